@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import contextlib
+import subprocess
+import multiprocessing
+import yaml
+import numpy as np
+from gen_trace import generate_trace
+
+# Peregrine benchmark suite.
+# Every stage runs in its own forked process (so its peak RSS is its own) on a synthetic trace
+# (see gen_trace.py), or on a given one, and reports:
+#   records     Records (packets, operations) processed.
+#   seconds     Time spent in the timed calls.
+#   rate        Records per second.
+#   batch       Records per timed call.
+#   latency_us  Latency percentiles of the timed calls (us): the latency of a record is the one
+#               of the call (batch) processing it.
+#   peak_rss_mb Peak RSS of the stage process.
+# The controller stages run on the records sent by the simulator for the trace (binary records,
+# see transport.py), with the trained models of the repository.
+
+BENCH_DIR   = os.path.dirname(os.path.abspath(__file__))
+DP_SIM      = os.path.join(BENCH_DIR, '..', 'dp-sim')
+ML_MODULE   = os.path.join(BENCH_DIR, '..', 'ml-module')
+COMMON      = os.path.join(BENCH_DIR, '..', 'common')
+
+STAGES = ['math_unit', 'fc_process', 'fc_process_batch', 'fc_process_numba', 'fc_process_workers',
+          'kitnet_execute', 'kitnet_execute_batch', 'peregrine_proc_next_packet',
+          'peregrine_proc_batch', 'end_to_end']
+
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+def percentiles(lat_ns):
+    lat_us = np.asarray(lat_ns, dtype=np.float64) / 1000
+    stats = {f'p{p:g}': float(np.percentile(lat_us, p)) for p in PERCENTILES}
+    stats['max'] = float(lat_us.max())
+    return stats
+
+
+# Stage result from the latencies (ns) of its timed calls, batch records each.
+def result(lat_ns, records, batch=1):
+    seconds = sum(lat_ns) / 1e9
+    return {'records':      records,
+            'seconds':      seconds,
+            'rate':         records / seconds if seconds > 0 else 0.0,
+            'batch':        batch,
+            'latency_us':   percentiles(lat_ns)}
+
+
+# Imports the dp-sim modules.
+def use_dp_sim():
+    sys.path.insert(0, DP_SIM)
+    sys.path.append(COMMON)
+
+
+# Imports the ml-module modules. The ml-module peregrine module has the same name as the dp-sim
+# entry point, so dp-sim and the ml-module are never imported by the same stage, except through
+# the dp-sim inproc transport (end_to_end).
+def use_ml_module():
+    sys.path.insert(0, ML_MODULE)
+    sys.path.append(COMMON)
+    os.chdir(ML_MODULE)
+
+
+def model_paths(args):
+    prefix = os.path.join(ML_MODULE, 'plugins', 'KitNET', 'models', args.model)
+    return prefix + '-fm.txt', prefix + '-el.txt', prefix + '-ol.txt', prefix + '-train-stats.txt'
+
+
+def dp_train_stats(args):
+    return os.path.join(DP_SIM, 'models', args.model + '-train-stats.txt')
+
+
+def build_peregrine(args):
+    from peregrine import Peregrine
+    return Peregrine(args.fm_grace, args.ad_grace, 10, 0.1, 0.75, 4, *model_paths(args), 'bench')
+
+
+# Controller records (see pipeline.decode_records) of the simulator record batches.
+def decode_payloads(payloads):
+    import pipeline
+    records = []
+    for payload in payloads:
+        records.extend(pipeline.decode_records(payload, 'record'))
+    return records
+
+
+# ----------------------------------------
+# Stages
+# ----------------------------------------
+
+def stage_math_unit(args, payloads):
+    use_dp_sim()
+    from fc_kitnet import sqr, sqrt_mu
+
+    values  = np.random.default_rng(args.seed).integers(0, 1 << 24, args.pkts).tolist()
+    lat     = []
+    for value in values:
+        start = time.perf_counter_ns()
+        sqr.compute(value)
+        sqrt_mu.compute(value)
+        lat.append(time.perf_counter_ns() - start)
+    return result(lat, 2 * len(values), 2)
+
+
+def stage_fc_process(args, payloads):
+    use_dp_sim()
+    from fc_kitnet import FCKitNET
+
+    fc  = FCKitNET(args.trace, 1, 0, dp_train_stats(args), 'pcap')
+    lat = []
+    while fc.has_next():
+        start = time.perf_counter_ns()
+        fc.feature_extract()
+        fc.process()
+        lat.append(time.perf_counter_ns() - start)
+    return result(lat, len(lat))
+
+
+def stage_fc_process_batch(args, payloads, engine='python', workers=0):
+    use_dp_sim()
+    from fc_kitnet import FCKitNET
+
+    fc      = FCKitNET(args.trace, 1, 0, dp_train_stats(args), 'pcap', engine, workers)
+    lat     = []
+    records = 0
+    while fc.has_next():
+        start   = time.perf_counter_ns()
+        cols    = fc.read_chunk(args.chunk)
+        fc.process_batch(cols)
+        lat.append(time.perf_counter_ns() - start)
+        records += len(cols['valid'])
+    fc.close()
+    return result(lat, records, args.chunk)
+
+
+# Compiled engine (see dp-sim fc_kernel.py), compiled when the simulator is built.
+def stage_fc_process_numba(args, payloads):
+    return stage_fc_process_batch(args, payloads, 'numba')
+
+
+# Flow-partitioned engine (see dp-sim fc_parallel.py), with --dp-workers processes.
+def stage_fc_process_workers(args, payloads):
+    return stage_fc_process_batch(args, payloads, 'numba', args.dp_workers)
+
+
+# KitNET inputs: the flow statistics of the records (see Peregrine.__update_stats__).
+def kitnet_inputs(args, payloads):
+    use_ml_module()
+    peregrine = build_peregrine(args)
+    return peregrine, np.array([peregrine.__update_stats__(r) for r in decode_payloads(payloads)])
+
+
+def stage_kitnet_execute(args, payloads):
+    peregrine, X = kitnet_inputs(args, payloads)
+
+    kitnet  = peregrine.AnomDetector
+    lat     = []
+    for x in X:
+        start = time.perf_counter_ns()
+        kitnet.execute(x)
+        lat.append(time.perf_counter_ns() - start)
+    return result(lat, len(X))
+
+
+def stage_kitnet_execute_batch(args, payloads):
+    peregrine, X = kitnet_inputs(args, payloads)
+
+    kitnet  = peregrine.AnomDetector
+    lat     = []
+    for i in range(0, len(X), args.batch):
+        start = time.perf_counter_ns()
+        kitnet.execute_batch(X[i:i + args.batch])
+        lat.append(time.perf_counter_ns() - start)
+    return result(lat, len(X), args.batch)
+
+
+def stage_peregrine_proc_next_packet(args, payloads):
+    use_ml_module()
+    records     = decode_payloads(payloads)
+    peregrine   = build_peregrine(args)
+
+    lat = []
+    for record in records:
+        start = time.perf_counter_ns()
+        peregrine.proc_next_packet(record)
+        lat.append(time.perf_counter_ns() - start)
+    return result(lat, len(records))
+
+
+def stage_peregrine_proc_batch(args, payloads):
+    use_ml_module()
+    records     = decode_payloads(payloads)
+    peregrine   = build_peregrine(args)
+
+    lat = []
+    for i in range(0, len(records), args.batch):
+        start = time.perf_counter_ns()
+        peregrine.proc_batch(records[i:i + args.batch])
+        lat.append(time.perf_counter_ns() - start)
+    return result(lat, len(records), args.batch)
+
+
+# Simulator -> controller in one process (inproc transport): batched feature computation, record
+# encoding and decoding, Peregrine and alerts. The latencies are the ones of the controller batches.
+def stage_end_to_end(args, payloads):
+    use_dp_sim()
+    import sender
+    from transport import InprocSender
+    from pipeline_kitnet import PipelineKitNET
+
+    sink, close = sender.inproc_sink(ml_conf(args))
+    lat         = []
+
+    def timed_sink(payload, ts):
+        start = time.perf_counter_ns()
+        sink(payload, ts)
+        lat.append(time.perf_counter_ns() - start)
+
+    pipeline    = PipelineKitNET('lo', args.trace, 1, 0, dp_train_stats(args), 'bench', 'bench',
+                                 'pcap', InprocSender(timed_sink, args.batch, close))
+    start       = time.perf_counter_ns()
+    pipeline.process_batch(args.chunk)
+    wall        = time.perf_counter_ns() - start
+
+    stats = result(lat, pipeline.sender.pkts_sent, args.batch)
+    stats['seconds']    = wall / 1e9
+    stats['rate']       = stats['records'] / stats['seconds']
+    return stats
+
+
+# Controller configuration of the end_to_end stage.
+def ml_conf(args):
+    fm, el, ol, train_stats = model_paths(args)
+    conf = {'fm_grace':     args.fm_grace,
+            'ad_grace':     args.ad_grace,
+            'max_ae':       10,
+            'fm_model':     fm,
+            'el_model':     el,
+            'ol_model':     ol,
+            'train_stats':  train_stats,
+            'thres':        os.path.join(os.path.dirname(fm), args.model + '-threshold.txt'),
+            'attack':       'bench',
+            'alert_path':   os.path.join(args.tmp, 'alerts.ndjson')}
+
+    path = os.path.join(args.tmp, 'ml.yml')
+    with open(path, 'w') as f:
+        yaml.dump(conf, f)
+    return path
+
+
+# Simulator record batches for the controller stages (see transport.InprocSender).
+def simulator_payloads(args):
+    use_dp_sim()
+    from transport import InprocSender
+    from pipeline_kitnet import PipelineKitNET
+
+    payloads = []
+    sender   = InprocSender(lambda payload, ts: payloads.append(payload), args.batch)
+    PipelineKitNET('lo', args.trace, 1, 0, dp_train_stats(args), 'bench', 'bench', 'pcap',
+                   sender).process_batch(args.chunk)
+    return payloads
+
+
+# Runs fn(args, *fn_args) in a forked process, with its output discarded unless verbose.
+# Returns the result of fn, with the peak RSS of the process for stages.
+def run_forked(fn, args, *fn_args):
+    ctx                 = multiprocessing.get_context('fork')
+    conn, child_conn    = ctx.Pipe()
+
+    def child():
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+            out = fn(args, *fn_args)
+        if isinstance(out, dict):
+            out['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        child_conn.send(out)
+
+    proc = ctx.Process(target=child)
+    proc.start()
+    child_conn.close()
+    try:
+        out = conn.recv()
+    except EOFError:
+        raise RuntimeError(f'{fn.__name__} failed (see the traceback above).') from None
+    finally:
+        proc.join()
+    return out
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    if baseline and baseline['meta']['trace'] != results['meta']['trace']:
+        print('Baseline run on a different trace:', baseline['meta']['trace'])
+    print(f'{"stage":<28} {"records":>9} {"rate (rec/s)":>13} {"batch":>6} {"p50 us":>10} '
+          f'{"p99 us":>10} {"max us":>10} {"rss MB":>8}' + ('  vs baseline' if baseline else ''))
+    for stage, res in results['stages'].items():
+        lat  = res['latency_us']
+        line = (f'{stage:<28} {res["records"]:>9} {res["rate"]:>13.0f} {res["batch"]:>6} '
+                f'{lat["p50"]:>10.1f} {lat["p99"]:>10.1f} {lat["max"]:>10.1f} '
+                f'{res["peak_rss_mb"]:>8.1f}')
+        if baseline and stage in baseline['stages']:
+            line += f'  {res["rate"] / baseline["stages"][stage]["rate"]:>10.2f}x'
+        print(line)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Peregrine benchmark suite.")
+    argparser.add_argument('--stages', type=str, default=','.join(STAGES),
+                           help='Comma-separated stages')
+    argparser.add_argument('--trace', type=str, help='Trace (pcap); synthetic trace if not set')
+    argparser.add_argument('--pkts', type=int, default=20000, help='Synthetic trace packets')
+    argparser.add_argument('--flows', type=int, default=1000, help='Synthetic trace benign flows')
+    argparser.add_argument('--zipf', type=float, default=1.1, help='Flow popularity Zipf exponent')
+    argparser.add_argument('--attack', type=float, default=0.1, help='Attack packet fraction')
+    argparser.add_argument('--attacks', type=str, default='ssdp,syn,scan', help='Attack types')
+    argparser.add_argument('--seed', type=int, default=0, help='Random seed')
+    argparser.add_argument('--model', type=str, default='ssdp-flood-m-10-r-0',
+                           help='Trained model name (models directories)')
+    argparser.add_argument('--fm-grace', type=int, default=5000, help='FM grace period')
+    argparser.add_argument('--ad-grace', type=int, default=50000, help='AD grace period')
+    argparser.add_argument('--chunk', type=int, default=1024, help='Simulator chunk size')
+    argparser.add_argument('--dp-workers', type=int, default=4,
+                           help='Simulator worker processes (fc_process_workers)')
+    argparser.add_argument('--batch', type=int, default=256, help='Controller batch size')
+    argparser.add_argument('-o', '--out', type=str, help='Results path (JSON)')
+    argparser.add_argument('--baseline', type=str, help='Previous results (JSON) to compare with')
+    argparser.add_argument('-v', '--verbose', action='store_true', help='Show the stage output')
+    args = argparser.parse_args()
+
+    stages = args.stages.split(',')
+    for stage in stages:
+        if stage not in STAGES:
+            argparser.error(f'unknown stage {stage} ({", ".join(STAGES)})')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        args.tmp    = tmp
+        trace = {'trace': args.trace}
+        if args.trace is None:
+            args.trace  = os.path.join(args.tmp, 'trace.pcap')
+            n_attack    = generate_trace(args.trace, args.pkts, args.flows, args.zipf, args.attack,
+                                         args.attacks.split(','), seed=args.seed)
+            trace       = {'pkts': args.pkts, 'flows': args.flows, 'zipf': args.zipf,
+                           'attack': args.attack, 'attacks': args.attacks, 'seed': args.seed,
+                           'attack_pkts': n_attack}
+
+        payloads = run_forked(simulator_payloads, args)
+
+        results = {'meta': {'time':         time.strftime('%Y-%m-%dT%H:%M:%S'),
+                            'commit':       git_commit(),
+                            'python':       platform.python_version(),
+                            'numpy':        np.__version__,
+                            'platform':     platform.platform(),
+                            'cpus':         os.cpu_count(),
+                            'model':        args.model,
+                            'chunk':        args.chunk,
+                            'dp_workers':   args.dp_workers,
+                            'batch':        args.batch,
+                            'trace':        trace},
+                   'stages': {}}
+
+        for stage in stages:
+            print(f'Running {stage}...', file=sys.stderr)
+            results['stages'][stage] = run_forked(globals()['stage_' + stage], args, payloads)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    print_results(results, baseline)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+import argparse
+import numpy as np
+
+# Synthetic trace generator.
+# Writes a reproducible pcap trace (same arguments and seed, same bytes) of benign flows and
+# attack traffic:
+#   benign  n_flows TCP/UDP/ICMP flows between clients and servers. Flow popularity follows a
+#           Zipf law of exponent zipf (0: uniform), each flow with its own mean packet size.
+#           A fraction reverse of the packets go from the server to the client. The IP sum of
+#           residual products of bidirectional flows quickly exceeds the 32-bit Peregrine header
+#           field it is sent in: like the data plane, only its low bits are then sent (see
+#           transport.wrap_fields).
+#   ssdp    SSDP reflection flood: UDP responses from port 1900 of many reflectors to the victim.
+#   syn     SYN flood: TCP packets to port 80 of the victim from spoofed sources.
+#   scan    TCP port scan of a server by a single host.
+# Attack packets make up a fraction attack of the packets after attack_start (fraction of the
+# trace), split evenly between the attack types.
+# Only the headers are captured (the original length is kept in the record and the IP header).
+
+ATTACKS = ['ssdp', 'syn', 'scan']
+
+SNAPLEN     = 54            # Ethernet + IPv4 + 20 bytes of L4 header.
+LINKTYPE    = 1             # Ethernet.
+TS_START    = 1600000000    # Timestamp of the first packet (s).
+
+PCAP_HDR = np.dtype([('magic', '<u4'), ('major', '<u2'), ('minor', '<u2'), ('zone', '<i4'),
+                     ('sigfigs', '<u4'), ('snaplen', '<u4'), ('linktype', '<u4')])
+
+# pcap record header followed by the captured frame.
+RECORD = np.dtype([('ts_sec', '<u4'), ('ts_usec', '<u4'), ('caplen', '<u4'), ('origlen', '<u4'),
+                   ('mac_dst_hi', '>u2'), ('mac_dst_lo', '>u4'),
+                   ('mac_src_hi', '>u2'), ('mac_src_lo', '>u4'), ('eth_type', '>u2'),
+                   ('ver_ihl', 'u1'), ('tos', 'u1'), ('ip_len', '>u2'), ('ip_id', '>u2'),
+                   ('frag', '>u2'), ('ttl', 'u1'), ('proto', 'u1'), ('ip_csum', '>u2'),
+                   ('ip_src', '>u4'), ('ip_dst', '>u4'),
+                   ('sport', '>u2'), ('dport', '>u2'), ('l4', 'V16')])
+
+CLIENT_NET  = 0xC0A80000    # 192.168.0.0/16
+SERVER_NET  = 0x0A000000    # 10.0.0.0/16
+VICTIM      = 0x0A00FFFE    # 10.0.255.254
+MAC_BASE    = 0x020000000000
+
+
+# Packet fields of the benign flows.
+def benign_packets(rng, n, n_flows, zipf, reverse):
+    n_clients   = max(n_flows // 8, 16)
+    n_servers   = max(n_flows // 32, 4)
+
+    client      = rng.integers(1, n_clients + 1, n_flows)
+    server      = rng.integers(1, n_servers + 1, n_flows)
+    proto       = rng.choice([6, 17, 1], n_flows, p=[0.6, 0.35, 0.05])
+    sport       = rng.integers(1024, 65536, n_flows)
+    dport       = rng.choice([80, 443, 53, 123, 22, 8080], n_flows)
+    size        = rng.integers(60, 1400, n_flows)
+
+    weights     = 1.0 / np.arange(1, n_flows + 1) ** zipf
+    flow        = rng.choice(n_flows, n, p=weights / weights.sum())
+    reverse     = rng.random(n) < reverse
+
+    ip_client   = CLIENT_NET + client[flow]
+    ip_server   = SERVER_NET + server[flow]
+    port_client = sport[flow]
+    port_server = dport[flow]
+    icmp        = proto[flow] == 1
+
+    # ICMP packets are echo requests (type 8, code 0 in place of the ports).
+    return {'mac_src':  MAC_BASE + np.where(reverse, 0x10000 + server[flow], client[flow]),
+            'ip_src':   np.where(reverse, ip_server, ip_client),
+            'ip_dst':   np.where(reverse, ip_client, ip_server),
+            'proto':    proto[flow],
+            'sport':    np.where(icmp, 0x0800, np.where(reverse, port_server, port_client)),
+            'dport':    np.where(icmp, 0, np.where(reverse, port_client, port_server)),
+            'ip_len':   np.clip(rng.normal(size[flow], size[flow] / 8), 40, 1500)}
+
+
+# Packet fields of an attack.
+def attack_packets(rng, n, attack):
+    if attack == 'ssdp':
+        reflector = rng.integers(1, 1024, n)
+        return {'mac_src':  np.full(n, MAC_BASE + 0xFFFF),
+                'ip_src':   0x64000000 + reflector * 97,
+                'ip_dst':   np.full(n, VICTIM),
+                'proto':    np.full(n, 17),
+                'sport':    np.full(n, 1900),
+                'dport':    rng.integers(1024, 65536, n),
+                'ip_len':   rng.integers(280, 400, n)}
+    if attack == 'syn':
+        return {'mac_src':  np.full(n, MAC_BASE + 0xFFFF),
+                'ip_src':   rng.integers(0x01000000, 0xDF000000, n),
+                'ip_dst':   np.full(n, VICTIM),
+                'proto':    np.full(n, 6),
+                'sport':    rng.integers(1024, 65536, n),
+                'dport':    np.full(n, 80),
+                'ip_len':   np.full(n, 40)}
+    if attack == 'scan':
+        return {'mac_src':  np.full(n, MAC_BASE + 0xFFFE),
+                'ip_src':   np.full(n, CLIENT_NET + 0xFFFE),
+                'ip_dst':   np.full(n, SERVER_NET + 1),
+                'proto':    np.full(n, 6),
+                'sport':    np.full(n, 40000),
+                'dport':    rng.integers(1, 1024, n),
+                'ip_len':   np.full(n, 44)}
+    raise ValueError(f'Unknown attack: {attack}')
+
+
+# Generates the trace at path. Returns the number of attack packets.
+def generate_trace(path, n_pkts, n_flows=1000, zipf=1.1, attack=0.0, attacks=('ssdp',),
+                   attack_start=0.5, pps=10000, reverse=0.0, seed=0):
+    rng     = np.random.default_rng(seed)
+    fields  = benign_packets(rng, n_pkts, n_flows, zipf, reverse)
+
+    # Attack packets replace benign ones after attack_start.
+    first       = int(n_pkts * attack_start)
+    is_attack   = np.zeros(n_pkts, dtype=bool)
+    is_attack[first:] = rng.random(n_pkts - first) < attack
+    attack_idx  = np.flatnonzero(is_attack)
+    attack_type = rng.integers(0, len(attacks), len(attack_idx))
+    for a, name in enumerate(attacks):
+        idx = attack_idx[attack_type == a]
+        for field, values in attack_packets(rng, len(idx), name).items():
+            fields[field][idx] = values
+
+    ts      = TS_START + np.cumsum(rng.exponential(1.0 / pps, n_pkts))
+    usec    = np.round(ts * 1e6).astype(np.int64)
+    ip_len  = fields['ip_len'].astype(np.int64)
+
+    records = np.zeros(n_pkts, dtype=RECORD)
+    records['ts_sec']       = usec // 1000000
+    records['ts_usec']      = usec % 1000000
+    records['caplen']       = SNAPLEN
+    records['origlen']      = 14 + ip_len
+    records['mac_dst_hi']   = MAC_BASE >> 32
+    records['mac_dst_lo']   = 1
+    records['mac_src_hi']   = fields['mac_src'] >> 32
+    records['mac_src_lo']   = fields['mac_src'] & 0xFFFFFFFF
+    records['eth_type']     = 0x0800
+    records['ver_ihl']      = 0x45
+    records['ip_len']       = ip_len
+    records['ip_id']        = np.arange(n_pkts) & 0xFFFF
+    records['ttl']          = 64
+    records['proto']        = fields['proto']
+    records['ip_src']       = fields['ip_src']
+    records['ip_dst']       = fields['ip_dst']
+    records['sport']        = fields['sport']
+    records['dport']        = fields['dport']
+
+    hdr = np.zeros(1, dtype=PCAP_HDR)
+    hdr['magic']    = 0xA1B2C3D4
+    hdr['major']    = 2
+    hdr['minor']    = 4
+    hdr['snaplen']  = SNAPLEN
+    hdr['linktype'] = LINKTYPE
+
+    with open(path, 'wb') as f:
+        f.write(hdr.tobytes())
+        f.write(records.tobytes())
+
+    return len(attack_idx)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Peregrine synthetic trace generator.")
+    argparser.add_argument('-o', '--out', type=str, required=True, help='Trace path (pcap)')
+    argparser.add_argument('--pkts', type=int, default=100000, help='Packets')
+    argparser.add_argument('--flows', type=int, default=1000, help='Benign flows')
+    argparser.add_argument('--zipf', type=float, default=1.1, help='Flow popularity Zipf exponent')
+    argparser.add_argument('--attack', type=float, default=0.1,
+                           help='Fraction of attack packets after --attack-start')
+    argparser.add_argument('--attacks', type=str, default='ssdp',
+                           help=f'Comma-separated attack types ({", ".join(ATTACKS)})')
+    argparser.add_argument('--attack-start', type=float, default=0.5,
+                           help='Start of the attack (fraction of the trace)')
+    argparser.add_argument('--pps', type=float, default=10000, help='Average packet rate')
+    argparser.add_argument('--reverse', type=float, default=0.0,
+                           help='Fraction of server to client packets')
+    argparser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = argparser.parse_args()
+
+    n_attack = generate_trace(args.out, args.pkts, args.flows, args.zipf, args.attack,
+                              args.attacks.split(','), args.attack_start, args.pps, args.reverse,
+                              args.seed)
+
+    print(f'Trace: {args.out}, {args.pkts} packets, {args.flows} benign flows, '
+          f'{n_attack} attack packets')
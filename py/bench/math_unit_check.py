@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import random
+import argparse
+import numpy as np
+
+# Equivalence check of the MathUnit table fast path (compute, compute_array) against the
+# step-by-step emulation (emulate), for the math units of the simulator (sqr, sqrt) and other
+# shift/invert/size configurations.
+# Arguments below 2^--exhaustive-bits are all checked. Above, the check is stratified on what the
+# table is indexed by: for every bit length up to 79 (above 63 bits, the fallback to emulate) and
+# every 4 most significant bits, the lowest and highest arguments of the stratum and --samples
+# random ones.
+# Exits with status 1 on any mismatch.
+
+BENCH_DIR   = os.path.dirname(os.path.abspath(__file__))
+DP_SIM      = os.path.join(BENCH_DIR, '..', 'dp-sim')
+COMMON      = os.path.join(BENCH_DIR, '..', 'common')
+
+sys.path.insert(0, DP_SIM)
+sys.path.append(COMMON)
+
+from math_unit import MathUnit
+from fc_kitnet import sqr, sqrt_mu
+
+MAX_BITS = 79
+
+# Other configurations: (shift, invert, scale, size), with the identity lookup table.
+CONFIGS = [(0, False, -3, 32), (0, True, 20, 16), (-1, True, 10, 8), (1, False, 0, 32)]
+
+
+def math_units():
+    units = {'sqr': sqr, 'sqrt': sqrt_mu}
+    for shift, invert, scale, size in CONFIGS:
+        name = f'shift={shift},invert={invert},scale={scale},size={size}'
+        units[name] = MathUnit(shift=shift, invert=invert, scale=scale,
+                               lookup=list(range(15, -1, -1)), size=size)
+    return units
+
+
+# Stratified arguments of the given bit length: (lowest, highest, random) for each mantissa.
+def stratum_args(bits, samples, rng):
+    args = []
+    for mantissa in range(8, 16):
+        lo = mantissa << (bits - 4)
+        hi = lo | ((1 << (bits - 4)) - 1)
+        args += [lo, hi] + [rng.randint(lo, hi) for _ in range(samples)]
+    return args
+
+
+# Arguments checked, split into int64 (array) and larger (object array) ones.
+def check_args(exhaustive_bits, samples, seed):
+    rng     = random.Random(seed)
+    args    = list(range(1 << exhaustive_bits))
+    for bits in range(max(exhaustive_bits, 4) + 1, MAX_BITS + 1):
+        args += stratum_args(bits, samples, rng)
+
+    small = [arg for arg in args if arg <= np.iinfo(np.int64).max]
+    large = [arg for arg in args if arg > np.iinfo(np.int64).max]
+    return small, large
+
+
+# Mismatches of compute and compute_array with emulate: (function, argument, result, expected).
+def check_unit(unit, small, large):
+    mismatches = []
+
+    expected = [unit.emulate(arg) for arg in small + large]
+    for arg, exp in zip(small + large, expected):
+        res = unit.compute(arg)
+        if res != exp:
+            mismatches.append(('compute', arg, res, exp))
+
+    results = unit.compute_array(np.array(small, dtype=np.int64)).tolist() + \
+              unit.compute_array(np.array(large, dtype=object)).tolist()
+    for arg, res, exp in zip(small + large, results, expected):
+        if res != exp:
+            mismatches.append(('compute_array', arg, res, exp))
+
+    return len(expected), mismatches
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="MathUnit fast path equivalence check.")
+    argparser.add_argument('--exhaustive-bits', type=int, default=20,
+                           help='Arguments below 2^N are all checked')
+    argparser.add_argument('--samples', type=int, default=16,
+                           help='Random arguments per bit length and mantissa')
+    argparser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = argparser.parse_args()
+
+    small, large = check_args(args.exhaustive_bits, args.samples, args.seed)
+
+    failed = False
+    for name, unit in math_units().items():
+        checked, mismatches = check_unit(unit, small, large)
+        print(f'{name}: {checked} arguments, {len(mismatches)} mismatches')
+        for func, arg, res, exp in mismatches[:10]:
+            print(f'  {func}({arg}) = {res}, emulate: {exp}')
+        failed = failed or len(mismatches) > 0
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Cold start check of the entry points: controller.py (ml-module) and peregrine.py (dp-sim).
+# Each entry point is imported in a fresh interpreter with python -X importtime, and the report
+# gives its import time with the slowest top-level packages (self time of all their modules).
+# The check fails (exit status 1) if an import takes more than the budget, or if it loads one of
+# the modules that are only imported on the code paths that need them (LAZY): scapy (scapy
+# decoder and sender), pandas (csv traces, stats export), scipy.stats and scipy.cluster (KitNET
+# feature mapping) and numba (compiled simulator engine).
+# Times are the best of --repeat runs; -X importtime itself adds some overhead.
+
+BENCH_DIR   = os.path.dirname(os.path.abspath(__file__))
+DP_SIM      = os.path.join(BENCH_DIR, '..', 'dp-sim')
+ML_MODULE   = os.path.join(BENCH_DIR, '..', 'ml-module')
+
+ENTRY_POINTS = {'controller':   (ML_MODULE, 'controller'),
+                'simulator':    (DP_SIM, 'peregrine')}
+
+LAZY = ['scapy', 'pandas', 'scipy.stats', 'scipy.cluster', 'numba']
+
+BUDGET_MS = 1000
+
+
+# Imports module from directory with -X importtime. Returns (total us, {module: self us}).
+def import_time(directory, module):
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=directory, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{proc.stderr}')
+
+    total   = 0
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        modules[name] = int(self_us)
+        if name == module:
+            total = int(cumulative_us)
+
+    return total, modules
+
+
+def lazily_loaded(modules):
+    return sorted(name for name in modules
+                  if any(name == lazy or name.startswith(lazy + '.') for lazy in LAZY))
+
+
+def measure(entry, repeat):
+    directory, module = ENTRY_POINTS[entry]
+    total, modules = min((import_time(directory, module) for _ in range(repeat)),
+                         key=lambda run: run[0])
+
+    packages = {}
+    for name, self_us in modules.items():
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+
+    return {'module':   module,
+            'ms':       total / 1000,
+            'packages': {package: us / 1000 for package, us in
+                         sorted(packages.items(), key=lambda item: -item[1])},
+            'lazy':     lazily_loaded(modules)}
+
+
+def print_report(results, top):
+    for entry, res in results.items():
+        print(f'{entry} (import {res["module"]}): {res["ms"]:.1f} ms')
+        for package, ms in list(res['packages'].items())[:top]:
+            print(f'  {package:<32} {ms:>8.1f} ms')
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Peregrine entry point import times.")
+    argparser.add_argument('--entries', type=str, default=','.join(ENTRY_POINTS),
+                           help='Comma-separated entry points')
+    argparser.add_argument('--budget', type=float, default=BUDGET_MS,
+                           help='Import time budget of each entry point (ms, 0: no budget)')
+    argparser.add_argument('--repeat', type=int, default=3, help='Runs per entry point')
+    argparser.add_argument('--top', type=int, default=10, help='Packages shown per entry point')
+    argparser.add_argument('-o', '--out', type=str, help='Results path (JSON)')
+    args = argparser.parse_args()
+
+    entries = args.entries.split(',')
+    for entry in entries:
+        if entry not in ENTRY_POINTS:
+            argparser.error(f'unknown entry point {entry} ({", ".join(ENTRY_POINTS)})')
+
+    results = {entry: measure(entry, args.repeat) for entry in entries}
+    print_report(results, args.top)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failures = []
+    for entry, res in results.items():
+        if args.budget > 0 and res['ms'] > args.budget:
+            failures.append(f'{entry}: import takes {res["ms"]:.1f} ms (budget {args.budget:g} ms)')
+        if res['lazy']:
+            failures.append(f'{entry}: loads {", ".join(res["lazy"])} at import')
+
+    for failure in failures:
+        print('FAIL', failure)
+    sys.exit(1 if failures else 0)
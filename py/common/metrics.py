@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Low-overhead metrics of the processing stages.
+# Every stage records the duration (ns, from time.perf_counter_ns) of its calls and the number of
+# records they processed. Durations go into log2 buckets (bucket k: below 2**k ns), so an
+# observation is an int.bit_length() and a few additions, cheap enough to stay on.
+# Gauges are read from callbacks when the metrics are exported. Stages never called (e.g. shards
+# without workers) are not exported.
+# The metrics are exposed through a local HTTP endpoint (Prometheus text format on /metrics, JSON
+# on /metrics.json) and periodically dumped as JSON (see MetricsExporter).
+# The same module is used by dp-sim and the ml-module (py/common), with a single registry,
+# METRICS, per process.
+
+BUCKETS     = 64            # bit_length of a duration (ns), up to 63.
+EXPORTED    = range(10, 36) # Buckets exported to Prometheus: 1 us to 34 s (then +Inf).
+PREFIX      = 'peregrine'
+
+
+class Stage:
+    def __init__(self, name):
+        self.name       = name
+        self.buckets    = [0] * BUCKETS     # Calls per duration bucket.
+        self.records    = 0                 # Records processed.
+        self.sum_ns     = 0                 # Total duration.
+
+    # Records a call of duration_ns processing records records.
+    # Kept to three increments: the call count is the sum of the buckets.
+    def observe(self, duration_ns, records=1):
+        self.buckets[duration_ns.bit_length()] += 1
+        self.records    += records
+        self.sum_ns     += duration_ns
+
+    def count(self):
+        return sum(self.buckets)
+
+    # Duration percentile (ns), as the upper bound of its bucket.
+    def percentile(self, p):
+        rank = p / 100 * self.count()
+        seen = 0
+        for k, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return 1 << k
+        return 0
+
+    def to_dict(self):
+        return {'count':    self.count(),
+                'records':  self.records,
+                'seconds':  self.sum_ns / 1e9,
+                'p50_us':   self.percentile(50) / 1000,
+                'p99_us':   self.percentile(99) / 1000,
+                'buckets':  self.buckets}
+
+
+class Metrics:
+    def __init__(self):
+        self.stages = {}
+        self.gauges = {}    # name -> (help, callback)
+
+    # The stage called name (created on first use).
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = Stage(name)
+        return self.stages[name]
+
+    # Registers a gauge, read from callback(): a number, or a dict of numbers (one per key label).
+    def gauge(self, name, help_text, callback):
+        self.gauges[name] = (help_text, callback)
+
+    def __gauge_values__(self):
+        values = {}
+        for name, (_, callback) in list(self.gauges.items()):
+            try:
+                values[name] = callback()
+            except Exception:
+                continue
+        return values
+
+    def to_dict(self):
+        return {'time':     time.time(),
+                'stages':   {name: stage.to_dict() for name, stage in list(self.stages.items())
+                             if stage.records or stage.sum_ns},
+                'gauges':   self.__gauge_values__()}
+
+    # Prometheus text exposition format.
+    def prometheus(self):
+        lines = [f'# HELP {PREFIX}_stage_seconds Duration of the calls of each processing stage.',
+                 f'# TYPE {PREFIX}_stage_seconds histogram']
+        stages = [stage for stage in list(self.stages.values()) if stage.records or stage.sum_ns]
+        for stage in stages:
+            label   = f'stage="{stage.name}"'
+            buckets = list(stage.buckets)
+            count   = sum(buckets)
+            for k in EXPORTED:
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{{label},le="{(1 << k) / 1e9:g}"}} '
+                             f'{sum(buckets[:k + 1])}')
+            lines.append(f'{PREFIX}_stage_seconds_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f'{PREFIX}_stage_seconds_sum{{{label}}} {stage.sum_ns / 1e9}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{{label}}} {count}')
+
+        lines += [f'# HELP {PREFIX}_stage_records_total Records processed by each processing stage.',
+                  f'# TYPE {PREFIX}_stage_records_total counter']
+        for stage in stages:
+            lines.append(f'{PREFIX}_stage_records_total{{stage="{stage.name}"}} {stage.records}')
+
+        for name, value in self.__gauge_values__().items():
+            lines += [f'# HELP {PREFIX}_{name} {self.gauges[name][0]}',
+                      f'# TYPE {PREFIX}_{name} gauge']
+            if isinstance(value, dict):
+                lines += [f'{PREFIX}_{name}{{key="{key}"}} {val}' for key, val in value.items()]
+            else:
+                lines.append(f'{PREFIX}_{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+class MetricsExporter:
+    # Serves the metrics on host:port (port 0: no endpoint) and dumps them as JSON to dump_path
+    # every interval seconds (empty path: no dump), from background threads.
+    def __init__(self, metrics=METRICS, port=0, host='127.0.0.1', dump_path=None, interval=10):
+        self.metrics    = metrics
+        self.dump_path  = dump_path
+        self.interval   = interval
+        self.server     = None
+        self.stopped    = threading.Event()
+        self.threads    = []
+
+        if port > 0:
+            self.server = ThreadingHTTPServer((host, port), self.__handler__())
+            self.server.daemon_threads = True
+            self.threads.append(threading.Thread(target=self.server.serve_forever, daemon=True))
+        if dump_path and interval > 0:
+            self.threads.append(threading.Thread(target=self.__run_dump__, daemon=True))
+
+        for thread in self.threads:
+            thread.start()
+
+    def __handler__(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = metrics.prometheus(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(metrics.to_dict()), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __run_dump__(self):
+        while not self.stopped.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        tmp = self.dump_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.metrics.to_dict(), f)
+        os.replace(tmp, self.dump_path)
+
+    # Stops the endpoint, with a last dump.
+    def close(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.dump_path:
+            self.dump()
+
+
+# Builds the metrics exporter of a configuration (metrics_port, metrics_dump, metrics_interval).
+def open_metrics_exporter(conf):
+    return MetricsExporter(METRICS, conf.get('metrics_port', 0), '127.0.0.1',
+                           conf.get('metrics_dump'), conf.get('metrics_interval', 10))
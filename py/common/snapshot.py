@@ -0,0 +1,115 @@
+import os
+import time
+import numpy as np
+
+# Periodic state snapshots, written without blocking the processing loop.
+# A snapshot is taken by forking: the child process gets a copy-on-write view of the parent
+# memory, collects the state arrays and writes them as an uncompressed .npz, while the parent
+# goes on right after the fork (its pause does not depend on the size of the state). Snapshots
+# are written to a temporary file and then renamed, so the snapshot on disk is always complete.
+# Only one snapshot is written at a time: a snapshot due while the previous one is still being
+# written is skipped.
+# The same module is used by dp-sim and the ml-module (py/common).
+
+
+class Snapshotter:
+    # path: snapshot file (.npz).
+    # interval: time (s) between two snapshots (0: only the final one, on close).
+    # collect: returns the dict of state arrays to write (called in the child process).
+    # prepare: called before each snapshot, in this process (e.g. to gather state kept by other
+    # processes), or None.
+    def __init__(self, path, interval, collect, prepare=None):
+        self.path       = path
+        self.interval   = interval
+        self.collect    = collect
+        self.prepare    = prepare
+        self.last       = time.monotonic()
+        self.child      = None      # pid of the child writing the current snapshot
+        self.child_time = 0.0       # start time of the current snapshot
+
+        # Metrics.
+        self.taken      = 0
+        self.written    = 0
+        self.skipped    = 0
+        self.failed     = 0
+        self.pause      = 0.0       # fork time (processing pause) of the last snapshot
+        self.duration   = 0.0       # write time of the last snapshot
+
+    # Takes a snapshot if interval seconds have passed since the last one.
+    # Called from the processing loop, between two batches.
+    def tick(self):
+        if self.child is not None:
+            self.__reap__(False)
+        if self.interval <= 0 or time.monotonic() - self.last < self.interval:
+            return
+
+        self.last = time.monotonic()
+        if self.child is not None:
+            self.skipped += 1
+            return
+
+        start   = time.monotonic()
+        if self.prepare is not None:
+            self.prepare()
+        pid     = os.fork()
+        if pid == 0:
+            # Child: write the snapshot and exit, without running the cleanup of the parent.
+            status = 1
+            try:
+                write_snapshot(self.path, self.collect())
+                status = 0
+            finally:
+                os._exit(status)
+
+        self.child      = pid
+        self.child_time = start
+        self.taken      += 1
+        self.pause      = time.monotonic() - start
+
+    # Collects the child writing the current snapshot, if done (or waits for it if block).
+    def __reap__(self, block):
+        pid, status = os.waitpid(self.child, 0 if block else os.WNOHANG)
+        if pid == 0:
+            return
+
+        if status == 0:
+            self.written += 1
+        else:
+            self.failed += 1
+        self.duration   = time.monotonic() - self.child_time
+        self.child      = None
+
+    # Waits for the pending snapshot, then writes the final one (in this process).
+    def close(self):
+        if self.child is not None:
+            self.__reap__(True)
+
+        start = time.monotonic()
+        if self.prepare is not None:
+            self.prepare()
+        write_snapshot(self.path, self.collect())
+        self.taken      += 1
+        self.written    += 1
+        self.duration   = time.monotonic() - start
+
+    def stats(self):
+        return {'taken':    self.taken,
+                'written':  self.written,
+                'skipped':  self.skipped,
+                'failed':   self.failed,
+                'pause':    self.pause,
+                'duration': self.duration}
+
+
+def write_snapshot(path, arrays):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+
+# Opens a snapshot (NpzFile, to be closed by the caller), or returns None if there is none.
+def load_snapshot(path):
+    if not path or not os.path.exists(path):
+        return None
+    return np.load(path, allow_pickle=False)
@@ -0,0 +1,351 @@
+import os
+import time
+import select
+import socket
+import struct
+from multiprocessing import shared_memory, resource_tracker
+
+# Transports between the data plane simulator (dp-sim) and the controller (ml-module) that
+# skip the veth pair. Records are exchanged in a fixed binary layout: the packet timestamp (trace
+# time), the flow header and the Peregrine header fields in wire order (see
+# peregrine_header.PeregrineHdr).
+# Records are sent in batches: a batch is the concatenation of its records.
+#
+#   unix    UNIX domain socket (SOCK_SEQPACKET, one message per batch).
+#   shm     Shared memory ring buffer, single producer / single consumer.
+#   inproc  Direct call of a sink function in the same process.
+#
+# The same module is used by dp-sim and the ml-module (py/common).
+
+# ts, mac_src, ip_src, ip_dst, proto, sport, dport, Peregrine header.
+RECORD = struct.Struct('!dQIIBHH17I4Q')
+
+TRANSPORTS = ['unix', 'shm', 'inproc']
+
+# Peregrine header field masks: like the data plane, only the low bits of the values wider than
+# their field are sent.
+HDR_MASKS = [(1 << 32) - 1] * 17 + [(1 << 64) - 1] * 4
+
+# Shared memory ring header: head (records written), tail (records read), closed flag,
+# capacity (records). Each counter sits on its own cache line.
+SHM_HDR         = 256
+SHM_HEAD        = 0
+SHM_TAIL        = 64
+SHM_CLOSED      = 128
+SHM_CAPACITY    = 192
+SHM_U64         = struct.Struct('=Q')
+
+
+# Peregrine header fields of a record, truncated to their width.
+def wrap_fields(stats):
+    return [int(value) & mask for value, mask in zip(stats, HDR_MASKS)]
+
+
+# Packs a dp-sim feature record (see PipelineKitNET.send_peregrine_pkt) at offset off of buf.
+def pack_record(buf, off, cur_stats):
+    ip_src  = struct.unpack('!I', socket.inet_aton(cur_stats[2]))[0]
+    ip_dst  = struct.unpack('!I', socket.inet_aton(cur_stats[3]))[0]
+    header  = (int(cur_stats[1].replace(':', ''), 16), ip_src, ip_dst,
+               int(cur_stats[4]), int(cur_stats[5]), int(cur_stats[6]))
+    ts      = float(cur_stats[0])
+    try:
+        RECORD.pack_into(buf, off, ts, *header, *cur_stats[7:28])
+    except struct.error:
+        RECORD.pack_into(buf, off, ts, *header, *wrap_fields(cur_stats[7:28]))
+
+
+class RecordSender:
+    # Serializes records into a batch buffer and hands full batches over to send_batch().
+    def __init__(self, batch_size=256):
+        self.batch_size = batch_size
+        self.buf        = bytearray(batch_size * RECORD.size)
+        self.buf_view   = memoryview(self.buf)
+        self.pending    = 0
+
+        # Send counters.
+        self.pkts_sent  = 0
+        self.batches    = 0
+        self.time_first = None
+        self.time_last  = None
+
+    def send(self, cur_stats):
+        if self.time_first is None:
+            self.time_first = time.time()
+
+        pack_record(self.buf, self.pending * RECORD.size, cur_stats)
+        self.pending += 1
+        if self.pending == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        n = self.pending
+        if n == 0:
+            return
+
+        self.send_batch(self.buf_view[:n * RECORD.size])
+
+        self.pending    = 0
+        self.pkts_sent  += n
+        self.batches    += 1
+        self.time_last  = time.time()
+
+    def send_batch(self, payload):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+    def stats(self):
+        elapsed = (self.time_last - self.time_first) if self.time_last is not None else 0
+        return {'sent':     self.pkts_sent,
+                'batches':  self.batches,
+                'elapsed':  elapsed,
+                'pps':      self.pkts_sent / elapsed if elapsed > 0 else 0.0}
+
+
+class RecordReceiver:
+    # Same consumer interface as capture.PacketCapture: next_batch() returns a
+    # (payload, ts_first) tuple, or None once the sender closed or after timeout seconds
+    # without any batch.
+    def __init__(self, batch_size=256, timeout=60):
+        self.batch_size = batch_size
+        self.timeout    = timeout
+
+        # Receive counters.
+        self.pkts_recv  = 0
+        self.batches    = 0
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def next_batch(self):
+        payload = self.recv_batch()
+        if not payload:
+            return None
+
+        self.pkts_recv  += len(payload) // RECORD.size
+        self.batches    += 1
+        return payload, time.time()
+
+    def recv_batch(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {'recv':     self.pkts_recv,
+                'kernel':   self.pkts_recv,
+                'dropped':  0,
+                'batches':  self.batches}
+
+
+class UnixSender(RecordSender):
+    def __init__(self, path, batch_size=256, timeout=60):
+        super().__init__(batch_size)
+
+        # Wait for the controller to listen.
+        self.sock   = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        deadline    = time.time() + timeout
+        while True:
+            try:
+                self.sock.connect(path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, len(self.buf) * 4)
+
+    def send_batch(self, payload):
+        self.sock.sendall(payload)
+
+    def close(self):
+        self.flush()
+        self.sock.close()
+
+
+class UnixReceiver(RecordReceiver):
+    def __init__(self, path, batch_size=256, timeout=60):
+        super().__init__(batch_size, timeout)
+        self.path = path
+        self.conn = None
+
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.sock.bind(path)
+        self.sock.listen(1)
+
+    def recv_batch(self):
+        if self.conn is None:
+            readable, _, _ = select.select([self.sock], [], [], self.timeout)
+            if not readable:
+                return None
+            self.conn, _ = self.sock.accept()
+            self.conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 24)
+
+        readable, _, _ = select.select([self.conn], [], [], self.timeout)
+        if not readable:
+            return None
+        # Batches larger than batch_size records are received whole as well.
+        return self.conn.recv(max(self.batch_size, 1 << 12) * RECORD.size)
+
+    def stop(self):
+        if self.conn is not None:
+            self.conn.close()
+        self.sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class ShmSender(RecordSender):
+    def __init__(self, name, batch_size=256, timeout=60):
+        super().__init__(batch_size)
+
+        # Wait for the controller to create the ring.
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name)
+                break
+            except FileNotFoundError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+        # The ring is owned (and unlinked) by the controller.
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+
+        self.ring       = self.shm.buf
+        self.capacity   = SHM_U64.unpack_from(self.ring, SHM_CAPACITY)[0]
+        self.head       = SHM_U64.unpack_from(self.ring, SHM_HEAD)[0]
+        self.timeout    = timeout
+
+    # Records are written as soon as slots are free, so batches larger than the ring are
+    # written in parts.
+    def send_batch(self, payload):
+        n       = len(payload) // RECORD.size
+        written = 0
+        while written < n:
+            count = min(n - written, self.__wait_free__())
+            self.__write__(payload[written * RECORD.size:(written + count) * RECORD.size], count)
+            written += count
+
+    # Waits for free slots (at most timeout seconds, e.g. if the controller died) and returns
+    # their number.
+    def __wait_free__(self):
+        deadline = time.time() + self.timeout
+        while True:
+            free = self.capacity - (self.head - SHM_U64.unpack_from(self.ring, SHM_TAIL)[0])
+            if free > 0:
+                return free
+            if time.time() > deadline:
+                raise TimeoutError(f'Shared memory ring full for {self.timeout} s')
+            time.sleep(0.0001)
+
+    # Copies n records (wrapping around the end of the ring), then publishes them.
+    def __write__(self, payload, n):
+        slot    = self.head % self.capacity
+        first   = min(n, self.capacity - slot)
+        start   = SHM_HDR + slot * RECORD.size
+        self.ring[start:start + first * RECORD.size] = payload[:first * RECORD.size]
+        if first < n:
+            self.ring[SHM_HDR:SHM_HDR + (n - first) * RECORD.size] = payload[first * RECORD.size:]
+
+        self.head += n
+        SHM_U64.pack_into(self.ring, SHM_HEAD, self.head)
+
+    def close(self):
+        self.flush()
+        SHM_U64.pack_into(self.ring, SHM_CLOSED, 1)
+        self.ring.release()
+        self.shm.close()
+
+
+class ShmReceiver(RecordReceiver):
+    def __init__(self, name, batch_size=256, timeout=60, capacity=1 << 16):
+        super().__init__(batch_size, timeout)
+        self.capacity = capacity
+
+        try:
+            shared_memory.SharedMemory(name=name).unlink()
+        except FileNotFoundError:
+            pass
+        self.shm    = shared_memory.SharedMemory(name=name, create=True,
+                                                 size=SHM_HDR + capacity * RECORD.size)
+        self.ring   = self.shm.buf
+        self.tail   = 0
+
+        self.ring[:SHM_HDR] = bytes(SHM_HDR)
+        SHM_U64.pack_into(self.ring, SHM_CAPACITY, capacity)
+
+    def recv_batch(self):
+        # Poll the ring, backing off up to 1 ms between checks.
+        deadline    = time.time() + self.timeout
+        wait        = 0.00001
+        while True:
+            head = SHM_U64.unpack_from(self.ring, SHM_HEAD)[0]
+            if head > self.tail:
+                break
+            if SHM_U64.unpack_from(self.ring, SHM_CLOSED)[0]:
+                # The last records may have been published after head was read.
+                head = SHM_U64.unpack_from(self.ring, SHM_HEAD)[0]
+                if head > self.tail:
+                    break
+                return None
+            if time.time() > deadline:
+                return None
+            time.sleep(wait)
+            wait = min(2 * wait, 0.001)
+
+        n       = min(head - self.tail, self.batch_size)
+        slot    = self.tail % self.capacity
+        first   = min(n, self.capacity - slot)
+        start   = SHM_HDR + slot * RECORD.size
+        payload = bytes(self.ring[start:start + first * RECORD.size])
+        if first < n:
+            payload += bytes(self.ring[SHM_HDR:SHM_HDR + (n - first) * RECORD.size])
+
+        self.tail += n
+        SHM_U64.pack_into(self.ring, SHM_TAIL, self.tail)
+
+        return payload
+
+    def stop(self):
+        self.ring.release()
+        self.shm.close()
+        self.shm.unlink()
+
+
+class InprocSender(RecordSender):
+    # Calls sink(payload, ts) for every batch, in the sending process, and on_close() (if not None)
+    # once the last batch is sent.
+    def __init__(self, sink, batch_size=256, on_close=None):
+        super().__init__(batch_size)
+        self.sink       = sink
+        self.on_close   = on_close
+
+    def send_batch(self, payload):
+        self.sink(bytes(payload), time.time())
+
+    def close(self):
+        self.flush()
+        if self.on_close is not None:
+            self.on_close()
+
+
+def open_sender(transport, addr, batch_size=256, timeout=60):
+    if transport == 'unix':
+        return UnixSender(addr, batch_size, timeout)
+    if transport == 'shm':
+        return ShmSender(addr, batch_size, timeout)
+    raise ValueError(f'Unknown transport: {transport}')
+
+
+def open_receiver(transport, addr, batch_size=256, timeout=60):
+    if transport == 'unix':
+        return UnixReceiver(addr, batch_size, timeout)
+    if transport == 'shm':
+        return ShmReceiver(addr, batch_size, timeout)
+    raise ValueError(f'Unknown transport: {transport}')
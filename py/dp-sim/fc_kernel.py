@@ -0,0 +1,385 @@
+import math
+import numpy as np
+from register_file import RegisterFile
+
+# Compiled engine of FCKitNET.process_batch (engine: numba).
+# The decay checks, register updates and residual products depend on the previous packets of the
+# same slots, so they cannot be vectorized. This kernel runs them, followed by the 1D/2D
+# statistics and the math unit lookups, for a whole chunk of packets in a single call, directly
+# on the structured register arrays (see register_file.py). It follows the per-packet path
+# operation by operation (same integer shifts, float decay factors and math unit tables), so its
+# output and register state are bit-exact with process() and the Python process_batch().
+# Numba is optional: without it, FCKitNET keeps the Python implementation.
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+AVAILABLE = njit is not None
+
+
+def jit(fn):
+    return njit(cache=True, nogil=True)(fn) if AVAILABLE else fn
+
+
+# int.bit_length of a non-negative integer (exact through the float exponent below 2**53).
+@jit
+def bit_length(n):
+    if n < (1 << 53):
+        return math.frexp(float(n))[1]
+    bits = 53
+    while n >> bits:
+        bits += 1
+    return bits
+
+
+# FCKitNET.pow_2: int(log(n, 2)) for n > 1 (the bit length minus one below 2**47).
+@jit
+def pow_2(n):
+    if n <= 1:
+        return 0
+    if n < (1 << 47):
+        return bit_length(n) - 1
+    return int(math.log(n) / math.log(2.0))
+
+
+# MathUnit.compute, from its table (MathUnit.table_array).
+@jit
+def math_unit(table, arg):
+    if arg < 0:
+        raise ValueError('Negative math unit argument.')
+    if arg < 16:
+        return table[arg]
+    bits = bit_length(arg)
+    return table[bits * 16 + (arg >> (bits - 4))]
+
+
+# FCKitNET.decay_check_1d.
+@jit
+def decay_check_1d(regs, slot, ts, pkt_len, interval, sqr_table):
+    reg = regs[slot]
+
+    if reg['valid']:
+        if reg['ts'] and ts - reg['ts'] > interval:
+            reg['ts']       += interval
+            reg['pkt_cnt']  = np.int64(0.5 * reg['pkt_cnt'] + 1)
+            reg['pkt_len']  = np.int64(0.5 * reg['pkt_len'])
+            reg['ss']       = np.int64(0.5 * reg['ss'])
+        else:
+            reg['ts']       = ts
+            reg['pkt_cnt']  += 1
+            reg['pkt_len']  += pkt_len
+            reg['ss']       += math_unit(sqr_table, pkt_len)
+    else:
+        reg['valid']    = True
+        reg['ts']       = ts
+        reg['pkt_cnt']  = 1
+        reg['pkt_len']  = pkt_len
+        reg['ss']       = math_unit(sqr_table, pkt_len)
+
+
+# Result of the decay check of a 2D flow slot.
+SLOT_INIT       = 0     # Slot initialized by the packet.
+SLOT_UPDATE     = 1     # Counters updated.
+SLOT_DECAY      = 2     # Counters decayed.
+
+
+# Flow slot part of FCKitNET.decay_check_2d. Returns SLOT_INIT, SLOT_UPDATE or SLOT_DECAY.
+@jit
+def decay_check_flow(regs, slot, ts, pkt_len, interval, sqr_table):
+    reg = regs[slot]
+
+    if reg['valid']:
+        if reg['ts'] and ts - reg['ts'] > interval:
+            reg['ts']       += interval
+            reg['pkt_cnt']  = np.int64(0.5 * reg['pkt_cnt'] + 1)
+            reg['pkt_len']  = np.int64(0.5 * reg['pkt_len'])
+            reg['ss']       = np.int64(0.5 * reg['ss'])
+            return SLOT_DECAY
+        reg['ts']       = ts
+        reg['pkt_cnt']  += 1
+        reg['pkt_len']  += pkt_len
+        reg['ss']       += math_unit(sqr_table, pkt_len)
+        return SLOT_UPDATE
+
+    reg['valid']        = True
+    reg['ts']           = ts
+    reg['pkt_cnt']      = 1
+    reg['pkt_len']      = pkt_len
+    reg['ss']           = math_unit(sqr_table, pkt_len)
+    reg['cur_pkt_cnt']  = 0
+    reg['cur_ss']       = 0
+    reg['cur_mean']     = 0
+    return SLOT_INIT
+
+
+# Xor slot part of FCKitNET.decay_check_2d (sum of residual products), given the result of the
+# flow slot check. Returns the applied decay factor.
+@jit
+def decay_check_xor(regs, slot_xor, check, ts, interval):
+    reg_xor = regs[slot_xor]
+
+    if check == SLOT_DECAY:
+        reg_xor['res_sum_ts']   += interval
+        reg_xor['res_sum']      = np.int64(0.5 * reg_xor['res_sum'])
+        return 0.5
+    if check == SLOT_UPDATE:
+        reg_xor['res_sum_ts']   = ts
+    return 1.0
+
+
+# FCKitNET.decay_check_2d, including the sum of residual products (xor slot).
+# Returns the applied decay factor.
+@jit
+def decay_check_2d(regs, slot, slot_xor, ts, pkt_len, interval, sqr_table):
+    check = decay_check_flow(regs, slot, ts, pkt_len, interval, sqr_table)
+    return decay_check_xor(regs, slot_xor, check, ts, interval)
+
+
+# FCKitNET.stats_calc_1d: mean and standard deviation, written to out[row, col:col + 2].
+@jit
+def stats_1d(pkt_cnt, pkt_len, pkt_len_sqr, sqr_table, sqrt_table, out, row, col):
+    mean = pkt_len >> pow_2(pkt_cnt)
+    out[row, col]       = mean
+    out[row, col + 1]   = math_unit(sqrt_table, abs((pkt_len_sqr >> pow_2(pkt_cnt)) -
+                                                    math_unit(sqr_table, mean)))
+
+
+# 2D statistics of a read (FCKitNET.stats_calc_2d), written to out[row, col + 3:col + 7]:
+# magnitude, radius, covariance and PCC.
+@jit
+def stats_2d(pkt_cnt_0, pkt_len_sqr, mean_0, std_dev_0, pkt_cnt_1, pkt_len_sqr_1, mean_1, res_sum,
+             sqr_table, sqrt_table, out, row, col):
+    variance_0  = abs((pkt_len_sqr >> pow_2(pkt_cnt_0)) - math_unit(sqr_table, mean_0))
+    variance_1  = abs((pkt_len_sqr_1 >> pow_2(pkt_cnt_1)) - math_unit(sqr_table, mean_1))
+    std_dev_1   = math_unit(sqrt_table, variance_1)
+    cov         = res_sum >> pow_2(pkt_cnt_0 + pkt_cnt_1)
+
+    out[row, col + 3] = math_unit(sqrt_table, math_unit(sqr_table, mean_0) + math_unit(sqr_table, mean_1))
+    out[row, col + 4] = math_unit(sqrt_table, math_unit(sqr_table, variance_0) +
+                                  math_unit(sqr_table, variance_1))
+    out[row, col + 5] = cov
+
+    pow_2_std_dev_1 = pow_2(std_dev_1)
+    if pow_2_std_dev_1 != 0:
+        pcc_shift = pow_2(std_dev_0 << pow_2_std_dev_1)
+        if pcc_shift != 0:
+            out[row, col + 6] = cov >> pcc_shift
+
+
+# Register update (FCKitNET.__update_registers__) and statistics of a 2D flow key, written to
+# out[row, col:col + 7]: packet count, mean, std. dev., then (on reads) magnitude, radius,
+# covariance and PCC.
+@jit
+def update_2d(regs, slot_0, slot_1, slot_xor, decay, read, sqr_table, sqrt_table, out, row, col):
+    reg_0       = regs[slot_0]
+    reg_1       = regs[slot_1]
+    pkt_cnt_0   = reg_0['pkt_cnt']
+    pkt_len_sqr = reg_0['ss']
+    mean_0      = reg_0['pkt_len'] >> pow_2(pkt_cnt_0)
+
+    # Residual products from flows A->B and B->A.
+    res_0 = reg_0['pkt_len'] - mean_0
+    reg_0['res'] = res_0
+    res_1 = reg_1['res'] if reg_1['valid'] else 0
+
+    if res_1 != 0 and decay == 1.0:
+        regs[slot_xor]['res_sum'] += res_0 << pow_2(res_1)
+
+    pkt_cnt_1 = pkt_len_sqr_1 = mean_1 = res_sum = 0
+    if not read:
+        reg_0['cur_pkt_cnt']    = pkt_cnt_0
+        reg_0['cur_ss']         = pkt_len_sqr
+        reg_0['cur_mean']       = mean_0
+    elif reg_1['valid']:
+        pkt_cnt_1       = reg_1['cur_pkt_cnt']
+        pkt_len_sqr_1   = reg_1['cur_ss']
+        mean_1          = reg_1['cur_mean']
+
+    if read:
+        res_sum = regs[slot_xor]['res_sum']
+
+    variance_0  = abs((pkt_len_sqr >> pow_2(pkt_cnt_0)) - math_unit(sqr_table, mean_0))
+    std_dev_0   = math_unit(sqrt_table, variance_0)
+
+    out[row, col]       = pkt_cnt_0
+    out[row, col + 1]   = mean_0
+    out[row, col + 2]   = std_dev_0
+
+    if read:
+        stats_2d(pkt_cnt_0, pkt_len_sqr, mean_0, std_dev_0, pkt_cnt_1, pkt_len_sqr_1, mean_1,
+                 res_sum, sqr_table, sqrt_table, out, row, col)
+
+
+# Processes a chunk of IPv4 packets: decay checks, register updates and statistics.
+# hashes: (n, 8) slots with the decay counter offset (see FCKitNET.hash_calc); decay_cntr, read,
+# pkt_len, ts: per packet; intervals: decay interval of each decay counter value.
+# out: (n, 21) statistics (see FCKitNET.process_batch), initialized to 0.
+# Returns the decay factors of the IP and 5-tuple keys of the last packet.
+@jit
+def process_chunk(mac_ip_src, ip_src, ip, five_t, hashes, decay_cntr, read, pkt_len, ts,
+                  intervals, sqr_table, sqrt_table, out):
+    decay_ip = decay_five_t = 1.0
+
+    for j in range(len(hashes)):
+        interval    = intervals[decay_cntr[j] - 1]
+        length      = pkt_len[j]
+        h           = hashes[j]
+
+        decay_check_1d(mac_ip_src, h[0], ts[j], length, interval, sqr_table)
+        decay_check_1d(ip_src, h[1], ts[j], length, interval, sqr_table)
+        decay_ip        = decay_check_2d(ip, h[2], h[4], ts[j], length, interval, sqr_table)
+        decay_five_t    = decay_check_2d(five_t, h[5], h[7], ts[j], length, interval, sqr_table)
+
+        out[j, 0] = decay_cntr[j]
+        out[j, 1] = mac_ip_src[h[0]]['pkt_cnt']
+        stats_1d(mac_ip_src[h[0]]['pkt_cnt'], mac_ip_src[h[0]]['pkt_len'], mac_ip_src[h[0]]['ss'],
+                 sqr_table, sqrt_table, out, j, 2)
+        out[j, 4] = ip_src[h[1]]['pkt_cnt']
+        stats_1d(ip_src[h[1]]['pkt_cnt'], ip_src[h[1]]['pkt_len'], ip_src[h[1]]['ss'],
+                 sqr_table, sqrt_table, out, j, 5)
+
+        update_2d(ip, h[2], h[3], h[4], decay_ip, read[j], sqr_table, sqrt_table, out, j, 7)
+        update_2d(five_t, h[5], h[6], h[7], decay_five_t, read[j], sqr_table, sqrt_table, out, j, 14)
+
+    return decay_ip, decay_five_t
+
+
+# Flow-partitioned engine (see fc_parallel.py). The counters of a flow slot only depend on the
+# packets of that slot, so the slots are split among worker processes (partition_chunk). What
+# links the slots of a 2D key (the residue and counters read from the reverse flow B->A, and the
+# sum of residual products of the xor slot) is then replayed in packet order by merge_2d.
+
+# Decay check and statistics of a 1D flow key, written to out[row, col:col + 3].
+@jit
+def update_1d(regs, slot, ts, pkt_len, interval, sqr_table, sqrt_table, out, row, col):
+    decay_check_1d(regs, slot, ts, pkt_len, interval, sqr_table)
+    reg = regs[slot]
+    out[row, col] = reg['pkt_cnt']
+    stats_1d(reg['pkt_cnt'], reg['pkt_len'], reg['ss'], sqr_table, sqrt_table, out, row, col + 1)
+
+
+# Flow A->B part of update_2d: residue, counters for the reverse flow to read, and the 1D
+# statistics, written to out[row, col:col + 3]. The squared sum and residue go to
+# flows[key, 1:3, row].
+@jit
+def update_flow(regs, slot, read, sqr_table, sqrt_table, out, row, col, flows, key):
+    reg         = regs[slot]
+    pkt_cnt     = reg['pkt_cnt']
+    pkt_len_sqr = reg['ss']
+    mean        = reg['pkt_len'] >> pow_2(pkt_cnt)
+
+    reg['res'] = reg['pkt_len'] - mean
+    flows[key, 1, row] = pkt_len_sqr
+    flows[key, 2, row] = reg['res']
+    if not read:
+        reg['cur_pkt_cnt']  = pkt_cnt
+        reg['cur_ss']       = pkt_len_sqr
+        reg['cur_mean']     = mean
+
+    out[row, col]       = pkt_cnt
+    out[row, col + 1]   = mean
+    out[row, col + 2]   = math_unit(sqrt_table, abs((pkt_len_sqr >> pow_2(pkt_cnt)) -
+                                                    math_unit(sqr_table, mean)))
+
+
+# Share of process_chunk of one worker: the packets of the slots it owns (slot % n_workers ==
+# worker), for the slot of each 1D key and the flow A->B slot of each 2D key.
+# out: (n, 21) statistics, of which the columns of the owned slots are written.
+# flows: (2, 3, n) results of the 2D keys (IP, 5-tuple) for merge_2d: decay check result,
+# squared sum and residue of the flow A->B slot.
+@jit
+def partition_chunk(mac_ip_src, ip_src, ip, five_t, hashes, decay_cntr, read, pkt_len, ts,
+                    intervals, sqr_table, sqrt_table, worker, n_workers, out, flows):
+    for j in range(len(hashes)):
+        slot_mac_ip_src = hashes[j, 0]
+        slot_ip_src     = hashes[j, 1]
+        slot_ip         = hashes[j, 2]
+        slot_five_t     = hashes[j, 5]
+        interval        = intervals[decay_cntr[j] - 1]
+
+        if slot_mac_ip_src % n_workers == worker:
+            update_1d(mac_ip_src, slot_mac_ip_src, ts[j], pkt_len[j], interval, sqr_table,
+                      sqrt_table, out, j, 1)
+        if slot_ip_src % n_workers == worker:
+            update_1d(ip_src, slot_ip_src, ts[j], pkt_len[j], interval, sqr_table, sqrt_table,
+                      out, j, 4)
+        if slot_ip % n_workers == worker:
+            flows[0, 0, j] = decay_check_flow(ip, slot_ip, ts[j], pkt_len[j], interval, sqr_table)
+            update_flow(ip, slot_ip, read[j], sqr_table, sqrt_table, out, j, 7, flows, 0)
+        if slot_five_t % n_workers == worker:
+            flows[1, 0, j] = decay_check_flow(five_t, slot_five_t, ts[j], pkt_len[j], interval,
+                                              sqr_table)
+            update_flow(five_t, slot_five_t, read[j], sqr_table, sqrt_table, out, j, 14, flows, 1)
+
+
+# In-order part of update_2d for one 2D key, from the results of partition_chunk (flows: the
+# (3, n) results of the key, out: the statistics, with the flow A->B columns col:col + 3).
+# regs: register table of the key, of which only the fields read from the reverse flow (valid,
+# res, cur_*) and the sums of residual products are kept up to date. hash_col: column of the flow
+# A->B slot in hashes. Returns the decay factor of the last packet.
+@jit
+def merge_2d(regs, hashes, hash_col, decay_cntr, read, ts, intervals, flows, sqr_table, sqrt_table,
+             out, col):
+    decay = 1.0
+
+    for j in range(len(hashes)):
+        slot_0      = hashes[j, hash_col]
+        slot_1      = hashes[j, hash_col + 1]
+        slot_xor    = hashes[j, hash_col + 2]
+        check       = flows[0, j]
+        reg_0       = regs[slot_0]
+        reg_1       = regs[slot_1]
+
+        decay = decay_check_xor(regs, slot_xor, check, ts[j], intervals[decay_cntr[j] - 1])
+        if check == SLOT_INIT:
+            reg_0['valid']          = True
+            reg_0['cur_pkt_cnt']    = 0
+            reg_0['cur_ss']         = 0
+            reg_0['cur_mean']       = 0
+
+        res_0 = flows[2, j]
+        reg_0['res'] = res_0
+        res_1 = reg_1['res'] if reg_1['valid'] else 0
+
+        if res_1 != 0 and decay == 1.0:
+            regs[slot_xor]['res_sum'] += res_0 << pow_2(res_1)
+
+        pkt_cnt_0   = out[j, col]
+        pkt_len_sqr = flows[1, j]
+        mean_0      = out[j, col + 1]
+
+        if not read[j]:
+            reg_0['cur_pkt_cnt']    = pkt_cnt_0
+            reg_0['cur_ss']         = pkt_len_sqr
+            reg_0['cur_mean']       = mean_0
+            continue
+
+        pkt_cnt_1 = pkt_len_sqr_1 = mean_1 = 0
+        if reg_1['valid']:
+            pkt_cnt_1       = reg_1['cur_pkt_cnt']
+            pkt_len_sqr_1   = reg_1['cur_ss']
+            mean_1          = reg_1['cur_mean']
+
+        stats_2d(pkt_cnt_0, pkt_len_sqr, mean_0, out[j, col + 2], pkt_cnt_1, pkt_len_sqr_1, mean_1,
+                 regs[slot_xor]['res_sum'], sqr_table, sqrt_table, out, j, col)
+
+    return decay
+
+
+# Compiles the kernels (or loads them from the Numba cache) on a one-packet chunk, so that the
+# compilation is not part of the first chunk processed.
+def warm_up():
+    regs    = RegisterFile(16)
+    tables  = (regs.mac_ip_src.regs, regs.ip_src.regs, regs.ip.regs, regs.five_t.regs)
+    chunk   = (np.zeros((1, 8), dtype=np.int64), np.ones(1, dtype=np.int64),
+               np.ones(1, dtype=np.bool_), np.ones(1, dtype=np.int64), np.ones(1), np.ones(4),
+               np.zeros(1024, dtype=np.int64), np.zeros(1024, dtype=np.int64))
+    out     = np.zeros((1, 21), dtype=np.int64)
+    flows   = np.zeros((2, 3, 1), dtype=np.int64)
+
+    process_chunk(*tables, *chunk, out)
+    partition_chunk(*tables, *chunk, 0, 1, out, flows)
+    merge_2d(regs.ip.regs, chunk[0], 2, chunk[1], chunk[2], chunk[4], chunk[5], flows[0],
+             chunk[6], chunk[7], out, 7)
@@ -1,14 +1,18 @@
 import os
+import time
 import subprocess
-import pandas as pd
 import binascii
 import socket
 import struct
-import pickle
-import crcmod
 import ipaddress
+import numpy as np
 from math import isnan, sqrt, pow, log
+from flow_hash import FlowHasher
 from math_unit import MathUnit
+from pcap_reader import PcapReader
+from trace_cache import load_cache, columns_from_csv
+from register_file import RegisterFile
+from metrics import METRICS
 
 sqr = MathUnit(shift=1, invert=False, scale=-6,
                lookup=[x*x for x in range(15, -1, -1)])
@@ -18,30 +22,68 @@ lookup_sqrt = [240, 240, 222, 222, 202, 202, 182, 182, 175, 169, 163, 157, 150,
 sqrt_mu = MathUnit(shift=-1, invert=False, scale=-7,
                    lookup=lookup_sqrt)
 
+# Decay intervals (s) for each decay counter value: 100 ms, 1 s, 10 s and 60 s.
+DECAY_INTERVALS = [0.1, 1, 10, 60]
+KERNEL_INTERVALS = np.array(DECAY_INTERVALS, dtype=np.float64)
+
+# Hot path stages (see metrics.py). In process() the register updates are part of stats_calc.
+STAGE_HASHING       = METRICS.stage('hashing')
+STAGE_DECAY_CHECK   = METRICS.stage('decay_check')
+STAGE_REGISTERS     = METRICS.stage('registers')
+STAGE_STATS_CALC    = METRICS.stage('stats_calc')
+STAGE_KERNEL        = METRICS.stage('kernel')       # Compiled engine: all of the above but hashing.
+
+# Compiled kernel module (fc_kernel.py), imported by load_kernel(): Numba takes long to import,
+# and only the numba engine and the simulator workers need it.
+fc_kernel = None
+
+
+def load_kernel():
+    global fc_kernel
+    if fc_kernel is None:
+        import fc_kernel
+    return fc_kernel
+
+
+# Powers of two used to compute bit lengths of int64 arrays.
+POW_2 = 2 ** np.arange(63, dtype=np.int64)
+
+
+# Vectorized FCKitNET.pow_2.
+# For 1 < n < 2**47, int(log(n, 2)) is exactly the bit length of n minus one.
+# Larger values (and arrays of Python ints) fall back to the scalar implementation.
+def pow_2_array(n):
+    if n.dtype == object or (n.size and n.max() >= 2 ** 47):
+        return np.array([FCKitNET.pow_2(None, v) for v in n.tolist()], dtype=n.dtype)
+
+    bit_len = np.searchsorted(POW_2, n, side='right')
+    return np.where(n > 1, bit_len - 1, 0).astype(n.dtype)
+
 
 class FCKitNET:
-    def __init__(self, file_path, sampling_rate, train_pkts, train_stats):
+    def __init__(self, file_path, sampling_rate, train_pkts, train_stats, reader='pcap',
+                 engine='python', workers=0):
         self.file_path      = file_path         # Path of the trace file / csv.
         self.df_csv         = None              # Dataframe for the trace csv.
-        self.cur_pkt        = pd.DataFrame()    # Stats of the packet being processed.
+        self.reader         = None              # Streaming pcap reader / trace cache.
+        self.pkt_buf        = None              # Packets read ahead by feature_extract().
+        self.pkt_buf_index  = 0                 # Next packet in pkt_buf.
+        self.cur_pkt        = []                # Stats of the packet being processed.
         self.sampling_rate  = sampling_rate     # Sampling rate during the execution phase.
         self.train_pkts     = train_pkts        # Number of packets in the training phase.
 
         self.global_pkt_index = train_pkts
 
-        with open(train_stats, 'rb') as f_stats:
-            stats = pickle.load(f_stats)
-            # Calculated 1D and 2D statistics for all flow keys.
-            self.fc_mac_ip_src  = stats[4]
-            self.fc_ip_src      = stats[5]
-            self.fc_ip          = stats[6]
-            self.fc_five_t      = stats[7]
-
-            # Support structures for residue calculation.
-            self.ip_res         = stats[8]
-            self.ip_res_sum     = stats[9]
-            self.five_t_res     = stats[10]
-            self.five_t_res_sum = stats[11]
+        # Calculated 1D and 2D statistics for all flow keys (fixed-size register tables).
+        # The IP and 5-tuple tables also hold the residues and sums of residual products.
+        if train_stats.endswith('.npz'):
+            self.registers  = RegisterFile.from_bundle(train_stats)
+        else:
+            self.registers  = RegisterFile.from_train_stats(train_stats)
+        self.fc_mac_ip_src  = self.registers.mac_ip_src
+        self.fc_ip_src      = self.registers.ip_src
+        self.fc_ip          = self.registers.ip
+        self.fc_five_t      = self.registers.five_t
 
         self.sampl_pkt_index = 0    # Packet index to track the sampling rate (tna impl).
 
@@ -50,8 +92,27 @@ class FCKitNET:
         self.decay_ip       = 1
         self.decay_five_t   = 1
 
-        # CRC 16 parameters, following the TNA.
-        self.crc16 = crcmod.mkCrcFun(0x18005, rev=True, initCrc=0x0000, xorOut=0x0000)
+        # CRC 16 hashing of the flow keys, following the TNA.
+        self.hasher = FlowHasher()
+
+        # process_batch() engine: python, or numba (compiled kernel, see fc_kernel.py), which
+        # falls back to python if Numba is not installed.
+        self.engine = engine
+        if engine == 'numba' and not load_kernel().AVAILABLE:
+            print('Numba is not installed: using the python engine.')
+            self.engine = 'python'
+        elif engine == 'numba':
+            fc_kernel.warm_up()
+
+        # With workers > 1, process_batch() splits the register slots among worker processes
+        # (flow-partitioned engine, see fc_parallel.py), started on the first chunk. It runs the
+        # kernel functions, as Python code if Numba is not installed.
+        self.workers    = workers
+        self.partition  = None
+        if workers > 1 and not load_kernel().AVAILABLE:
+            print('Numba is not installed: the simulator workers run the kernel as Python code.')
+        elif workers > 1:
+            fc_kernel.warm_up()
 
         # Hash values for all flow keys.
         self.hash_mac_ip_src    = 0
@@ -63,8 +124,17 @@ class FCKitNET:
         self.hash_five_t_1      = 0
         self.hash_five_t_xor    = 0
 
-        # Check if the pcap -> csv already exists and pass it to a dataframe.
-        self.__check_csv__()
+        # Trace input: stream the pcap/pcapng directly (reader: pcap), memory-map its columnar
+        # cache (reader: cache), or (reader: tshark) check if the pcap -> csv already exists
+        # and load it to a dataframe. The training packets are skipped.
+        if reader == 'pcap':
+            self.reader = PcapReader(file_path)
+            self.reader.skip(train_pkts)
+        elif reader == 'cache':
+            self.reader = load_cache(file_path)
+            self.reader.skip(train_pkts)
+        else:
+            self.__check_csv__()
 
     def __check_csv__(self):
         # Check the file type.
@@ -73,10 +143,58 @@ class FCKitNET:
         if not os.path.isfile(file_path + '.csv'):
             self.parse_pcap(self.file_path)
 
+        import pandas as pd
         self.df_csv = pd.read_csv(file_path + '.csv')
 
-    def trace_size(self):
-        return len(self.df_csv)
+    # State arrays for a snapshot (see snapshot.py): the registers (reg_<table>) and the trace
+    # position and decay control variables.
+    def snapshot(self):
+        arrays = {f'reg_{name}': regs for name, regs in self.registers.snapshot().items()}
+        arrays['fc_state'] = np.array([self.global_pkt_index, self.sampl_pkt_index, self.decay_cntr,
+                                       self.decay_ip, self.decay_five_t], dtype=np.int64)
+        return arrays
+
+    # Restores the state saved by snapshot() (npz: the snapshot arrays), resuming the trace after
+    # the last packet processed before the snapshot.
+    def restore(self, npz):
+        self.close()
+        self.registers.restore({name: npz[f'reg_{name}'] for name in self.registers.tables()})
+
+        global_pkt_index, self.sampl_pkt_index, self.decay_cntr, self.decay_ip, self.decay_five_t = \
+            npz['fc_state'].tolist()
+
+        if self.reader is not None:
+            self.reader.skip(global_pkt_index - self.global_pkt_index)
+            self.pkt_buf = None
+        self.global_pkt_index = global_pkt_index
+
+    # True while there are packets left in the trace.
+    def has_next(self):
+        if self.reader is None:
+            return self.global_pkt_index < len(self.df_csv)
+        if self.pkt_buf is not None and self.pkt_buf_index < len(self.pkt_buf['valid']):
+            return True
+        return not self.reader.eof()
+
+    # Parse the next chunk of packets from the trace into NumPy columns
+    # (see trace_cache.columns_from_csv() for the field semantics).
+    def read_chunk(self, size):
+        if self.reader is not None:
+            return self.reader.read(size)
+
+        return columns_from_csv(self.df_csv.iloc[self.global_pkt_index:self.global_pkt_index + size])
+
+    # Builds the packet header list returned by process() for packet i of a chunk.
+    @staticmethod
+    def chunk_header(cols, i):
+        mac = '%012x' % int(cols['mac_src'][i])
+        return [float(cols['ts'][i]),
+                ':'.join(mac[j:j + 2] for j in range(0, 12, 2)),
+                socket.inet_ntoa(struct.pack('!I', int(cols['ip_src'][i]))),
+                socket.inet_ntoa(struct.pack('!I', int(cols['ip_dst'][i]))),
+                str(int(cols['proto'][i])),
+                str(int(cols['port_src'][i])),
+                str(int(cols['port_dst'][i]))]
 
     def parse_pcap(self, pcap_path):
         fields = "-e frame.time_epoch -e frame.len -e eth.src -e eth.dst \
@@ -91,8 +209,12 @@ class FCKitNET:
         print('Parsing pcap file to csv.')
         subprocess.call(cmd, shell=True)
 
-    # Parse the next packet from the csv.
+    # Parse the next packet from the trace.
     def feature_extract(self):
+        if self.reader is not None:
+            self.__feature_extract_pcap__()
+            return
+
         ip_src = self.df_csv.iat[self.global_pkt_index, 4]
         ip_dst = self.df_csv.iat[self.global_pkt_index, 5]
         if str(ip_src) == 'nan' or str(ip_dst) == 'nan':
@@ -125,6 +247,27 @@ class FCKitNET:
         self.cur_pkt = [pkt_len, timestamp, mac_dst, mac_src, ip_src, ip_dst,
                         str(int(ip_proto)), str(int(port_src)), str(int(port_dst))]
 
+    # feature_extract() for the pcap reader: packets are parsed in batches and then
+    # converted one by one to the csv field representation.
+    def __feature_extract_pcap__(self):
+        if self.pkt_buf is None or self.pkt_buf_index >= len(self.pkt_buf['valid']):
+            self.pkt_buf        = self.reader.read(self.reader.batch_size)
+            self.pkt_buf_index  = 0
+
+        i = self.pkt_buf_index
+        self.pkt_buf_index      += 1
+        self.global_pkt_index   += 1
+
+        if not self.pkt_buf['valid'][i]:
+            self.cur_pkt = []
+            return
+
+        hdr     = self.chunk_header(self.pkt_buf, i)
+        mac_dst = '%012x' % int(self.pkt_buf['mac_dst'][i])
+
+        self.cur_pkt = [int(self.pkt_buf['pkt_len'][i]), hdr[0],
+                        ':'.join(mac_dst[j:j + 2] for j in range(0, 12, 2))] + hdr[1:]
+
     def process(self):
         # If the packet is not IPv4.
         if self.cur_pkt == []:
@@ -153,9 +296,7 @@ class FCKitNET:
                 self.sampl_pkt_index = 1
 
         # Hash calculation.
-        # CRC16, sliced to 13 bits (0-8191).
-        # To each hash value we then sum 8192 * (self.decay_cntr - 1)
-        # in order to obtain the current position based on the decay counter value.
+        start           = time.perf_counter_ns()
         mac_src_bytes   = binascii.unhexlify(self.cur_pkt[3].replace(':', ''))
         ip_src_bytes    = socket.inet_aton(self.cur_pkt[4])
         ip_dst_bytes    = socket.inet_aton(self.cur_pkt[5])
@@ -163,103 +304,65 @@ class FCKitNET:
         proto_src_bytes = struct.pack("!H", int(self.cur_pkt[7]))
         proto_dst_bytes = struct.pack("!H", int(self.cur_pkt[8]))
 
-        hash_mac_ip_src_temp = self.crc16(mac_src_bytes)
-        hash_mac_ip_src_temp = '{:016b}'.format(self.crc16(ip_src_bytes, hash_mac_ip_src_temp))
-
-        self.hash_mac_ip_src = int(hash_mac_ip_src_temp[-13:], 2) + 8192 * (self.decay_cntr - 1)
-
-        hash_ip_src_temp = '{:016b}'.format(self.crc16(ip_src_bytes))
-        self.hash_ip_src = int(hash_ip_src_temp[-13:], 2) + 8192 * (self.decay_cntr - 1)
-
-        # Hash xor value is used to access the sum of residual products.
-        # Xor is used since the value is the same for both flow directions.
-
-        hash_ip_0_temp = self.crc16(ip_src_bytes)
-        hash_ip_0_temp = '{:016b}'.format(self.crc16(ip_dst_bytes, hash_ip_0_temp))
-        self.hash_ip_0 = int(hash_ip_0_temp[-13:], 2)
-
-        hash_ip_1_temp = self.crc16(ip_dst_bytes)
-        hash_ip_1_temp = '{:016b}'.format(self.crc16(ip_src_bytes, hash_ip_1_temp))
-        self.hash_ip_1 = int(hash_ip_1_temp[-13:], 2)
-
-        self.hash_ip_xor = self.hash_ip_0 ^ self.hash_ip_1
-
-        self.hash_ip_0      += 8192 * (self.decay_cntr - 1)
-        self.hash_ip_1      += 8192 * (self.decay_cntr - 1)
-        self.hash_ip_xor    += 8192 * (self.decay_cntr - 1)
-
-        hash_five_t_0_temp = self.crc16(ip_src_bytes)
-        hash_five_t_0_temp = self.crc16(ip_dst_bytes, hash_five_t_0_temp)
-        hash_five_t_0_temp = self.crc16(ip_proto_bytes, hash_five_t_0_temp)
-        hash_five_t_0_temp = self.crc16(proto_src_bytes, hash_five_t_0_temp)
-        hash_five_t_0_temp = '{:016b}'.format(self.crc16(proto_dst_bytes, hash_five_t_0_temp))
-        self.hash_five_t_0 = int(hash_five_t_0_temp[-13:], 2)
-
-        hash_five_t_1_temp = self.crc16(ip_dst_bytes)
-        hash_five_t_1_temp = self.crc16(ip_src_bytes, hash_five_t_1_temp)
-        hash_five_t_1_temp = self.crc16(ip_proto_bytes, hash_five_t_1_temp)
-        hash_five_t_1_temp = self.crc16(proto_dst_bytes, hash_five_t_1_temp)
-        hash_five_t_1_temp = '{:016b}'.format(self.crc16(proto_src_bytes, hash_five_t_1_temp))
-        self.hash_five_t_1 = int(hash_five_t_1_temp[-13:], 2)
-
-        self.hash_five_t_xor = self.hash_five_t_0 ^ self.hash_five_t_1
-
-        self.hash_five_t_0      += 8192 * (self.decay_cntr - 1)
-        self.hash_five_t_1      += 8192 * (self.decay_cntr - 1)
-        self.hash_five_t_xor    += 8192 * (self.decay_cntr - 1)
+        self.hash_calc(FlowHasher.pack_key(mac_src_bytes, ip_src_bytes, ip_dst_bytes,
+                                           ip_proto_bytes, proto_src_bytes, proto_dst_bytes))
+        hashed = time.perf_counter_ns()
+        STAGE_HASHING.observe(hashed - start)
 
         # Decay check for all flow keys.
         self.decay_check()
+        checked = time.perf_counter_ns()
+        STAGE_DECAY_CHECK.observe(checked - hashed)
 
         # Calculate the 1D/2D statistics for each flow key.
 
         # 1D: Mac src, IP src
-        mac_ip_src_pkt_cnt = int(self.fc_mac_ip_src[self.hash_mac_ip_src][self.decay_cntr][0])
+        mac_ip_src_pkt_cnt = int(self.fc_mac_ip_src.pkt_cnt[self.hash_mac_ip_src])
         mac_ip_src_mean, mac_ip_src_std_dev = \
             self.stats_calc_1d(mac_ip_src_pkt_cnt,
-                               int(self.fc_mac_ip_src[self.hash_mac_ip_src][self.decay_cntr][1]),
-                               int(self.fc_mac_ip_src[self.hash_mac_ip_src][self.decay_cntr][2]))
+                               int(self.fc_mac_ip_src.pkt_len[self.hash_mac_ip_src]),
+                               int(self.fc_mac_ip_src.ss[self.hash_mac_ip_src]))
         # 1D: IP src
-        ip_src_pkt_cnt = int(self.fc_ip_src[self.hash_ip_src][self.decay_cntr][0])
+        ip_src_pkt_cnt = int(self.fc_ip_src.pkt_cnt[self.hash_ip_src])
         ip_src_mean, ip_src_std_dev = \
             self.stats_calc_1d(ip_src_pkt_cnt,
-                               int(self.fc_ip_src[self.hash_ip_src][self.decay_cntr][1]),
-                               int(self.fc_ip_src[self.hash_ip_src][self.decay_cntr][2]))
+                               int(self.fc_ip_src.pkt_len[self.hash_ip_src]),
+                               int(self.fc_ip_src.ss[self.hash_ip_src]))
         # 1D: IP
 
-        ip_pkt_cnt_0    = int(self.fc_ip[self.hash_ip_0][self.decay_cntr][0])
-        ip_pkt_len      = int(self.fc_ip[self.hash_ip_0][self.decay_cntr][1])
-        ip_pkt_len_sqr  = int(self.fc_ip[self.hash_ip_0][self.decay_cntr][2])
+        ip_pkt_cnt_0    = int(self.fc_ip.pkt_cnt[self.hash_ip_0])
+        ip_pkt_len      = int(self.fc_ip.pkt_len[self.hash_ip_0])
+        ip_pkt_len_sqr  = int(self.fc_ip.ss[self.hash_ip_0])
 
         ip_mean_0, ip_std_dev_0 = \
             self.stats_calc_1d(ip_pkt_cnt_0, ip_pkt_len, ip_pkt_len_sqr)
 
         # Calculate the residual products from flows A->B and B->A.
         ip_res_0 = ip_pkt_len - ip_mean_0
-        self.ip_res[self.hash_ip_0][self.decay_cntr-1] = ip_res_0
-        if self.hash_ip_1 in self.fc_ip:
-            ip_res_1 = int(self.ip_res[self.hash_ip_1][self.decay_cntr-1])
+        self.fc_ip.res[self.hash_ip_0] = ip_res_0
+        if self.fc_ip.valid[self.hash_ip_1]:
+            ip_res_1 = int(self.fc_ip.res[self.hash_ip_1])
         else:
             ip_res_1 = 0
 
         # Update the Sum of Residual Products.
         if ip_res_1 != 0 and self.decay_ip == 1:
-            self.ip_res_sum[self.hash_ip_xor][self.decay_cntr] += (ip_res_0 << self.pow_2(ip_res_1))
+            self.fc_ip.res_sum[self.hash_ip_xor] += (ip_res_0 << self.pow_2(ip_res_1))
 
         # Update the counters for flow A->B / Read the counters for flow B->A.
         # Execution phase: we switch between writing the counters for flow A->B
         # and reading the previously stored counters for flow B->A according to the sampling rate.
         if (self.global_pkt_index - self.train_pkts) % self.sampling_rate != 0:
             # Update
-            self.fc_ip[self.hash_ip_0][self.decay_cntr][3] = ip_pkt_cnt_0
-            self.fc_ip[self.hash_ip_0][self.decay_cntr][4] = ip_pkt_len_sqr
-            self.fc_ip[self.hash_ip_0][self.decay_cntr][5] = ip_mean_0
+            self.fc_ip.cur_pkt_cnt[self.hash_ip_0]  = ip_pkt_cnt_0
+            self.fc_ip.cur_ss[self.hash_ip_0]       = ip_pkt_len_sqr
+            self.fc_ip.cur_mean[self.hash_ip_0]     = ip_mean_0
         else:
             # Read
-            if self.hash_ip_1 in self.fc_ip:
-                ip_pkt_cnt_1        = int(self.fc_ip[self.hash_ip_1][self.decay_cntr][3])
-                ip_pkt_len_sqr_1    = int(self.fc_ip[self.hash_ip_1][self.decay_cntr][4])
-                ip_mean_1           = int(self.fc_ip[self.hash_ip_1][self.decay_cntr][5])
+            if self.fc_ip.valid[self.hash_ip_1]:
+                ip_pkt_cnt_1        = int(self.fc_ip.cur_pkt_cnt[self.hash_ip_1])
+                ip_pkt_len_sqr_1    = int(self.fc_ip.cur_ss[self.hash_ip_1])
+                ip_mean_1           = int(self.fc_ip.cur_mean[self.hash_ip_1])
             else:
                 ip_pkt_cnt_1        = 0
                 ip_pkt_len_sqr_1    = 0
@@ -267,39 +370,39 @@ class FCKitNET:
 
         # 1D: 5-tuple
 
-        five_t_pkt_cnt_0    = int(self.fc_five_t[self.hash_five_t_0][self.decay_cntr][0])
-        five_t_pkt_len      = int(self.fc_five_t[self.hash_five_t_0][self.decay_cntr][1])
-        five_t_pkt_len_sqr  = int(self.fc_five_t[self.hash_five_t_0][self.decay_cntr][2])
+        five_t_pkt_cnt_0    = int(self.fc_five_t.pkt_cnt[self.hash_five_t_0])
+        five_t_pkt_len      = int(self.fc_five_t.pkt_len[self.hash_five_t_0])
+        five_t_pkt_len_sqr  = int(self.fc_five_t.ss[self.hash_five_t_0])
 
         five_t_mean_0, five_t_std_dev_0 = \
             self.stats_calc_1d(five_t_pkt_cnt_0, five_t_pkt_len, five_t_pkt_len_sqr)
 
         # Calculate the residual products from flows A->B and B->A.
         five_t_res_0 = five_t_pkt_len - five_t_mean_0
-        self.five_t_res[self.hash_five_t_0][self.decay_cntr-1] = five_t_res_0
-        if self.hash_five_t_1 in self.fc_five_t:
-            five_t_res_1 = int(self.five_t_res[self.hash_five_t_1][self.decay_cntr-1])
+        self.fc_five_t.res[self.hash_five_t_0] = five_t_res_0
+        if self.fc_five_t.valid[self.hash_five_t_1]:
+            five_t_res_1 = int(self.fc_five_t.res[self.hash_five_t_1])
         else:
             five_t_res_1 = 0
 
         # Update the Sum of Residual Products.
         if five_t_res_1 != 0 and self.decay_five_t == 1:
-            self.five_t_res_sum[self.hash_five_t_xor][self.decay_cntr] += (five_t_res_0 << self.pow_2(five_t_res_1))
+            self.fc_five_t.res_sum[self.hash_five_t_xor] += (five_t_res_0 << self.pow_2(five_t_res_1))
 
         # Update the counters for flow A->B / Read the counters for flow B->A.
         # Execution phase: we switch between writing the counters for flow A->B
         # and reading the previously stored counters for flow B->A according to the sampling rate.
         if (self.global_pkt_index - self.train_pkts) % self.sampling_rate != 0:
             # Update
-            self.fc_five_t[self.hash_five_t_0][self.decay_cntr][3] = five_t_pkt_cnt_0
-            self.fc_five_t[self.hash_five_t_0][self.decay_cntr][4] = five_t_pkt_len_sqr
-            self.fc_five_t[self.hash_five_t_0][self.decay_cntr][5] = five_t_mean_0
+            self.fc_five_t.cur_pkt_cnt[self.hash_five_t_0]  = five_t_pkt_cnt_0
+            self.fc_five_t.cur_ss[self.hash_five_t_0]       = five_t_pkt_len_sqr
+            self.fc_five_t.cur_mean[self.hash_five_t_0]     = five_t_mean_0
         else:
             # Read
-            if self.hash_five_t_1 in self.fc_five_t:
-                five_t_pkt_cnt_1        = int(self.fc_five_t[self.hash_five_t_1][self.decay_cntr][3])
-                five_t_pkt_len_sqr_1    = int(self.fc_five_t[self.hash_five_t_1][self.decay_cntr][4])
-                five_t_mean_1           = int(self.fc_five_t[self.hash_five_t_1][self.decay_cntr][5])
+            if self.fc_five_t.valid[self.hash_five_t_1]:
+                five_t_pkt_cnt_1        = int(self.fc_five_t.cur_pkt_cnt[self.hash_five_t_1])
+                five_t_pkt_len_sqr_1    = int(self.fc_five_t.cur_ss[self.hash_five_t_1])
+                five_t_mean_1           = int(self.fc_five_t.cur_mean[self.hash_five_t_1])
             else:
                 five_t_pkt_cnt_1        = 0
                 five_t_pkt_len_sqr_1    = 0
@@ -316,7 +419,7 @@ class FCKitNET:
             ip_std_dev_1 = sqrt_mu.compute(ip_variance_1)
             ip_magnitude, ip_radius, ip_cov, ip_pcc \
                 = self.stats_calc_2d(ip_pkt_cnt_0, ip_pkt_cnt_1, ip_mean_0, ip_mean_1,
-                                     int(self.ip_res_sum[self.hash_ip_xor][self.decay_cntr]),
+                                     int(self.fc_ip.res_sum[self.hash_ip_xor]),
                                      ip_variance_0, ip_variance_1, ip_std_dev_0, ip_std_dev_1)
         else:
             ip_magnitude = 0
@@ -336,7 +439,7 @@ class FCKitNET:
             five_t_magnitude, five_t_radius, five_t_cov, five_t_pcc \
                 = self.stats_calc_2d(five_t_pkt_cnt_0, five_t_pkt_cnt_1,
                                      five_t_mean_0, five_t_mean_1,
-                                     int(self.five_t_res_sum[self.hash_five_t_xor][self.decay_cntr]),
+                                     int(self.fc_five_t.res_sum[self.hash_five_t_xor]),
                                      five_t_variance_0, five_t_variance_1,
                                      five_t_std_dev_0, five_t_std_dev_1)
         else:
@@ -355,9 +458,282 @@ class FCKitNET:
                      int(five_t_magnitude), int(five_t_radius), int(five_t_cov), int(five_t_pcc)]
 
         self.cur_pkt = [self.cur_pkt[1]] + self.cur_pkt[3:]
+        STAGE_STATS_CALC.observe(time.perf_counter_ns() - checked)
 
         return [self.cur_pkt, cur_stats]
 
+    # Batched equivalent of feature_extract() + process() over a chunk from read_chunk().
+    # Decay counters and read/write alternation are derived for the whole chunk at once and the
+    # statistics are computed on NumPy columns. Only the register updates (decay_check, residues
+    # and counter writes) run sequentially, in packet order, so that the state evolves exactly
+    # as in the per-packet path. With the numba engine, they run along with the statistics in a
+    # single compiled call (see fc_kernel.py).
+    # Returns an (N, 21) array with the statistics of each packet (rows of non-IPv4 packets are 0).
+    def process_batch(self, cols):
+        valid   = cols['valid']
+        n       = len(valid)
+        ip_idx  = np.flatnonzero(valid)
+        n_ip    = len(ip_idx)
+
+        # Value of global_pkt_index after feature_extract() for each IPv4 packet.
+        pkt_index   = self.global_pkt_index + 1 + ip_idx
+        read        = (pkt_index - self.train_pkts) % self.sampling_rate == 0
+        decay_cntr  = self.__decay_cntr_batch__(n_ip)
+
+        self.global_pkt_index += n
+
+        out = np.zeros((n, 21), dtype=np.int64)
+        if n_ip == 0:
+            return out
+
+        if self.workers > 1:
+            out[ip_idx] = self.__process_partitioned__(cols, ip_idx, decay_cntr, read)
+            return out
+
+        # Hash slots of all flow keys, including the decay counter offset.
+        start  = time.perf_counter_ns()
+        hashes = self.hasher.hash_batch(*(cols[name][ip_idx] for name in
+                                          ('mac_src', 'ip_src', 'ip_dst', 'proto', 'port_src', 'port_dst')))
+        hashes += 8192 * (np.array(decay_cntr, dtype=np.int64)[:, None] - 1)
+        hashed = time.perf_counter_ns()
+        STAGE_HASHING.observe(hashed - start, n_ip)
+
+        if self.engine == 'numba':
+            out[ip_idx] = self.__process_chunk__(hashes, decay_cntr, read, cols['pkt_len'][ip_idx],
+                                                 cols['ts'][ip_idx])
+            STAGE_KERNEL.observe(time.perf_counter_ns() - hashed, n_ip)
+            return out
+
+        raw         = [[] for _ in range(20)]
+        ts          = cols['ts'][ip_idx].tolist()
+        pkt_len     = cols['pkt_len'][ip_idx].tolist()
+        hashes      = hashes.tolist()
+
+        decay_ns = 0
+        for j in range(n_ip):
+            self.decay_cntr = decay_cntr[j]
+            self.cur_pkt    = [pkt_len[j], ts[j]]
+
+            (self.hash_mac_ip_src, self.hash_ip_src,
+             self.hash_ip_0, self.hash_ip_1, self.hash_ip_xor,
+             self.hash_five_t_0, self.hash_five_t_1, self.hash_five_t_xor) = hashes[j]
+
+            decay_start = time.perf_counter_ns()
+            self.decay_check()
+            decay_ns    += time.perf_counter_ns() - decay_start
+            self.__update_registers__(read[j], raw)
+
+        updated = time.perf_counter_ns()
+        STAGE_DECAY_CHECK.observe(decay_ns, n_ip)
+        STAGE_REGISTERS.observe(updated - hashed - decay_ns, n_ip)
+
+        (mac_ip_src_pkt_cnt, mac_ip_src_pkt_len, mac_ip_src_pkt_len_sqr,
+         ip_src_pkt_cnt, ip_src_pkt_len, ip_src_pkt_len_sqr,
+         ip_pkt_cnt_0, ip_pkt_len_sqr, ip_mean_0,
+         ip_pkt_cnt_1, ip_pkt_len_sqr_1, ip_mean_1, ip_res_sum,
+         five_t_pkt_cnt_0, five_t_pkt_len_sqr, five_t_mean_0,
+         five_t_pkt_cnt_1, five_t_pkt_len_sqr_1, five_t_mean_1, five_t_res_sum) = \
+            [np.array(col) for col in raw]
+
+        mac_ip_src_mean, mac_ip_src_std_dev = \
+            self.stats_calc_1d_batch(mac_ip_src_pkt_cnt, mac_ip_src_pkt_len, mac_ip_src_pkt_len_sqr)
+        ip_src_mean, ip_src_std_dev = \
+            self.stats_calc_1d_batch(ip_src_pkt_cnt, ip_src_pkt_len, ip_src_pkt_len_sqr)
+        ip_std_dev_0 = self.std_dev_batch(ip_pkt_cnt_0, ip_pkt_len_sqr, ip_mean_0)
+        five_t_std_dev_0 = self.std_dev_batch(five_t_pkt_cnt_0, five_t_pkt_len_sqr, five_t_mean_0)
+
+        ip_2d = self.stats_calc_2d_batch(ip_pkt_cnt_0, ip_pkt_cnt_1, ip_mean_0, ip_mean_1,
+                                         ip_pkt_len_sqr, ip_pkt_len_sqr_1, ip_res_sum,
+                                         ip_std_dev_0, read)
+        five_t_2d = self.stats_calc_2d_batch(five_t_pkt_cnt_0, five_t_pkt_cnt_1,
+                                             five_t_mean_0, five_t_mean_1,
+                                             five_t_pkt_len_sqr, five_t_pkt_len_sqr_1,
+                                             five_t_res_sum, five_t_std_dev_0, read)
+
+        cols_out = [decay_cntr,
+                    mac_ip_src_pkt_cnt, mac_ip_src_mean, mac_ip_src_std_dev,
+                    ip_src_pkt_cnt, ip_src_mean, ip_src_std_dev,
+                    ip_pkt_cnt_0, ip_mean_0, ip_std_dev_0] + ip_2d + \
+                   [five_t_pkt_cnt_0, five_t_mean_0, five_t_std_dev_0] + five_t_2d
+
+        if any(np.asarray(col).dtype == object for col in cols_out):
+            out = out.astype(object)
+        for k, col in enumerate(cols_out):
+            out[ip_idx, k] = col
+
+        STAGE_STATS_CALC.observe(time.perf_counter_ns() - updated, n_ip)
+        return out
+
+    # Compiled equivalent of the register updates and statistics of process_batch() (see
+    # fc_kernel.process_chunk). Returns the (n_ip, 21) statistics.
+    def __process_chunk__(self, hashes, decay_cntr, read, pkt_len, ts):
+        stats = np.zeros((len(hashes), 21), dtype=np.int64)
+
+        self.decay_ip, self.decay_five_t = fc_kernel.process_chunk(
+            self.fc_mac_ip_src.regs, self.fc_ip_src.regs, self.fc_ip.regs, self.fc_five_t.regs,
+            np.ascontiguousarray(hashes, dtype=np.int64), np.array(decay_cntr, dtype=np.int64),
+            np.asarray(read, dtype=np.bool_), np.array(pkt_len, dtype=np.int64),
+            np.array(ts, dtype=np.float64), KERNEL_INTERVALS, sqr.table_array,
+            sqrt_mu.table_array, stats)
+
+        # The decay factors are 1 or 0.5, as in decay_check().
+        self.decay_ip       = 1 if self.decay_ip == 1 else 0.5
+        self.decay_five_t   = 1 if self.decay_five_t == 1 else 0.5
+
+        return stats
+
+    # Flow-partitioned equivalent of the hashing, register updates and statistics of
+    # process_batch() (see fc_parallel.py). Returns the (n_ip, 21) statistics.
+    def __process_partitioned__(self, cols, ip_idx, decay_cntr, read):
+        if self.partition is None:
+            from fc_parallel import FlowPartition
+            self.partition = FlowPartition(self, self.workers, len(cols['valid']), KERNEL_INTERVALS,
+                                           sqr.table_array, sqrt_mu.table_array)
+
+        stats, (decay_ip, decay_five_t) = self.partition.process(
+            {name: cols[name][ip_idx] for name in cols}, np.array(decay_cntr, dtype=np.int64), read)
+
+        # The decay factors are 1 or 0.5, as in decay_check().
+        self.decay_ip       = 1 if decay_ip == 1 else 0.5
+        self.decay_five_t   = 1 if decay_five_t == 1 else 0.5
+
+        return stats
+
+    # Gathers the registers of the simulator workers, if any (see fc_parallel.py).
+    def sync(self):
+        if self.partition is not None:
+            self.partition.sync()
+
+    # Stops the simulator workers, if any, once their registers are gathered.
+    def close(self):
+        if self.partition is not None:
+            self.partition.sync()
+            self.partition.close()
+            self.partition = None
+
+    # Decay counter values of the next n IPv4 packets (same sequence as process()).
+    # The decay counter advances on every packet except, for sampling rates above 1,
+    # once every sampling_rate packets.
+    def __decay_cntr_batch__(self, n):
+        steps = np.arange(n)
+
+        if self.sampling_rate == 1:
+            advance = np.ones(n, dtype=np.int64)
+        else:
+            first_skip  = self.sampling_rate - self.sampl_pkt_index
+            skip        = (steps >= first_skip) & ((steps - first_skip) % self.sampling_rate == 0)
+            advance     = (~skip).astype(np.int64)
+
+            if n > 0:
+                last = n - 1 - first_skip
+                if last < 0:
+                    self.sampl_pkt_index += n
+                else:
+                    self.sampl_pkt_index = 1 + last % self.sampling_rate
+
+        advances    = np.cumsum(advance)
+        decay_cntr  = np.where(advances > 0, (self.decay_cntr - 1 + advances) % 4 + 1, self.decay_cntr)
+
+        if n > 0:
+            self.decay_cntr = int(decay_cntr[-1])
+
+        return decay_cntr.tolist()
+
+    # Sequential part of process() after the decay check: residues, sum of residual products
+    # and the flow A->B update / flow B->A read. Appends the register values needed for the
+    # statistics calculation to raw.
+    def __update_registers__(self, read, raw):
+        # 1D: MAC src, IP src
+        for fc, slot in ((self.fc_mac_ip_src, self.hash_mac_ip_src), (self.fc_ip_src, self.hash_ip_src)):
+            raw[0 if fc is self.fc_mac_ip_src else 3].append(int(fc.pkt_cnt[slot]))
+            raw[1 if fc is self.fc_mac_ip_src else 4].append(int(fc.pkt_len[slot]))
+            raw[2 if fc is self.fc_mac_ip_src else 5].append(int(fc.ss[slot]))
+
+        # IP and 5-tuple
+        for (fc, hash_0, hash_1, hash_xor, decay, offset) in \
+                ((self.fc_ip, self.hash_ip_0, self.hash_ip_1, self.hash_ip_xor, self.decay_ip, 6),
+                 (self.fc_five_t, self.hash_five_t_0, self.hash_five_t_1, self.hash_five_t_xor,
+                  self.decay_five_t, 13)):
+            pkt_cnt_0   = int(fc.pkt_cnt[hash_0])
+            pkt_len     = int(fc.pkt_len[hash_0])
+            pkt_len_sqr = int(fc.ss[hash_0])
+            mean_0      = pkt_len >> self.pow_2(pkt_cnt_0)
+
+            # Calculate the residual products from flows A->B and B->A.
+            res_0 = pkt_len - mean_0
+            fc.res[hash_0] = res_0
+            if fc.valid[hash_1]:
+                res_1 = int(fc.res[hash_1])
+            else:
+                res_1 = 0
+
+            # Update the Sum of Residual Products.
+            if res_1 != 0 and decay == 1:
+                fc.res_sum[hash_xor] += (res_0 << self.pow_2(res_1))
+
+            pkt_cnt_1 = pkt_len_sqr_1 = mean_1 = res_sum = 0
+            if not read:
+                # Update
+                fc.cur_pkt_cnt[hash_0]  = pkt_cnt_0
+                fc.cur_ss[hash_0]       = pkt_len_sqr
+                fc.cur_mean[hash_0]     = mean_0
+            elif fc.valid[hash_1]:
+                # Read
+                pkt_cnt_1       = int(fc.cur_pkt_cnt[hash_1])
+                pkt_len_sqr_1   = int(fc.cur_ss[hash_1])
+                mean_1          = int(fc.cur_mean[hash_1])
+
+            if read:
+                res_sum = int(fc.res_sum[hash_xor])
+
+            for k, val in enumerate((pkt_cnt_0, pkt_len_sqr, mean_0,
+                                     pkt_cnt_1, pkt_len_sqr_1, mean_1, res_sum)):
+                raw[offset + k].append(val)
+
+    def stats_calc_1d_batch(self, pkt_cnt, pkt_len, pkt_len_sqr):
+        mean = pkt_len >> pow_2_array(pkt_cnt)
+        return [mean, self.std_dev_batch(pkt_cnt, pkt_len_sqr, mean)]
+
+    def std_dev_batch(self, pkt_cnt, pkt_len_sqr, mean):
+        return sqrt_mu.compute_array(np.abs((pkt_len_sqr >> pow_2_array(pkt_cnt)) - sqr.compute_array(mean)))
+
+    # Batched 2D statistics (magnitude, radius, covariance, PCC); 0 for packets without a read.
+    def stats_calc_2d_batch(self, pkt_cnt_0, pkt_cnt_1, mean_0, mean_1, pkt_len_sqr_0,
+                            pkt_len_sqr_1, res_sum, std_dev_0, read):
+        variance_0 = np.abs((pkt_len_sqr_0 >> pow_2_array(pkt_cnt_0)) - sqr.compute_array(mean_0))
+        variance_1 = np.abs((pkt_len_sqr_1 >> pow_2_array(pkt_cnt_1)) - sqr.compute_array(mean_1))
+        std_dev_1 = sqrt_mu.compute_array(variance_1)
+
+        # Magnitude
+        magnitude = sqrt_mu.compute_array(sqr.compute_array(mean_0) + sqr.compute_array(mean_1))
+
+        # Radius
+        radius = sqrt_mu.compute_array(sqr.compute_array(variance_0) + sqr.compute_array(variance_1))
+
+        # Covariance
+        cov = res_sum >> pow_2_array(pkt_cnt_0 + pkt_cnt_1)
+
+        # PCC
+        pow_2_std_dev_1 = pow_2_array(std_dev_1)
+        pcc_shift = pow_2_array(std_dev_0 << pow_2_std_dev_1)
+        pcc = np.where((pow_2_std_dev_1 != 0) & (pcc_shift != 0), cov >> pcc_shift, 0)
+
+        return [np.where(read, magnitude, 0), np.where(read, radius, 0),
+                np.where(read, cov, 0), np.where(read, pcc, 0)]
+
+    def hash_calc(self, key):
+        # CRC16, sliced to 13 bits (0-8191).
+        # To each hash value we then sum 8192 * (self.decay_cntr - 1)
+        # in order to obtain the current position based on the decay counter value.
+        # Hash xor values are used to access the sum of residual products.
+        # Xor is used since the value is the same for both flow directions.
+        offset = 8192 * (self.decay_cntr - 1)
+
+        (self.hash_mac_ip_src, self.hash_ip_src,
+         self.hash_ip_0, self.hash_ip_1, self.hash_ip_xor,
+         self.hash_five_t_0, self.hash_five_t_1, self.hash_five_t_xor) = \
+            [slot + offset for slot in self.hasher.hash_key(key)]
+
     def stats_calc_1d(self, pkt_cnt, pkt_len, pkt_len_sqr):
         # Mean
         mean = pkt_len >> self.pow_2(pkt_cnt)
@@ -392,285 +768,111 @@ class FCKitNET:
         self.decay_five_t = 1
 
         # MAC src, IP src
+        self.decay_check_1d(self.fc_mac_ip_src, self.hash_mac_ip_src)
 
-        # Check if the current flow ID has already been seen.
-        # If it exists, calculate the decay.
-        # Else, initialize all values and perform the update from the current pkt.
-        if self.hash_mac_ip_src in self.fc_mac_ip_src:
-            mac_ip_src_ts_interval = \
-                self.cur_pkt[1] - self.fc_mac_ip_src[self.hash_mac_ip_src][0][self.decay_cntr-1]
-
-            decay = 1
-
-            # Check if the current decay counter has been previously updated.
-            # If so, perform the decay factor update.
-            # Else, the current decay counter value becomes the current pkt timestamp.
-            if self.fc_mac_ip_src[self.hash_mac_ip_src][0][self.decay_cntr-1]:
-                if self.decay_cntr == 1 and mac_ip_src_ts_interval > 0.1:
-                    decay = 0.5
-                    self.fc_mac_ip_src[self.hash_mac_ip_src][0][0] += 0.1
-                elif self.decay_cntr == 2 and mac_ip_src_ts_interval > 1:
-                    decay = 0.5
-                    self.fc_mac_ip_src[self.hash_mac_ip_src][0][1] += 1
-                elif self.decay_cntr == 3 and mac_ip_src_ts_interval > 10:
-                    decay = 0.5
-                    self.fc_mac_ip_src[self.hash_mac_ip_src][0][2] += 10
-                elif self.decay_cntr == 4 and mac_ip_src_ts_interval > 60:
-                    decay = 0.5
-                    self.fc_mac_ip_src[self.hash_mac_ip_src][0][3] += 60
-                else:
-                    self.fc_mac_ip_src[self.hash_mac_ip_src][0][self.decay_cntr-1] = self.cur_pkt[1]
-            else:
-                self.fc_mac_ip_src[self.hash_mac_ip_src][0][self.decay_cntr-1] = self.cur_pkt[1]
-
-            # Decay factor: pkt count.
-            self.fc_mac_ip_src[self.hash_mac_ip_src][self.decay_cntr][0] = \
-                int(decay * self.fc_mac_ip_src[self.hash_mac_ip_src][self.decay_cntr][0] + 1)
-
-            # If the decay will not be applied, simply update the values from the current pkt.
-            # Else, update the values with the current decay factor.
-            if decay == 1:
-                # Pkt length.
-                self.fc_mac_ip_src[self.hash_mac_ip_src][self.decay_cntr][1] = \
-                    int(self.fc_mac_ip_src[self.hash_mac_ip_src][self.decay_cntr][1] + self.cur_pkt[0])
-                # Pkt length squared.
-                self.fc_mac_ip_src[self.hash_mac_ip_src][self.decay_cntr][2] = \
-                    int(self.fc_mac_ip_src[self.hash_mac_ip_src][self.decay_cntr][2] + sqr.compute(self.cur_pkt[0]))
-            else:
-                # Pkt length.
-                self.fc_mac_ip_src[self.hash_mac_ip_src][self.decay_cntr][1] = \
-                    int(decay * self.fc_mac_ip_src[self.hash_mac_ip_src][self.decay_cntr][1])
-                # Pkt length squared.
-                self.fc_mac_ip_src[self.hash_mac_ip_src][self.decay_cntr][2] = \
-                    int(decay * self.fc_mac_ip_src[self.hash_mac_ip_src][self.decay_cntr][2])
+        # IP src
+        self.decay_check_1d(self.fc_ip_src, self.hash_ip_src)
 
-        else:
-            self.fc_mac_ip_src[self.hash_mac_ip_src] = ([[0, 0, 0, 0],
-                                                            [0, 0, 0],
-                                                            [0, 0, 0],
-                                                            [0, 0, 0],
-                                                            [0, 0, 0]])
-            self.fc_mac_ip_src[self.hash_mac_ip_src][0][self.decay_cntr-1] = self.cur_pkt[1]
-            self.fc_mac_ip_src[self.hash_mac_ip_src][self.decay_cntr] = \
-                [1, self.cur_pkt[0], sqr.compute(self.cur_pkt[0])]
+        # IP
+        self.decay_ip = self.decay_check_2d(self.fc_ip, self.hash_ip_0, self.hash_ip_xor)
 
-        # IP src
+        # Five tuple
+        self.decay_five_t = self.decay_check_2d(self.fc_five_t, self.hash_five_t_0,
+                                                self.hash_five_t_xor)
 
+    # Decay check and update for a 1D flow key slot.
+    def decay_check_1d(self, fc, slot):
         # Check if the current flow ID has already been seen.
         # If it exists, calculate the decay.
         # Else, initialize all values and perform the update from the current pkt.
-        if self.hash_ip_src in self.fc_ip_src:
-            ip_src_ts_interval = self.cur_pkt[1] - self.fc_ip_src[self.hash_ip_src][0][self.decay_cntr-1]
+        if fc.valid[slot]:
+            ts_interval = self.cur_pkt[1] - fc.ts[slot]
 
             decay = 1
 
             # Check if the current decay counter has been previously updated.
             # If so, perform the decay factor update.
             # Else, the current decay counter value becomes the current pkt timestamp.
-            if self.fc_ip_src[self.hash_ip_src][0][self.decay_cntr-1]:
-                if self.decay_cntr == 1 and ip_src_ts_interval > 0.1:
-                    decay = 0.5
-                    self.fc_ip_src[self.hash_ip_src][0][0] += 0.1
-                elif self.decay_cntr == 2 and ip_src_ts_interval > 1:
-                    decay = 0.5
-                    self.fc_ip_src[self.hash_ip_src][0][1] += 1
-                elif self.decay_cntr == 3 and ip_src_ts_interval > 10:
-                    decay = 0.5
-                    self.fc_ip_src[self.hash_ip_src][0][2] += 10
-                elif self.decay_cntr == 4 and ip_src_ts_interval > 60:
-                    decay = 0.5
-                    self.fc_ip_src[self.hash_ip_src][0][3] += 60
-                else:
-                    self.fc_ip_src[self.hash_ip_src][0][self.decay_cntr-1] = self.cur_pkt[1]
+            if fc.ts[slot] and ts_interval > DECAY_INTERVALS[self.decay_cntr-1]:
+                decay = 0.5
+                fc.ts[slot] += DECAY_INTERVALS[self.decay_cntr-1]
             else:
-                self.fc_ip_src[self.hash_ip_src][0][self.decay_cntr-1] = self.cur_pkt[1]
+                fc.ts[slot] = self.cur_pkt[1]
 
             # Decay factor: pkt count.
-            self.fc_ip_src[self.hash_ip_src][self.decay_cntr][0] = \
-                int(decay * self.fc_ip_src[self.hash_ip_src][self.decay_cntr][0] + 1)
+            fc.pkt_cnt[slot] = int(decay * fc.pkt_cnt[slot] + 1)
 
             # If the decay will not be applied, simply update the values from the current pkt.
             # Else, update the values with the current decay factor.
             if decay == 1:
                 # Pkt length.
-                self.fc_ip_src[self.hash_ip_src][self.decay_cntr][1] = \
-                    int(self.fc_ip_src[self.hash_ip_src][self.decay_cntr][1] + self.cur_pkt[0])
-                # Pkt length squared.
-                self.fc_ip_src[self.hash_ip_src][self.decay_cntr][2] = \
-                    int(self.fc_ip_src[self.hash_ip_src][self.decay_cntr][2] + sqr.compute(self.cur_pkt[0]))
-            else:
-                # Pkt length.
-                self.fc_ip_src[self.hash_ip_src][self.decay_cntr][1] = \
-                    int(decay * self.fc_ip_src[self.hash_ip_src][self.decay_cntr][1])
-                # Pkt length squared.
-                self.fc_ip_src[self.hash_ip_src][self.decay_cntr][2] = \
-                    int(decay * self.fc_ip_src[self.hash_ip_src][self.decay_cntr][2])
-
-        else:
-            self.fc_ip_src[self.hash_ip_src] = ([[0, 0, 0, 0],
-                                                    [0, 0, 0],
-                                                    [0, 0, 0],
-                                                    [0, 0, 0],
-                                                    [0, 0, 0]])
-            self.fc_ip_src[self.hash_ip_src][0][self.decay_cntr-1] = self.cur_pkt[1]
-            self.fc_ip_src[self.hash_ip_src][self.decay_cntr] = \
-                [1, self.cur_pkt[0], sqr.compute(self.cur_pkt[0])]
-
-        # IP
-
-        if self.hash_ip_0 not in self.ip_res:
-            self.ip_res[self.hash_ip_0] = [0, 0, 0, 0]
-
-        if self.hash_ip_xor not in self.ip_res_sum:
-            self.ip_res_sum[self.hash_ip_xor] = ([[0, 0, 0, 0], 0, 0, 0, 0])
-
-        # Check if the current flow ID has already been seen.
-        # If it exists, calculate the decay.
-        # Else, initialize all values and perform the update from the current pkt.
-        if self.hash_ip_0 in self.fc_ip:
-            ip_ts_interval = self.cur_pkt[1] - self.fc_ip[self.hash_ip_0][0][self.decay_cntr-1]
-
-            # Check if the current decay counter has been previously updated.
-            # If so, perform the decay factor update.
-            # Else, the current decay counter value becomes the current pkt timestamp.
-            if self.fc_ip[self.hash_ip_0][0][self.decay_cntr-1]:
-                if self.decay_cntr == 1 and ip_ts_interval > 0.1:
-                    self.decay_ip = 0.5
-                    self.fc_ip[self.hash_ip_0][0][0] += 0.1
-                    self.ip_res_sum[self.hash_ip_xor][0][0] += 0.1
-                elif self.decay_cntr == 2 and ip_ts_interval > 1:
-                    self.decay_ip = 0.5
-                    self.fc_ip[self.hash_ip_0][0][1] += 1
-                    self.ip_res_sum[self.hash_ip_xor][0][1] += 1
-                elif self.decay_cntr == 3 and ip_ts_interval > 10:
-                    self.decay_ip = 0.5
-                    self.fc_ip[self.hash_ip_0][0][2] += 10
-                    self.ip_res_sum[self.hash_ip_xor][0][2] += 10
-                elif self.decay_cntr == 4 and ip_ts_interval > 60:
-                    self.decay_ip = 0.5
-                    self.fc_ip[self.hash_ip_0][0][3] += 60
-                    self.ip_res_sum[self.hash_ip_xor][0][3] += 60
-                else:
-                    self.fc_ip[self.hash_ip_0][0][self.decay_cntr-1] = self.cur_pkt[1]
-                    self.ip_res_sum[self.hash_ip_xor][0][self.decay_cntr-1] = self.cur_pkt[1]
-            else:
-                self.fc_ip[self.hash_ip_0][0][self.decay_cntr-1] = self.cur_pkt[1]
-                self.ip_res_sum[self.hash_ip_xor][0][self.decay_cntr-1] = self.cur_pkt[1]
-
-            # Decay factor: pkt count.
-            self.fc_ip[self.hash_ip_0][self.decay_cntr][0] = \
-                int(self.decay_ip * self.fc_ip[self.hash_ip_0][self.decay_cntr][0] + 1)
-
-            # If the decay will not be applied, simply update the values from the current pkt.
-            # Else, update the values with the current decay factor.
-            if self.decay_ip == 1:
-                # Pkt length.
-                self.fc_ip[self.hash_ip_0][self.decay_cntr][1] = \
-                    int(self.fc_ip[self.hash_ip_0][self.decay_cntr][1] + self.cur_pkt[0])
+                fc.pkt_len[slot] = int(fc.pkt_len[slot] + self.cur_pkt[0])
                 # Pkt length squared.
-                self.fc_ip[self.hash_ip_0][self.decay_cntr][2] = \
-                    int(self.fc_ip[self.hash_ip_0][self.decay_cntr][2] + sqr.compute(self.cur_pkt[0]))
+                fc.ss[slot] = int(fc.ss[slot] + sqr.compute(self.cur_pkt[0]))
             else:
                 # Pkt length.
-                self.fc_ip[self.hash_ip_0][self.decay_cntr][1] = \
-                    int(self.decay_ip * self.fc_ip[self.hash_ip_0][self.decay_cntr][1])
+                fc.pkt_len[slot] = int(decay * fc.pkt_len[slot])
                 # Pkt length squared.
-                self.fc_ip[self.hash_ip_0][self.decay_cntr][2] = \
-                    int(self.decay_ip * self.fc_ip[self.hash_ip_0][self.decay_cntr][2])
-                # Sum of residual products.
-                self.ip_res_sum[self.hash_ip_xor][self.decay_cntr] = \
-                    int(self.decay_ip * self.ip_res_sum[self.hash_ip_xor][self.decay_cntr])
+                fc.ss[slot] = int(decay * fc.ss[slot])
 
         else:
-            self.fc_ip[self.hash_ip_0] = ([[0, 0, 0, 0],
-                                              [0, 0, 0, 0, 0, 0],
-                                              [0, 0, 0, 0, 0, 0],
-                                              [0, 0, 0, 0, 0, 0],
-                                              [0, 0, 0, 0, 0, 0]])
-            self.fc_ip[self.hash_ip_0][0][self.decay_cntr-1] = self.cur_pkt[1]
-            self.fc_ip[self.hash_ip_0][self.decay_cntr] = \
-                [1, self.cur_pkt[0], sqr.compute(self.cur_pkt[0]), 0, 0, 0]
-
-        # Five tuple
+            fc.valid[slot]      = True
+            fc.ts[slot]         = self.cur_pkt[1]
+            fc.pkt_cnt[slot]    = 1
+            fc.pkt_len[slot]    = self.cur_pkt[0]
+            fc.ss[slot]         = sqr.compute(self.cur_pkt[0])
 
-        if self.hash_five_t_0 not in self.five_t_res:
-            self.five_t_res[self.hash_five_t_0] = [0, 0, 0, 0]
-
-        if self.hash_five_t_xor not in self.five_t_res_sum:
-            self.five_t_res_sum[self.hash_five_t_xor] = ([[0, 0, 0, 0], 0, 0, 0, 0])
+    # Decay check and update for a 2D flow key slot, including the sum of residual products
+    # (xor slot). Returns the applied decay factor.
+    def decay_check_2d(self, fc, slot, slot_xor):
+        decay = 1
 
         # Check if the current flow ID has already been seen.
         # If it exists, calculate the decay.
         # Else, initialize all values and perform the update from the current pkt.
-        if self.hash_five_t_0 in self.fc_five_t:
-            five_t_ts_interval = \
-                self.cur_pkt[1] - self.fc_five_t[self.hash_five_t_0][0][self.decay_cntr-1]
+        if fc.valid[slot]:
+            ts_interval = self.cur_pkt[1] - fc.ts[slot]
 
             # Check if the current decay counter has been previously updated.
             # If so, perform the decay factor update.
             # Else, the current decay counter value becomes the current pkt timestamp.
-            if self.fc_five_t[self.hash_five_t_0][0][self.decay_cntr-1]:
-                if self.decay_cntr == 1 and five_t_ts_interval > 0.1:
-                    self.decay_five_t = 0.5
-                    self.fc_five_t[self.hash_five_t_0][0][0] += 0.1
-                    self.five_t_res_sum[self.hash_five_t_xor][0][0] += 0.1
-                elif self.decay_cntr == 2 and five_t_ts_interval > 1:
-                    self.decay_five_t = 0.5
-                    self.fc_five_t[self.hash_five_t_0][0][1] += 1
-                    self.five_t_res_sum[self.hash_five_t_xor][0][1] += 1
-                elif self.decay_cntr == 3 and five_t_ts_interval > 10:
-                    self.decay_five_t = 0.5
-                    self.fc_five_t[self.hash_five_t_0][0][2] += 10
-                    self.five_t_res_sum[self.hash_five_t_xor][0][2] += 10
-                elif self.decay_cntr == 4 and five_t_ts_interval > 60:
-                    self.decay_five_t = 0.5
-                    self.fc_five_t[self.hash_five_t_0][0][3] += 60
-                    self.five_t_res_sum[self.hash_five_t_xor][0][3] += 60
-                else:
-                    self.fc_five_t[self.hash_five_t_0][0][self.decay_cntr-1] = self.cur_pkt[1]
-                    self.five_t_res_sum[self.hash_five_t_xor][0][self.decay_cntr-1] = \
-                        self.cur_pkt[1]
+            if fc.ts[slot] and ts_interval > DECAY_INTERVALS[self.decay_cntr-1]:
+                decay = 0.5
+                fc.ts[slot]             += DECAY_INTERVALS[self.decay_cntr-1]
+                fc.res_sum_ts[slot_xor] += DECAY_INTERVALS[self.decay_cntr-1]
             else:
-                self.fc_five_t[self.hash_five_t_0][0][self.decay_cntr-1] = self.cur_pkt[1]
-                self.five_t_res_sum[self.hash_five_t_xor][0][self.decay_cntr-1] = self.cur_pkt[1]
+                fc.ts[slot]             = self.cur_pkt[1]
+                fc.res_sum_ts[slot_xor] = self.cur_pkt[1]
 
             # Decay factor: pkt count.
-            self.fc_five_t[self.hash_five_t_0][self.decay_cntr][0] = \
-                int(self.decay_five_t *
-                    self.fc_five_t[self.hash_five_t_0][self.decay_cntr][0] + 1)
+            fc.pkt_cnt[slot] = int(decay * fc.pkt_cnt[slot] + 1)
 
             # If the decay will not be applied, simply update the values from the current pkt.
             # Else, update the values with the current decay factor.
-            if self.decay_five_t == 1:
+            if decay == 1:
                 # Pkt length.
-                self.fc_five_t[self.hash_five_t_0][self.decay_cntr][1] = \
-                    int(self.fc_five_t[self.hash_five_t_0][self.decay_cntr][1] + self.cur_pkt[0])
+                fc.pkt_len[slot] = int(fc.pkt_len[slot] + self.cur_pkt[0])
                 # Pkt length squared.
-                self.fc_five_t[self.hash_five_t_0][self.decay_cntr][2] = \
-                    int(self.fc_five_t[self.hash_five_t_0][self.decay_cntr][2] +
-                        sqr.compute(self.cur_pkt[0]))
+                fc.ss[slot] = int(fc.ss[slot] + sqr.compute(self.cur_pkt[0]))
             else:
                 # Pkt length.
-                self.fc_five_t[self.hash_five_t_0][self.decay_cntr][1] = \
-                    int(self.decay_five_t *
-                        self.fc_five_t[self.hash_five_t_0][self.decay_cntr][1])
+                fc.pkt_len[slot] = int(decay * fc.pkt_len[slot])
                 # Pkt length squared.
-                self.fc_five_t[self.hash_five_t_0][self.decay_cntr][2] = \
-                    int(self.decay_five_t *
-                        self.fc_five_t[self.hash_five_t_0][self.decay_cntr][2])
+                fc.ss[slot] = int(decay * fc.ss[slot])
                 # Sum of residual products.
-                self.five_t_res_sum[self.hash_five_t_xor][self.decay_cntr] = \
-                    int(self.decay_five_t * self.five_t_res_sum[self.hash_five_t_xor][self.decay_cntr])
+                fc.res_sum[slot_xor] = int(decay * fc.res_sum[slot_xor])
 
         else:
-            self.fc_five_t[self.hash_five_t_0] = ([[0, 0, 0, 0],
-                                                      [0, 0, 0, 0, 0, 0],
-                                                      [0, 0, 0, 0, 0, 0],
-                                                      [0, 0, 0, 0, 0, 0],
-                                                      [0, 0, 0, 0, 0, 0]])
-            self.fc_five_t[self.hash_five_t_0][0][self.decay_cntr-1] = self.cur_pkt[1]
-            self.fc_five_t[self.hash_five_t_0][self.decay_cntr] = \
-                [1, self.cur_pkt[0], sqr.compute(self.cur_pkt[0]), 0, 0, 0]
+            fc.valid[slot]          = True
+            fc.ts[slot]             = self.cur_pkt[1]
+            fc.pkt_cnt[slot]        = 1
+            fc.pkt_len[slot]        = self.cur_pkt[0]
+            fc.ss[slot]             = sqr.compute(self.cur_pkt[0])
+            fc.cur_pkt_cnt[slot]    = 0
+            fc.cur_ss[slot]         = 0
+            fc.cur_mean[slot]       = 0
+
+        return decay
 
     # Returns the nearest lower power of two.
     def pow_2(self, n):
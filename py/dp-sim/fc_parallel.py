@@ -0,0 +1,201 @@
+import mmap
+import time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from register_file import REG_SIZE
+from metrics import METRICS
+import fc_kernel
+
+# Flow-partitioned feature computation over worker processes (FCKitNET workers > 1).
+# The decay counters and read/write alternation only depend on the packet index, and the hashes
+# only on the packet, so both are computed for the whole chunk upfront (the hashes by the
+# workers, each on a range of packets). The register slots are then split among the workers
+# (slot % n_workers) in each of the four tables: every worker runs the decay checks, counter
+# updates and statistics of the packets of its own slots (fc_kernel.partition_chunk), in packet
+# order. For the 2D keys, the two directions of a flow and the sum of residual products they share
+# (xor slot) usually live on different slots: what links them (residues and counters read from
+# flow B->A, sums of residual products) is cheap and is replayed in packet order by the main
+# process (fc_kernel.merge_2d) from the results of the workers, for the two keys in parallel
+# (the kernels release the GIL).
+# Chunks go through shared memory (anonymous shared mappings, inherited by the forked workers);
+# the pipes only carry the phases. Each worker keeps the registers of its own slots, which are
+# gathered by sync(). The output is bit-exact with the single process engines.
+
+STAGE_HASHING   = METRICS.stage('hashing')
+STAGE_KERNEL    = METRICS.stage('kernel')
+STAGE_MERGE     = METRICS.stage('merge')
+
+KEY_COLS    = ('mac_src', 'ip_src', 'ip_dst', 'proto', 'port_src', 'port_dst')
+CHUNK_COLS  = [(name, np.int64) for name in KEY_COLS] + \
+              [('pkt_len', np.int64), ('ts', np.float64), ('decay_cntr', np.int64),
+               ('read', np.bool_)]
+
+# Registers kept by the workers (the main process keeps the sums of residual products).
+FLOW_FIELDS_2D = ['valid', 'ts', 'pkt_cnt', 'pkt_len', 'ss', 'cur_pkt_cnt', 'cur_ss', 'cur_mean',
+                  'res']
+
+
+# Array in an anonymous shared mapping, shared with the processes forked afterwards.
+def shared_array(shape, dtype):
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    buf   = mmap.mmap(-1, max(count * dtype.itemsize, 1))
+    return np.frombuffer(buf, dtype=dtype, count=count).reshape(shape)
+
+
+def __worker__(conn, partition, worker):
+    conn.send(None)
+
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            conn.send(None)
+            break
+        phase, n = msg
+        if phase == 'hash':
+            partition.hash_range(worker, n)
+            conn.send(None)
+        elif phase == 'update':
+            partition.update(worker, n)
+            conn.send(None)
+        elif phase == 'registers':
+            conn.send(partition.owned_registers(worker))
+
+    conn.close()
+
+
+class FlowPartition:
+    # fc: the FCKitNET whose registers are partitioned (its registers and hasher are used).
+    # capacity: maximum chunk size (larger chunks are processed in parts).
+    # intervals, sqr_table, sqrt_table: decay intervals and math unit tables of the kernels.
+    def __init__(self, fc, n_workers, capacity, intervals, sqr_table, sqrt_table):
+        self.fc         = fc
+        self.n_workers  = n_workers
+        self.capacity   = capacity
+        self.intervals  = intervals
+        self.sqr_table  = sqr_table
+        self.sqrt_table = sqrt_table
+        self.owner      = np.arange(REG_SIZE) % n_workers   # Worker of each slot.
+
+        self.cols   = {name: shared_array(capacity, dtype) for name, dtype in CHUNK_COLS}
+        self.hashes = shared_array((capacity, 8), np.int64)
+        self.stats  = shared_array((capacity, 21), np.int64)
+        self.flows  = shared_array((2, 3, capacity), np.int64)
+
+        # Thread of the 5-tuple merge (the IP one runs in the calling thread).
+        self.merger = ThreadPoolExecutor(1)
+
+        ctx         = multiprocessing.get_context('fork')
+        self.conns  = []
+        self.procs  = []
+        for w in range(n_workers):
+            conn, worker_conn = ctx.Pipe()
+            proc = ctx.Process(target=__worker__, args=(worker_conn, self, w), daemon=True)
+            proc.start()
+            worker_conn.close()
+            self.conns.append(conn)
+            self.procs.append(proc)
+
+        self.__wait__()
+
+    # Waits for all the workers to complete the current phase.
+    def __wait__(self):
+        return [conn.recv() for conn in self.conns]
+
+    def __run__(self, phase, n):
+        for conn in self.conns:
+            conn.send((phase, n))
+        return self.__wait__()
+
+    # Worker side: hashes of the worker's range of the chunk, with the decay counter offset.
+    def hash_range(self, worker, n):
+        lo      = n * worker // self.n_workers
+        hi      = n * (worker + 1) // self.n_workers
+        hashes  = self.fc.hasher.hash_batch(*(self.cols[name][lo:hi] for name in KEY_COLS))
+        self.hashes[lo:hi] = hashes + 8192 * (self.cols['decay_cntr'][lo:hi, None] - 1)
+
+    # Worker side: register updates and statistics of the worker's slots.
+    def update(self, worker, n):
+        regs = self.fc.registers
+        fc_kernel.partition_chunk(regs.mac_ip_src.regs, regs.ip_src.regs, regs.ip.regs,
+                                  regs.five_t.regs, self.hashes[:n], self.cols['decay_cntr'][:n],
+                                  self.cols['read'][:n], self.cols['pkt_len'][:n],
+                                  self.cols['ts'][:n], self.intervals, self.sqr_table,
+                                  self.sqrt_table, worker, self.n_workers, self.stats[:n],
+                                  self.flows[:, :, :n])
+
+    # Worker side: registers of the worker's slots.
+    def owned_registers(self, worker):
+        slots = self.owner == worker
+        return {name: table.regs[slots] for name, table in self.fc.registers.tables().items()}
+
+    # Processes a chunk of IPv4 packets (see FCKitNET.process_batch): cols are the chunk columns
+    # of these packets. Returns the (n, 21) statistics (decay counter column included) and the
+    # decay factors of the IP and 5-tuple keys of the last packet.
+    def process(self, cols, decay_cntr, read):
+        n       = len(decay_cntr)
+        stats   = np.zeros((n, 21), dtype=np.int64)
+        decay   = (1.0, 1.0)
+
+        for lo in range(0, n, self.capacity):
+            hi      = min(lo + self.capacity, n)
+            decay   = self.__process_part__(cols, decay_cntr, read, lo, hi, stats[lo:hi])
+
+        stats[:, 0] = decay_cntr
+        return stats, decay
+
+    def __process_part__(self, cols, decay_cntr, read, lo, hi, stats):
+        n = hi - lo
+        for name in KEY_COLS + ('pkt_len', 'ts'):
+            self.cols[name][:n] = cols[name][lo:hi]
+        self.cols['decay_cntr'][:n] = decay_cntr[lo:hi]
+        self.cols['read'][:n]       = read[lo:hi]
+        self.stats[:n]              = 0
+
+        start = time.perf_counter_ns()
+        self.__run__('hash', n)
+        hashed = time.perf_counter_ns()
+        STAGE_HASHING.observe(hashed - start, n)
+
+        self.__run__('update', n)
+        updated = time.perf_counter_ns()
+        STAGE_KERNEL.observe(updated - hashed, n)
+
+        # Replay of the links between the slots of the 2D keys, in packet order.
+        five_t      = self.merger.submit(self.__merge__, 1, n)
+        decay_ip    = self.__merge__(0, n)
+        decay       = (decay_ip, five_t.result())
+        STAGE_MERGE.observe(time.perf_counter_ns() - updated, n)
+
+        stats[:] = self.stats[:n]
+        return decay
+
+    # Merge of the 2D key (0: IP, 1: 5-tuple). Returns the decay factor of the last packet.
+    def __merge__(self, key, n):
+        table, hash_col, col = ((self.fc.registers.ip, 2, 7), (self.fc.registers.five_t, 5, 14))[key]
+        return fc_kernel.merge_2d(table.regs, self.hashes[:n], hash_col, self.cols['decay_cntr'][:n],
+                                  self.cols['read'][:n], self.cols['ts'][:n], self.intervals,
+                                  self.flows[key, :, :n], self.sqr_table, self.sqrt_table,
+                                  self.stats[:n], col)
+
+    # Gathers the registers of the workers' slots, so that the registers of fc are complete
+    # (e.g. for a snapshot).
+    def sync(self):
+        tables = self.fc.registers.tables()
+        for w, owned in enumerate(self.__run__('registers', 0)):
+            slots = self.owner == w
+            for name, regs in owned.items():
+                if name in ('ip', 'five_t'):
+                    for field in FLOW_FIELDS_2D:
+                        tables[name].regs[field][slots] = regs[field]
+                else:
+                    tables[name].regs[slots] = regs
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+        self.__wait__()
+        for proc in self.procs:
+            proc.join()
+        self.merger.shutdown()
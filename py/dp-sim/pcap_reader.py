@@ -0,0 +1,272 @@
+import mmap
+import struct
+import numpy as np
+
+# Streaming pcap/pcapng reader for the data plane simulator.
+# The trace is memory-mapped and walked record by record; packet headers are then parsed
+# for a whole batch at once into fixed-dtype NumPy columns, with the same field semantics
+# as the tshark csv used by FCKitNET (see FCKitNET.parse_pcap).
+
+# pcap magic numbers (microsecond and nanosecond timestamps), as read in little endian.
+PCAP_MAGIC_US       = 0xa1b2c3d4
+PCAP_MAGIC_NS       = 0xa1b23c4d
+PCAP_MAGIC_US_SWAP  = 0xd4c3b2a1
+PCAP_MAGIC_NS_SWAP  = 0x4d3cb2a1
+
+# pcapng block types.
+PCAPNG_SHB          = 0x0A0D0D0A    # Section header block.
+PCAPNG_IDB          = 0x00000001    # Interface description block.
+PCAPNG_SPB          = 0x00000003    # Simple packet block.
+PCAPNG_EPB          = 0x00000006    # Enhanced packet block.
+PCAPNG_BYTE_ORDER   = 0x1A2B3C4D
+PCAPNG_IF_TSRESOL   = 9
+
+# Link types.
+LINKTYPE_ETHERNET   = 1
+LINKTYPE_RAW        = 101
+LINKTYPE_LINUX_SLL  = 113
+LINKTYPE_IPV4       = 228
+
+ETH_TYPE_IPV4       = 0x0800
+ETH_TYPE_VLAN       = 0x8100
+ETH_TYPE_QINQ       = 0x88a8
+
+IP_PROTO_TCP        = 6
+IP_PROTO_UDP        = 17
+
+# Consumed pages are released from the mapping every RELEASE_SIZE bytes,
+# which bounds the resident size of the trace.
+RELEASE_SIZE        = 1 << 26
+
+
+class PcapReader:
+    # Reads a pcap or pcapng trace in batches. Each batch is a dict of NumPy columns:
+    #   valid               IPv4 packet (the remaining fields are 0 otherwise).
+    #   ts                  Timestamp (s, epoch).
+    #   pkt_len             IP total length.
+    #   mac_src, mac_dst    MAC addresses (48-bit integers, 0 if the link type has none).
+    #   ip_src, ip_dst      IPv4 addresses (32-bit integers).
+    #   proto               IP protocol.
+    #   port_src, port_dst  TCP/UDP ports (0 for other protocols and IP fragments).
+    def __init__(self, path, batch_size=4096):
+        self.path       = path
+        self.batch_size = batch_size
+
+        self.file   = open(path, 'rb')
+        self.mm     = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.raw    = np.frombuffer(self.mm, dtype=np.uint8)
+        self.size   = len(self.mm)
+
+        if hasattr(self.mm, 'madvise'):
+            self.mm.madvise(mmap.MADV_SEQUENTIAL)
+
+        self.offset     = 0     # Offset of the next record/block.
+        self.released   = 0     # Offset up to which pages were released.
+        self.pkt_cnt    = 0     # Packets read (or skipped) so far.
+
+        # Per-interface link types and timestamp resolutions (a single one for pcap).
+        self.linktypes  = []
+        self.tsresols   = []
+
+        magic = struct.unpack_from('<I', self.mm, 0)[0] if self.size >= 4 else None
+
+        if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS, PCAP_MAGIC_US_SWAP, PCAP_MAGIC_NS_SWAP):
+            self.pcapng = False
+            self.endian = '<' if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS) else '>'
+            linktype    = struct.unpack_from(self.endian + 'I', self.mm, 20)[0] & 0xFFFF
+            self.linktypes.append(linktype)
+            self.tsresols.append(10 ** 9 if magic in (PCAP_MAGIC_NS, PCAP_MAGIC_NS_SWAP)
+                                 else 10 ** 6)
+            self.offset = 24
+        elif magic == PCAPNG_SHB:
+            self.pcapng = True
+            self.endian = '<'
+            self.__next_packet_block__()
+        else:
+            self.close()
+            raise ValueError(f'{path}: not a pcap or pcapng file.')
+
+    def __iter__(self):
+        while not self.eof():
+            yield self.read(self.batch_size)
+
+    # A truncated pcap record header at the end of the trace is ignored.
+    def eof(self):
+        if self.pcapng:
+            return self.offset >= self.size
+        return self.offset + 16 > self.size
+
+    def close(self):
+        self.raw = None
+        self.mm.close()
+        self.file.close()
+
+    # Skips the next n packets without parsing them. Returns the number of skipped packets.
+    def skip(self, n):
+        return len(self.__walk__(n, False)[1])
+
+    # Reads the next n packets (less at the end of the trace).
+    def read(self, n):
+        ts, off, caplen, linktype = self.__walk__(n, True)
+        return self.parse(np.array(off, dtype=np.int64),
+                          np.array(caplen, dtype=np.int64),
+                          np.array(linktype, dtype=np.int64),
+                          np.array(ts, dtype=np.float64))
+
+    # Walks the next n packet records, returning their timestamps, data offsets, captured
+    # lengths and link types (only the offsets if collect is False).
+    def __walk__(self, n, collect):
+        ts, off, caplen, linktype = [], [], [], []
+        mm = self.mm
+
+        while len(off) < n and not self.eof():
+            if self.pcapng:
+                block_type, block_len = struct.unpack_from(self.endian + 'II', mm, self.offset)
+                if block_type == PCAPNG_EPB:
+                    if_id, ts_high, ts_low, rec_caplen = \
+                        struct.unpack_from(self.endian + 'IIII', mm, self.offset + 8)
+                    rec_off = self.offset + 28
+                    rec_ts  = ((ts_high << 32) | ts_low) / self.tsresols[if_id]
+                else:
+                    if_id       = 0
+                    rec_caplen  = min(struct.unpack_from(self.endian + 'I', mm, self.offset + 8)[0],
+                                      block_len - 16)
+                    rec_off     = self.offset + 12
+                    rec_ts      = 0.0
+                self.offset += block_len
+                self.__next_packet_block__()
+            else:
+                ts_sec, ts_frac, rec_caplen = \
+                    struct.unpack_from(self.endian + 'III', mm, self.offset)
+                if_id   = 0
+                rec_off = self.offset + 16
+                rec_ts  = (ts_sec * self.tsresols[0] + ts_frac) / self.tsresols[0]
+                self.offset = rec_off + rec_caplen
+
+            off.append(rec_off)
+            if collect:
+                ts.append(rec_ts)
+                caplen.append(min(rec_caplen, self.size - rec_off))
+                linktype.append(self.linktypes[if_id])
+
+        self.pkt_cnt += len(off)
+        self.__release__()
+
+        return ts, off, caplen, linktype
+
+    # Consumes pcapng blocks up to the next packet block (or the end of the trace),
+    # keeping track of the section byte order and of the interfaces.
+    def __next_packet_block__(self):
+        mm = self.mm
+
+        while self.offset + 12 <= self.size:
+            block_type = struct.unpack_from(self.endian + 'I', mm, self.offset)[0]
+
+            if block_type == PCAPNG_SHB:
+                # The byte order magic tells the endianness of the whole section.
+                if struct.unpack_from('<I', mm, self.offset + 8)[0] == PCAPNG_BYTE_ORDER:
+                    self.endian = '<'
+                else:
+                    self.endian = '>'
+                self.linktypes  = []
+                self.tsresols   = []
+            elif block_type == PCAPNG_IDB:
+                self.linktypes.append(struct.unpack_from(self.endian + 'H', mm, self.offset + 8)[0])
+                self.tsresols.append(self.__idb_tsresol__())
+            elif block_type in (PCAPNG_EPB, PCAPNG_SPB):
+                return
+
+            self.offset += struct.unpack_from(self.endian + 'I', mm, self.offset + 4)[0]
+
+        self.offset = self.size
+
+    # Timestamp resolution (units per second) from the if_tsresol option of an IDB.
+    def __idb_tsresol__(self):
+        block_len   = struct.unpack_from(self.endian + 'I', self.mm, self.offset + 4)[0]
+        opt         = self.offset + 16
+        end         = self.offset + block_len - 4
+
+        while opt + 4 <= end:
+            code, length = struct.unpack_from(self.endian + 'HH', self.mm, opt)
+            if code == 0:
+                break
+            if code == PCAPNG_IF_TSRESOL:
+                tsresol = self.mm[opt + 4]
+                return 2 ** (tsresol & 0x7F) if tsresol & 0x80 else 10 ** tsresol
+            opt += 4 + (length + 3) // 4 * 4
+
+        return 10 ** 6
+
+    # Releases the pages of the mapping that were already consumed.
+    def __release__(self):
+        if not hasattr(self.mm, 'madvise'):
+            return
+        if self.offset - self.released < RELEASE_SIZE:
+            return
+
+        end = self.offset // mmap.PAGESIZE * mmap.PAGESIZE
+        if end > self.released:
+            self.mm.madvise(mmap.MADV_DONTNEED, self.released, end - self.released)
+            self.released = end
+
+    # Parses the link, IPv4 and TCP/UDP headers of the packets at the given offsets.
+    def parse(self, off, caplen, linktype, ts):
+        raw     = self.raw
+        last    = self.size - 1
+        end     = off + caplen
+
+        def u8(idx):
+            return raw[np.minimum(idx, last)].astype(np.int64)
+
+        def u16(idx):
+            return (u8(idx) << 8) | u8(idx + 1)
+
+        def u32(idx):
+            return (u8(idx) << 24) | (u8(idx + 1) << 16) | (u8(idx + 2) << 8) | u8(idx + 3)
+
+        def u48(idx):
+            return (u16(idx) << 32) | u32(idx + 2)
+
+        # Link layer: L3 offset and ethertype (802.1Q/802.1ad tags are skipped).
+        is_eth      = linktype == LINKTYPE_ETHERNET
+        is_sll      = linktype == LINKTYPE_LINUX_SLL
+        is_raw      = (linktype == LINKTYPE_RAW) | (linktype == LINKTYPE_IPV4)
+
+        l3          = np.where(is_sll, off + 16, off + 14)
+        eth_type    = np.where(is_sll, u16(off + 14), u16(off + 12))
+        for _ in range(2):
+            tagged      = (eth_type == ETH_TYPE_VLAN) | (eth_type == ETH_TYPE_QINQ)
+            eth_type    = np.where(tagged, u16(l3 + 2), eth_type)
+            l3          = np.where(tagged, l3 + 4, l3)
+        l3          = np.where(is_raw, off, l3)
+        eth_type    = np.where(is_raw, ETH_TYPE_IPV4, eth_type)
+
+        valid   = (is_eth | is_sll | is_raw) & (eth_type == ETH_TYPE_IPV4) & (l3 + 20 <= end)
+        valid   &= (u8(l3) >> 4) == 4
+
+        # IPv4.
+        ihl     = (u8(l3) & 0xF) * 4
+        pkt_len = u16(l3 + 2)
+        frag    = u16(l3 + 6) & 0x3FFF      # MF flag and fragment offset.
+        proto   = u8(l3 + 9)
+        ip_src  = u32(l3 + 12)
+        ip_dst  = u32(l3 + 16)
+
+        # TCP/UDP ports, if present in the captured bytes.
+        l4      = l3 + ihl
+        ports   = valid & ((proto == IP_PROTO_TCP) | (proto == IP_PROTO_UDP)) & \
+                  (frag == 0) & (l4 + 4 <= end)
+
+        mac_dst = np.where(is_eth, u48(off), 0)
+        mac_src = np.where(is_eth, u48(off + 6), 0)
+
+        return {'valid':    valid,
+                'ts':       ts,
+                'pkt_len':  np.where(valid, pkt_len, 0),
+                'mac_src':  np.where(valid, mac_src, 0).astype(np.uint64),
+                'mac_dst':  np.where(valid, mac_dst, 0).astype(np.uint64),
+                'ip_src':   np.where(valid, ip_src, 0),
+                'ip_dst':   np.where(valid, ip_dst, 0),
+                'proto':    np.where(valid, proto, 0),
+                'port_src': np.where(ports, u16(l4), 0),
+                'port_dst': np.where(ports, u16(l4 + 2), 0)}
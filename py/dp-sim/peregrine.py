@@ -1,6 +1,14 @@
 #!/usr/bin/env python3
 
+import os
+import sys
+
+# Modules shared with the ml-module (transport, snapshots, metrics, Peregrine header).
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
 from pipeline_kitnet import PipelineKitNET
+from sender import open_sender
+from metrics import open_metrics_exporter
 import argparse
 import time
 import yaml
@@ -15,6 +23,9 @@ if __name__ == "__main__":
 
     time_start = time.time()
 
+    # Metrics endpoint and dump (see metrics.py).
+    metrics = open_metrics_exporter(conf)
+
     # Call function to run the packet processing pipeline.
     pipeline = PipelineKitNET(conf['iface'],
                               conf['trace'],
@@ -22,9 +33,21 @@ if __name__ == "__main__":
                               conf['train_pkt_cnt'],
                               conf['train_stats'],
                               conf['dataset'],
-                              conf['attack'])
-
-    pipeline.process()
+                              conf['attack'],
+                              conf.get('reader', 'pcap'),
+                              open_sender(conf),
+                              conf.get('snapshot_path'),
+                              conf.get('snapshot_interval', 0),
+                              conf.get('engine', 'python'),
+                              conf.get('workers', 0))
+
+    # Batched feature computation (chunk size), or 0 for the per-packet path.
+    if conf.get('batch', 0) > 0:
+        pipeline.process_batch(conf['batch'])
+    else:
+        pipeline.process()
+
+    metrics.close()
 
     time_stop   = time.time()
     total_time  = time_stop - time_start
@@ -3,18 +3,23 @@ import time
 import pickle
 import itertools
 import numpy as np
-import pandas as pd
 from datetime import datetime
 from pathlib import Path
-from scapy.all import Ether, IP, UDP, TCP, ICMP, sendp, conf, Packet, IntField, LongField
 from fc_kitnet import FCKitNET
-from peregrine_header import PeregrineHdr
+from snapshot import Snapshotter, load_snapshot
+from metrics import METRICS
 
 LAMBDAS = 4
 
+# Hot path stages (see metrics.py): trace reading (and header parsing), and record sending.
+STAGE_READ = METRICS.stage('read')
+STAGE_SEND = METRICS.stage('send')
+
 
 class PipelineKitNET:
-    def __init__(self, iface, trace, sampl, train_pkt_cnt, train_stats, dataset, attack):
+    def __init__(self, iface, trace, sampl, train_pkt_cnt, train_stats, dataset, attack,
+                 reader='pcap', sender=None, snapshot_path=None, snapshot_interval=0,
+                 engine='python', workers=0):
         self.decay_to_pos = {
             0: 0, 1: 0, 2: 1, 3: 2, 4: 3,
             8192: 1, 16384: 2, 24576: 3}
@@ -33,18 +38,41 @@ class PipelineKitNET:
         self.stats_ip           = {}
         self.stats_five_t       = {}
 
-        # Import the previously generated models.
-        with open(train_stats, 'rb') as f_stats:
-            stats                   = pickle.load(f_stats)
-            self.stats_mac_ip_src   = stats[0]
-            self.stats_ip_src       = stats[1]
-            self.stats_ip           = stats[2]
-            self.stats_five_t       = stats[3]
+        # Import the previously generated models (training statistics pickle, or model bundle).
+        if train_stats.endswith('.npz'):
+            with np.load(train_stats, allow_pickle=False) as npz:
+                stats = [dict(zip(npz[f'stats_{table}_keys'].tolist(), npz[f'stats_{table}']))
+                         for table in ['mac_ip_src', 'ip_src', 'ip', 'five_t']]
+        else:
+            with open(train_stats, 'rb') as f_stats:
+                stats = pickle.load(f_stats)
+        self.stats_mac_ip_src   = stats[0]
+        self.stats_ip_src       = stats[1]
+        self.stats_ip           = stats[2]
+        self.stats_five_t       = stats[3]
 
         # Initialize feature extraction/computation.
-        self.fc = FCKitNET(trace, sampl, self.train_pkt_cnt, train_stats)
+        self.fc = FCKitNET(trace, sampl, self.train_pkt_cnt, train_stats, reader, engine, workers)
+
+        # Record sender (see sender.open_sender), or None to send each record with scapy
+        # (send_peregrine_pkt).
+        self.sender = sender
+
+        # Gauges of the metrics endpoint (see metrics.py).
+        METRICS.gauge('packets', 'Simulator packet counters.',
+                      lambda: {'exec': self.pkt_cnt_exec, 'skipped': self.pkt_skip,
+                               'read': self.fc.global_pkt_index})
+        METRICS.gauge('flow_hash_cache', 'Flow hash cache counters.', self.fc.hasher.cache_stats)
+        if sender is not None:
+            METRICS.gauge('sender', 'Record sender counters.', sender.stats)
 
-        self.trace_size = self.fc.trace_size()
+        # Warm restart from the last snapshot, if any, and periodic snapshots of the registers and
+        # the trace position every snapshot_interval seconds (see snapshot.py).
+        self.snapshots = None
+        if snapshot_path:
+            self.restore(snapshot_path)
+            self.snapshots = Snapshotter(snapshot_path, snapshot_interval, self.snapshot,
+                                         self.fc.sync)
 
     def process(self):
         time_old = time.time()
@@ -57,6 +85,9 @@ class PipelineKitNET:
         while True:
             cur_stats = 0
 
+            if self.snapshots is not None:
+                self.snapshots.tick()
+
             time_new = time.time()
             if (self.pkt_cnt_exec + self.pkt_skip) % 10000 == 0:
                 print(f'Processed pkts: {self.pkt_cnt_exec + self.pkt_skip}. '
@@ -67,10 +98,12 @@ class PipelineKitNET:
             # Execution phase
             # ----------------------------------------
 
-            if self.pkt_cnt_exec + self.pkt_skip >= self.trace_size:
+            if not self.fc.has_next():
                 break
 
+            start = time.perf_counter_ns()
             self.fc.feature_extract()
+            STAGE_READ.observe(time.perf_counter_ns() - start)
 
             cur_stats = self.fc.process()
 
@@ -91,16 +124,123 @@ class PipelineKitNET:
                 # Flatten the statistics' list of lists.
                 cur_stats = list(itertools.chain(*cur_stats))
 
-                self.send_peregrine_pkt(self.iface, cur_stats)
+                self.send(cur_stats)
 
                 # Break when we reach the end of the trace file.
-                if self.pkt_cnt_exec + self.pkt_skip >= self.trace_size:
+                if not self.fc.has_next():
                     break
             else:
                 print("Done.")
                 break
 
+        self.close_sender()
+        self.close_snapshots()
+
+        cache = self.fc.hasher.cache_stats()
+        print(f'Flow hash cache: {cache["hits"]} hits, {cache["misses"]} misses '
+              f'(hit rate {100 * cache["hit_rate"]:.2f}%)')
+
+    # Chunked variant of process(): features are computed by FCKitNET.process_batch()
+    # for chunk_size packets at a time, with the same sampling and skipping logic.
+    def process_batch(self, chunk_size):
+        time_old = time.time()
+        time_new = time.time()
+
+        print('--- DP Simulator: Inference phase (batched) ---')
+        print('--- Processing...')
+
+        while self.fc.has_next():
+            start       = time.perf_counter_ns()
+            cols        = self.fc.read_chunk(chunk_size)
+            n           = len(cols['valid'])
+            STAGE_READ.observe(time.perf_counter_ns() - start, n)
+            chunk_stats = self.fc.process_batch(cols)
+
+            for i in range(n):
+                time_new = time.time()
+                if (self.pkt_cnt_exec + self.pkt_skip) % 10000 == 0:
+                    print(f'Processed pkts: {self.pkt_cnt_exec + self.pkt_skip}. '
+                          f'Elapsed time: {time_new - time_old} ')
+                    time_old = time_new
+
+                # Execution phase: only proceed according to the sampling rate.
+                if (self.pkt_cnt_exec - self.train_pkt_cnt) % self.sampl != 0:
+                    self.pkt_cnt_exec += 1
+                    continue
+
+                # If the packet is not IPv4.
+                if not cols['valid'][i]:
+                    self.pkt_skip += 1
+                    continue
+
+                self.pkt_cnt_exec += 1
+
+                cur_stats = self.fc.chunk_header(cols, i) + chunk_stats[i].tolist()
+
+                self.send(cur_stats)
+
+            if self.snapshots is not None:
+                self.snapshots.tick()
+
+        self.close_sender()
+        self.close_snapshots()
+        self.fc.close()
+
+    # State arrays for a snapshot: the feature computation state (see FCKitNET.snapshot) and the
+    # packet counters.
+    def snapshot(self):
+        arrays = self.fc.snapshot()
+        arrays['pipeline_state'] = np.array([self.pkt_cnt_exec, self.pkt_skip], dtype=np.int64)
+        return arrays
+
+    # Restores the state of a snapshot, if there is one at path.
+    def restore(self, path):
+        npz = load_snapshot(path)
+        if npz is None:
+            return
+
+        start = time.time()
+        self.fc.restore(npz)
+        self.pkt_cnt_exec, self.pkt_skip = npz['pipeline_state'].tolist()
+        npz.close()
+
+        print(f'Restored snapshot {path}: resuming at packet {self.fc.global_pkt_index} '
+              f'in {time.time() - start:.3f} s')
+
+    # Writes the final snapshot.
+    def close_snapshots(self):
+        if self.snapshots is None:
+            return
+
+        self.snapshots.close()
+        stats = self.snapshots.stats()
+        print(f'Snapshots: written {stats["written"]}, skipped {stats["skipped"]}, '
+              f'failed {stats["failed"]}. Last pause {1000 * stats["pause"]:.3f} ms, '
+              f'last write {stats["duration"]:.3f} s')
+
+    def send(self, cur_stats):
+        start = time.perf_counter_ns()
+        if self.sender is None:
+            self.send_peregrine_pkt(self.iface, cur_stats)
+        else:
+            self.sender.send(cur_stats)
+        STAGE_SEND.observe(time.perf_counter_ns() - start)
+
+    # Flushes the pending records and reports the send rate.
+    def close_sender(self):
+        if self.sender is None:
+            return
+
+        self.sender.close()
+        stats = self.sender.stats()
+        print(f'Sent pkts: {stats["sent"]} in {stats["batches"]} batches. '
+              f'Rate: {stats["pps"]:.0f} pkts/s')
+
+    # Scapy sender (sender: scapy). Scapy is only imported here, as it takes seconds to import.
     def send_peregrine_pkt(self, iface, cur_stats):
+        from scapy.all import Ether, IP, UDP, TCP, ICMP, sendp, conf
+        from peregrine_header import PeregrineHdr
+
         conf.iface  = iface
         eth         = Ether(src=cur_stats[1])
         ip          = IP(src=cur_stats[2], dst=cur_stats[3])
@@ -0,0 +1,116 @@
+import pickle
+import numpy as np
+
+# Register size, as in the P4 implementation (REG_SIZE in constants.p4):
+# 8192 hash slots (13-bit CRC16) for each of the 4 decay counter values.
+REG_SIZE    = 32768
+SLOTS       = 8192
+
+# 1D flow keys (MAC src + IP src, IP src).
+REG_1D_FIELDS = [('valid',          np.bool_),      # Slot already initialized by a packet.
+                 ('ts',             np.float64),    # Timestamp of the last decay update.
+                 ('pkt_cnt',        np.int64),      # Packet count.
+                 ('pkt_len',        np.int64),      # Sum of the packet lengths.
+                 ('ss',             np.int64)]      # Squared sum of the packet lengths.
+
+# 2D flow keys (IP pair, 5-tuple): counters stored for the reverse flow direction to read,
+# residues (indexed by the flow hash) and the sum of residual products (indexed by the xor hash).
+REG_2D_FIELDS = REG_1D_FIELDS + \
+                [('cur_pkt_cnt',    np.int64),      # Packet count (flow A->B, read by B->A).
+                 ('cur_ss',         np.int64),      # Squared sum (flow A->B, read by B->A).
+                 ('cur_mean',       np.int64),      # Mean (flow A->B, read by B->A).
+                 ('res',            np.int64),      # Residue.
+                 ('res_sum',        np.int64),      # Sum of residual products.
+                 ('res_sum_ts',     np.float64)]    # Sum of residual products timestamp.
+
+
+class RegisterTable:
+    # Fixed-size register table for one flow key. All registers live in a single preallocated
+    # structured array; each register is exposed as an attribute (a view into that array).
+    def __init__(self, fields, size=REG_SIZE):
+        self.regs = np.zeros(size, dtype=np.dtype(fields))
+        for name in self.regs.dtype.names:
+            setattr(self, name, self.regs[name])
+
+    def snapshot(self):
+        return self.regs.copy()
+
+    def restore(self, regs):
+        self.regs[...] = regs
+
+    def occupancy(self):
+        return int(np.count_nonzero(self.valid))
+
+
+class RegisterFile:
+    # Register tables for all the flow keys computed in the data plane.
+    def __init__(self, size=REG_SIZE):
+        self.mac_ip_src = RegisterTable(REG_1D_FIELDS, size)
+        self.ip_src     = RegisterTable(REG_1D_FIELDS, size)
+        self.ip         = RegisterTable(REG_2D_FIELDS, size)
+        self.five_t     = RegisterTable(REG_2D_FIELDS, size)
+
+    def tables(self):
+        return {'mac_ip_src':   self.mac_ip_src,
+                'ip_src':       self.ip_src,
+                'ip':           self.ip,
+                'five_t':       self.five_t}
+
+    def snapshot(self):
+        return {name: table.snapshot() for name, table in self.tables().items()}
+
+    def restore(self, snapshot):
+        for name, table in self.tables().items():
+            table.restore(snapshot[name])
+
+    def nbytes(self):
+        return sum(table.regs.nbytes for table in self.tables().values())
+
+    # Loads the register file from a train stats pickle (list of dicts, see FCKitNET).
+    # Entries are keyed by hash + 8192 * (decay_cntr - 1): each key only holds values for
+    # its own decay counter position.
+    @classmethod
+    def from_train_stats(cls, train_stats):
+        with open(train_stats, 'rb') as f_stats:
+            stats = pickle.load(f_stats)
+
+        reg_file = cls()
+
+        for table, fc in ((reg_file.mac_ip_src, stats[4]), (reg_file.ip_src, stats[5]),
+                          (reg_file.ip, stats[6]), (reg_file.five_t, stats[7])):
+            for key, val in fc.items():
+                decay = key // SLOTS + 1
+                table.valid[key]    = True
+                table.ts[key]       = val[0][decay-1]
+                table.pkt_cnt[key]  = val[decay][0]
+                table.pkt_len[key]  = val[decay][1]
+                table.ss[key]       = val[decay][2]
+                if len(val[decay]) > 3:
+                    table.cur_pkt_cnt[key]  = val[decay][3]
+                    table.cur_ss[key]       = val[decay][4]
+                    table.cur_mean[key]     = val[decay][5]
+
+        for table, res, res_sum in ((reg_file.ip, stats[8], stats[9]),
+                                    (reg_file.five_t, stats[10], stats[11])):
+            for key, val in res.items():
+                table.res[key] = val[key // SLOTS]
+            for key, val in res_sum.items():
+                decay = key // SLOTS + 1
+                table.res_sum_ts[key]   = val[0][decay-1]
+                table.res_sum[key]      = val[decay]
+
+        return reg_file
+
+    # Loads the register file from the reg_<table> arrays (non-zero registers and their
+    # indices) of a model bundle (.npz, see the ml-module plugins/KitNET/bundle.py).
+    @classmethod
+    def from_bundle(cls, bundle):
+        reg_file = cls()
+
+        with np.load(bundle, allow_pickle=False) as npz:
+            if 'reg_mac_ip_src' not in npz.files:
+                raise ValueError(f'{bundle}: the model bundle has no data plane registers.')
+            for name, table in reg_file.tables().items():
+                table.regs[npz[f'reg_{name}_index']] = npz[f'reg_{name}']
+
+        return reg_file
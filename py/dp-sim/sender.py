@@ -0,0 +1,294 @@
+import os
+import sys
+import ctypes
+import socket
+import struct
+import time
+import importlib.util
+import yaml
+from transport import InprocSender, wrap_fields, open_sender as open_record_sender
+
+# Batched raw-socket sender for the Peregrine feature records.
+# Frames (Ether / IPv4 / L4 / Peregrine header) are serialized with struct.pack_into into a
+# preallocated batch buffer, from per-protocol templates, and sent through a single AF_PACKET
+# socket with one sendmmsg() call per batch.
+# The frames are byte-identical to the ones built by PipelineKitNET.send_peregrine_pkt (scapy),
+# with a broadcast destination MAC.
+
+ETH_P_ALL       = 0x0003
+ETH_HDR         = struct.Struct('!6s6sH')
+IP_HDR          = struct.Struct('!BBHHHBBH4s4s')
+UDP_HDR         = struct.Struct('!HHHH')
+TCP_HDR         = struct.Struct('!HHIIBBHHH')
+ICMP_HDR        = struct.Struct('!BBHHH')
+PEREGRINE_HDR   = struct.Struct('!17I4Q')
+
+ETH_DST         = b'\xff' * 6
+ETH_TYPE_IPV4   = 0x0800
+
+IP_PROTO_ICMP   = 1
+IP_PROTO_TCP    = 6
+IP_PROTO_UDP    = 17
+
+# L4 header length for each protocol (other protocols carry the Peregrine header right after IP).
+L4_LEN = {IP_PROTO_UDP: UDP_HDR.size, IP_PROTO_TCP: TCP_HDR.size, IP_PROTO_ICMP: ICMP_HDR.size}
+
+# ml-module directory, for the in-process transport.
+ML_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ml-module')
+
+ETH_LEN     = ETH_HDR.size
+IP_LEN      = IP_HDR.size
+FRAME_MAX   = ETH_LEN + IP_LEN + TCP_HDR.size + PEREGRINE_HDR.size
+
+
+# Linux sendmmsg() structures.
+class IOVec(ctypes.Structure):
+    _fields_ = [('iov_base',        ctypes.c_void_p),
+                ('iov_len',         ctypes.c_size_t)]
+
+
+class MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name',        ctypes.c_void_p),
+                ('msg_namelen',     ctypes.c_uint32),
+                ('msg_iov',         ctypes.POINTER(IOVec)),
+                ('msg_iovlen',      ctypes.c_size_t),
+                ('msg_control',     ctypes.c_void_p),
+                ('msg_controllen',  ctypes.c_size_t),
+                ('msg_flags',       ctypes.c_int)]
+
+
+class MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr',         MsgHdr),
+                ('msg_len',         ctypes.c_uint)]
+
+
+def __load_sendmmsg__():
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes   = [ctypes.c_int, ctypes.POINTER(MMsgHdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype    = ctypes.c_int
+    return sendmmsg
+
+
+_sendmmsg = __load_sendmmsg__()
+
+
+# Internet checksum of buf[start:end] (even length), plus an initial partial sum.
+def checksum(buf, start, end, init=0):
+    total = init + sum(struct.unpack_from('!%dH' % ((end - start) // 2), buf, start))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+class PeregrineSender:
+    # Keeps one raw socket open on iface and sends the records in batches of batch_size.
+    def __init__(self, iface, batch_size=256):
+        self.iface      = iface
+        self.batch_size = batch_size
+
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        self.sock.bind((iface, 0))
+
+        # Batch buffer: one FRAME_MAX slot per frame.
+        self.buf        = bytearray(batch_size * FRAME_MAX)
+        self.buf_view   = memoryview(self.buf)
+        self.frame_lens = [0] * batch_size
+        self.pending    = 0
+
+        # sendmmsg() message vector, pointing to the buffer slots (only the lengths change).
+        buf_addr    = ctypes.addressof(ctypes.c_char.from_buffer(self.buf))
+        self.iovs   = (IOVec * batch_size)()
+        self.msgs   = (MMsgHdr * batch_size)()
+        for i in range(batch_size):
+            self.iovs[i].iov_base           = buf_addr + i * FRAME_MAX
+            self.msgs[i].msg_hdr.msg_iov    = ctypes.pointer(self.iovs[i])
+            self.msgs[i].msg_hdr.msg_iovlen = 1
+
+        # Frame templates, with the constant fields already in place.
+        self.templates = {proto: self.__template__(proto) for proto in L4_LEN}
+        self.templates[0] = self.__template__(0)
+
+        # Send counters.
+        self.pkts_sent  = 0
+        self.batches    = 0
+        self.time_first = None
+        self.time_last  = None
+
+    @staticmethod
+    def __template__(proto):
+        l4_len      = L4_LEN.get(proto, 0)
+        ip_len      = IP_LEN + l4_len + PEREGRINE_HDR.size
+        template    = bytearray(ETH_LEN + ip_len)
+
+        ETH_HDR.pack_into(template, 0, ETH_DST, bytes(6), ETH_TYPE_IPV4)
+        IP_HDR.pack_into(template, ETH_LEN, 0x45, 0, ip_len, 1, 0, 64, proto, 0, bytes(4), bytes(4))
+
+        l4 = ETH_LEN + IP_LEN
+        if proto == IP_PROTO_UDP:
+            UDP_HDR.pack_into(template, l4, 0, 0, l4_len + PEREGRINE_HDR.size, 0)
+        elif proto == IP_PROTO_TCP:
+            TCP_HDR.pack_into(template, l4, 0, 0, 0, 0, 5 << 4, 0x02, 8192, 0, 0)
+        elif proto == IP_PROTO_ICMP:
+            ICMP_HDR.pack_into(template, l4, 8, 0, 0, 0, 0)
+
+        return bytes(template)
+
+    # Serializes a feature record (see PipelineKitNET.send_peregrine_pkt) into the batch,
+    # flushing it when full.
+    def send(self, cur_stats):
+        if self.time_first is None:
+            self.time_first = time.time()
+
+        proto = int(cur_stats[4])
+        if proto not in L4_LEN:
+            proto = 0
+        template    = self.templates[proto]
+        frame_len   = len(template)
+
+        buf = self.buf
+        off = self.pending * FRAME_MAX
+        buf[off:off + frame_len] = template
+
+        ip_src = socket.inet_aton(cur_stats[2])
+        ip_dst = socket.inet_aton(cur_stats[3])
+
+        buf[off + 6:off + 12]                       = bytes.fromhex(cur_stats[1].replace(':', ''))
+        buf[off + ETH_LEN + 12:off + ETH_LEN + 16]  = ip_src
+        buf[off + ETH_LEN + 16:off + ETH_LEN + 20]  = ip_dst
+
+        ip  = off + ETH_LEN
+        l4  = ip + IP_LEN
+        struct.pack_into('!H', buf, ip + 10, checksum(buf, ip, l4))
+
+        try:
+            PEREGRINE_HDR.pack_into(buf, l4 + L4_LEN.get(proto, 0), *cur_stats[7:28])
+        except struct.error:
+            PEREGRINE_HDR.pack_into(buf, l4 + L4_LEN.get(proto, 0), *wrap_fields(cur_stats[7:28]))
+
+        end = off + frame_len
+        if proto == IP_PROTO_UDP or proto == IP_PROTO_TCP:
+            struct.pack_into('!HH', buf, l4, int(cur_stats[5]), int(cur_stats[6]))
+            # Pseudo header: addresses, protocol and L4 length.
+            pseudo = sum(struct.unpack('!4H', ip_src + ip_dst)) + proto + (end - l4)
+            csum_off = l4 + 6 if proto == IP_PROTO_UDP else l4 + 16
+            csum = checksum(buf, l4, end, pseudo)
+            if proto == IP_PROTO_UDP and csum == 0:
+                csum = 0xFFFF
+            struct.pack_into('!H', buf, csum_off, csum)
+        elif proto == IP_PROTO_ICMP:
+            struct.pack_into('!H', buf, l4 + 2, checksum(buf, l4, end))
+
+        self.frame_lens[self.pending] = frame_len
+        self.pending += 1
+        if self.pending == self.batch_size:
+            self.flush()
+
+    # Sends all the pending frames.
+    def flush(self):
+        n = self.pending
+        if n == 0:
+            return
+
+        if _sendmmsg is None:
+            for i in range(n):
+                off = i * FRAME_MAX
+                self.sock.send(self.buf_view[off:off + self.frame_lens[i]])
+        else:
+            for i in range(n):
+                self.iovs[i].iov_len = self.frame_lens[i]
+            sent = 0
+            while sent < n:
+                ret = _sendmmsg(self.sock.fileno(), ctypes.byref(self.msgs[sent]), n - sent, 0)
+                if ret < 0:
+                    err = ctypes.get_errno()
+                    raise OSError(err, os.strerror(err))
+                sent += ret
+
+        self.pending    = 0
+        self.pkts_sent  += n
+        self.batches    += 1
+        self.time_last  = time.time()
+
+    def close(self):
+        self.flush()
+        self.sock.close()
+
+    def stats(self):
+        elapsed = (self.time_last - self.time_first) if self.time_last is not None else 0
+        return {'sent':     self.pkts_sent,
+                'batches':  self.batches,
+                'elapsed':  elapsed,
+                'pps':      self.pkts_sent / elapsed if elapsed > 0 else 0.0}
+
+
+# Builds the record sender for the simulator configuration:
+#   transport: veth     frames on iface (sender: raw, or None to send each record with scapy).
+#   transport: unix/shm binary records to the controller at transport_addr (see transport.py).
+#   transport: inproc   records fed to the controller (configured by ml_conf) in this process.
+def open_sender(conf):
+    transport   = conf.get('transport', 'veth')
+    batch_size  = conf.get('send_batch', 256)
+
+    if transport == 'veth':
+        if conf.get('sender', 'raw') == 'raw':
+            return PeregrineSender(conf['iface'], batch_size)
+        return None
+    if transport == 'inproc':
+        sink, close = inproc_sink(conf['ml_conf'])
+        return InprocSender(sink, batch_size, close)
+
+    return open_record_sender(transport, conf['transport_addr'], batch_size,
+                              conf.get('timeout', 60))
+
+
+# Loads the ml-module pipeline and builds Peregrine from the controller configuration.
+# Returns a sink processing record batches and a close function (pending alerts, final snapshot,
+# controller workers), for InprocSender.
+def inproc_sink(ml_conf):
+    with open(ml_conf, 'r') as yaml_conf:
+        conf = yaml.load(yaml_conf, Loader=yaml.FullLoader)
+
+    sys.path.append(ML_MODULE)
+
+    # The ml-module peregrine module (Peregrine class) has the same name as the simulator
+    # entry point, so it is loaded explicitly before the ml-module pipeline imports it.
+    spec        = importlib.util.spec_from_file_location('peregrine',
+                                                         os.path.join(ML_MODULE, 'peregrine.py'))
+    peregrine   = importlib.util.module_from_spec(spec)
+    sys.modules['peregrine'] = peregrine
+    spec.loader.exec_module(peregrine)
+
+    ml_pipeline = importlib.import_module('pipeline')
+    alerts      = importlib.import_module('alerts').open_alert_sink(conf)
+
+    model, threshold = ml_pipeline.build_peregrine(conf['fm_grace'],
+                                                   conf['ad_grace'],
+                                                   conf['max_ae'],
+                                                   conf['fm_model'],
+                                                   conf['el_model'],
+                                                   conf['ol_model'],
+                                                   conf['train_stats'],
+                                                   conf['thres'],
+                                                   conf['attack'],
+                                                   conf.get('train_batch', 1),
+                                                   conf.get('workers', 1),
+                                                   conf.get('flow_capacity', 0),
+                                                   conf.get('flow_timeout', 0),
+                                                   conf.get('snapshot_path'),
+                                                   conf.get('snapshot_interval', 0),
+                                                   conf.get('stats_history', 0))
+
+    def sink(payload, ts):
+        ml_pipeline.process_batch(model, threshold, payload, 'record', alerts)
+
+    def close():
+        ml_pipeline.print_flow_stats(model)
+        alerts.close()
+        ml_pipeline.print_alert_stats(alerts)
+        model.close()
+
+    return sink, close
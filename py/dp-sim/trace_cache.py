@@ -0,0 +1,248 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import warnings
+import zipfile
+import numpy as np
+from pcap_reader import PcapReader
+
+# Columnar trace cache.
+# A pcap/pcapng trace (or its tshark csv) is converted once into an uncompressed .npz with
+# one pre-decoded column per field. Runs then memory-map the columns straight from the .npz
+# members, so no text parsing or address conversion is left at startup.
+
+CACHE_VERSION = 1
+
+# Cached columns (same fields as FCKitNET.read_chunk()).
+CACHE_COLUMNS = [('valid',      np.bool_),
+                 ('ts',         np.float64),
+                 ('pkt_len',    np.uint16),
+                 ('mac_src',    np.uint64),
+                 ('mac_dst',    np.uint64),
+                 ('ip_src',     np.uint32),
+                 ('ip_dst',     np.uint32),
+                 ('proto',      np.uint8),
+                 ('port_src',   np.uint16),
+                 ('port_dst',   np.uint16)]
+
+BUILD_CHUNK = 1 << 16
+HASH_BLOCK  = 1 << 24
+
+
+def cache_path(trace):
+    return os.path.splitext(trace)[0] + '.npz'
+
+
+# Content hash of the source trace.
+def trace_digest(trace):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(trace, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def ip_to_int(col):
+    octets = col.fillna('0.0.0.0').astype(str).str.split('.', expand=True).to_numpy(dtype=np.int64)
+    return (octets[:, 0] << 24) | (octets[:, 1] << 16) | (octets[:, 2] << 8) | octets[:, 3]
+
+
+def mac_to_int(col):
+    return np.array([int(mac.replace(':', ''), 16) if isinstance(mac, str) else 0
+                     for mac in col], dtype=np.uint64)
+
+
+# Converts rows of the tshark csv (see FCKitNET.parse_pcap) into NumPy columns.
+# Non-IPv4 packets are flagged in 'valid', missing lengths/protocols/ports become 0 and
+# ports are only kept for TCP and UDP.
+def columns_from_csv(df):
+    valid = (df.iloc[:, 4].notna() & df.iloc[:, 5].notna()).to_numpy()
+
+    proto   = df.iloc[:, 7].fillna(0).to_numpy(dtype=np.int64)
+    is_udp  = proto == 17
+    is_tcp  = proto == 6
+    port_src = np.where(is_udp, df.iloc[:, 10], np.where(is_tcp, df.iloc[:, 8], 0))
+    port_dst = np.where(is_udp, df.iloc[:, 11], np.where(is_tcp, df.iloc[:, 9], 0))
+    no_ports = np.isnan(port_src) | np.isnan(port_dst)
+
+    return {'valid':    valid,
+            'ts':       df.iloc[:, 0].to_numpy(dtype=np.float64),
+            'pkt_len':  df.iloc[:, 6].fillna(0).to_numpy(dtype=np.int64),
+            'mac_src':  mac_to_int(df.iloc[:, 2]),
+            'mac_dst':  mac_to_int(df.iloc[:, 3]),
+            'ip_src':   ip_to_int(df.iloc[:, 4]),
+            'ip_dst':   ip_to_int(df.iloc[:, 5]),
+            'proto':    proto,
+            'port_src': np.where(no_ports, 0, port_src).astype(np.int64),
+            'port_dst': np.where(no_ports, 0, port_dst).astype(np.int64)}
+
+
+class TraceCache:
+    # Memory-mapped cached trace. Same reading interface as PcapReader
+    # (read, skip, eof), with batches converted to the reader column types.
+    def __init__(self, path, batch_size=4096):
+        self.path       = path
+        self.batch_size = batch_size
+        self.index      = 0     # Next packet.
+
+        with zipfile.ZipFile(path) as zf:
+            self.meta = json.loads(zf.read('meta.json'))
+            self.cols = {name: self.__memmap_member__(zf, name + '.npy')
+                         for name, _ in CACHE_COLUMNS}
+
+        self.pkt_cnt = self.meta['pkt_cnt']
+
+    # Maps a .npy member of the (uncompressed) .npz without reading it.
+    def __memmap_member__(self, zf, member):
+        info = zf.getinfo(member)
+        with open(self.path, 'rb') as f:
+            # Local file header: the data follows the name and extra fields.
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = np.frombuffer(f.read(4), dtype='<u2')
+            f.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+    def __iter__(self):
+        while not self.eof():
+            yield self.read(self.batch_size)
+
+    def __len__(self):
+        return self.pkt_cnt
+
+    def eof(self):
+        return self.index >= self.pkt_cnt
+
+    def close(self):
+        self.cols = None
+
+    def skip(self, n):
+        n           = min(n, self.pkt_cnt - self.index)
+        self.index  += n
+        return n
+
+    def read(self, n):
+        start       = self.index
+        self.index  = min(start + n, self.pkt_cnt)
+
+        cols = {}
+        for name, dtype in CACHE_COLUMNS:
+            col = self.cols[name][start:self.index]
+            if dtype in (np.bool_, np.float64, np.uint64):
+                cols[name] = np.array(col)
+            else:
+                cols[name] = col.astype(np.int64)
+        return cols
+
+    # True if the cache was built from the current content of the trace.
+    # Size and mtime are checked first; the content hash is only computed if they changed, and
+    # the new mtime is then recorded so that the next runs skip the hash.
+    def is_fresh(self, trace):
+        if self.meta.get('version') != CACHE_VERSION:
+            return False
+
+        stat = os.stat(trace)
+        if stat.st_size != self.meta['src_size']:
+            return False
+        if stat.st_mtime_ns == self.meta['src_mtime_ns']:
+            return True
+
+        if trace_digest(trace) != self.meta['src_digest']:
+            return False
+        self.update_meta(src_mtime_ns=stat.st_mtime_ns)
+        return True
+
+    # Updates the cache metadata. The new meta.json is appended to the .npz (the last member of
+    # a name is the one read), so the columns are neither rewritten nor moved.
+    def update_meta(self, **fields):
+        self.meta.update(fields)
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')     # Duplicate name: meta.json.
+                with zipfile.ZipFile(self.path, 'a') as zf:
+                    zf.writestr('meta.json', json.dumps(self.meta))
+        except OSError as e:
+            print('Could not update the trace cache metadata:', e)
+
+    # Converts a pcap/pcapng trace (or a tshark csv, by extension) into a cache at path.
+    # Columns are filled chunk by chunk into temporary .npy files, so the conversion
+    # runs with bounded memory.
+    @classmethod
+    def build(cls, trace, path):
+        print('Building trace cache:', path)
+
+        if trace.endswith('.csv'):
+            import pandas as pd
+
+            with open(trace, 'rb') as f:
+                pkt_cnt = sum(1 for _ in f) - 1
+            chunks  = (columns_from_csv(df) for df in pd.read_csv(trace, chunksize=BUILD_CHUNK))
+        else:
+            reader  = PcapReader(trace)
+            pkt_cnt = reader.skip(np.iinfo(np.int64).max)
+            reader.close()
+            reader  = PcapReader(trace)
+            chunks  = (reader.read(BUILD_CHUNK) for _ in range(0, pkt_cnt, BUILD_CHUNK))
+
+        stat = os.stat(trace)
+        meta = {'version':      CACHE_VERSION,
+                'source':       os.path.abspath(trace),
+                'src_size':     stat.st_size,
+                'src_mtime_ns': stat.st_mtime_ns,
+                'src_digest':   trace_digest(trace),
+                'pkt_cnt':      pkt_cnt}
+
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            cols = {name: np.lib.format.open_memmap(os.path.join(tmp_dir, name + '.npy'),
+                                                    mode='w+', dtype=dtype, shape=(pkt_cnt,))
+                    for name, dtype in CACHE_COLUMNS}
+
+            index = 0
+            for chunk in chunks:
+                n = len(chunk['valid'])
+                for name, _ in CACHE_COLUMNS:
+                    cols[name][index:index + n] = chunk[name]
+                index += n
+
+            for col in cols.values():
+                col.flush()
+            del cols
+
+            tmp_path = os.path.join(tmp_dir, 'cache.npz')
+            with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+                zf.writestr('meta.json', json.dumps(meta))
+                for name, _ in CACHE_COLUMNS:
+                    zf.write(os.path.join(tmp_dir, name + '.npy'), name + '.npy')
+            os.replace(tmp_path, path)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        return cls(path)
+
+
+# Opens the cache of a trace, (re)building it if missing or stale.
+def load_cache(trace, batch_size=4096):
+    path = cache_path(trace)
+
+    if os.path.isfile(path):
+        cache = TraceCache(path, batch_size)
+        if cache.is_fresh(trace):
+            return cache
+        print('Trace changed since the cache was built.')
+        cache.close()
+
+    cache = TraceCache.build(trace, path)
+    cache.batch_size = batch_size
+    return cache
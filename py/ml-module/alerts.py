@@ -0,0 +1,177 @@
+import os
+import json
+import queue
+import socket
+import syslog
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from decoder import flow_to_str
+
+# Asynchronous alert sink.
+# Alerts are pushed into a bounded queue by the processing loop and written in batches by a
+# background thread, as NDJSON (one alert per line):
+#   file    appended to a file, rotated once larger than max_bytes (path.1 ... path.<backups>).
+#   socket  sent to a local UNIX datagram socket, one datagram per alert.
+#   syslog  sent to the local syslog.
+# When the queue is full, alerts are dropped (and counted) instead of stalling the loop.
+# Alerts of the same flow can be rate limited to one every dedup seconds.
+
+ALERT_DIR   = str(Path(__file__).parents[0]) + '/json'
+SINKS       = ['file', 'socket', 'syslog']
+
+DEDUP_FLOWS = 1 << 16   # Flows tracked for deduplication (least recently alerted evicted first).
+WRITE_BATCH = 1024      # Alerts written per batch.
+
+
+class AlertSink:
+    def __init__(self, sink='file', path=ALERT_DIR + '/alerts.ndjson', max_bytes=1 << 26, backups=5,
+                 queue_size=1 << 14, dedup=0):
+        if sink not in SINKS:
+            raise ValueError(f'Unknown alert sink: {sink}')
+
+        self.sink       = sink
+        self.path       = path
+        self.max_bytes  = max_bytes
+        self.backups    = backups
+        self.dedup      = dedup
+
+        self.queue      = queue.Queue(maxsize=queue_size)
+        self.last_alert = OrderedDict()     # 5-tuple -> time of the last alert, for dedup.
+
+        # Counters.
+        self.pushed     = 0
+        self.written    = 0
+        self.dropped    = 0
+        self.suppressed = 0
+        self.errors     = 0
+
+        self.file = None
+        self.sock = None
+        if sink == 'file':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.file = open(path, 'a', encoding='utf-8')
+        elif sink == 'socket':
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        else:
+            syslog.openlog('peregrine', 0, syslog.LOG_DAEMON)
+
+        self.thread = threading.Thread(target=self.__run__, daemon=True)
+        self.thread.start()
+
+    # Queues the alert of a record (see pipeline.decode_records) scored rmse. Never blocks.
+    def push(self, cur_stats, rmse):
+        now = time.time()
+
+        if self.dedup > 0:
+            flow = tuple(cur_stats[1:6])
+            last = self.last_alert.get(flow)
+            if last is not None and now - last < self.dedup:
+                self.suppressed += 1
+                return
+            self.last_alert[flow] = now
+            self.last_alert.move_to_end(flow)
+            if len(self.last_alert) > DEDUP_FLOWS:
+                self.last_alert.popitem(last=False)
+
+        try:
+            self.queue.put_nowait((now, cur_stats[:6], rmse))
+            self.pushed += 1
+        except queue.Full:
+            self.dropped += 1
+
+    # Writer thread: drains the queue in batches until the None sentinel.
+    def __run__(self):
+        running = True
+        while running:
+            alerts = [self.queue.get()]
+            while len(alerts) < WRITE_BATCH:
+                try:
+                    alerts.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if alerts[-1] is None:
+                alerts.pop()
+                running = False
+
+            lines = [self.__to_json__(*alert) for alert in alerts]
+            if not lines:
+                continue
+            try:
+                self.__write__(lines)
+                self.written += len(lines)
+            except OSError:
+                self.errors += len(lines)
+
+    @staticmethod
+    def __to_json__(ts, header, rmse):
+        _, ip_src, ip_dst, ip_proto, port_src, port_dst = flow_to_str(header)
+        ts_datetime = datetime.fromtimestamp(ts).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
+
+        return json.dumps({
+            "timestamp": ts_datetime,
+            "data": {
+                "ip_src": ip_src,
+                "ip_dst": ip_dst,
+                "ip_proto": ip_proto,
+                "port_src": port_src,
+                "port_dst": port_dst,
+                "prediction": "MALICIOUS FLOW",
+                "score": rmse
+            },
+            "model": "KitNET"
+        })
+
+    def __write__(self, lines):
+        if self.sink == 'file':
+            self.file.write('\n'.join(lines) + '\n')
+            self.file.flush()
+            if self.max_bytes > 0 and self.file.tell() > self.max_bytes:
+                self.__rotate__()
+        elif self.sink == 'socket':
+            for line in lines:
+                self.sock.sendto(line.encode(), self.path)
+        else:
+            for line in lines:
+                syslog.syslog(syslog.LOG_WARNING, line)
+
+    # path -> path.1 -> ... -> path.<backups> (dropped).
+    def __rotate__(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        if self.backups > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    # Writes the pending alerts and stops the writer thread.
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.file is not None:
+            self.file.close()
+        if self.sock is not None:
+            self.sock.close()
+
+    def stats(self):
+        return {'pushed':       self.pushed,
+                'written':      self.written,
+                'queued':       self.queue.qsize(),
+                'dropped':      self.dropped,
+                'suppressed':   self.suppressed,
+                'errors':       self.errors}
+
+
+# Builds the alert sink of a controller configuration.
+def open_alert_sink(conf):
+    return AlertSink(conf.get('alert_sink', 'file'),
+                     conf.get('alert_path', ALERT_DIR + '/alerts.ndjson'),
+                     conf.get('alert_max_bytes', 1 << 26),
+                     conf.get('alert_backups', 5),
+                     conf.get('alert_queue', 1 << 14),
+                     conf.get('alert_dedup', 0))
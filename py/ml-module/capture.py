@@ -0,0 +1,110 @@
+import queue
+import select
+import socket
+import struct
+import threading
+import time
+
+# Linux AF_PACKET constants (not all of them are exported by the socket module).
+ETH_P_ALL           = 0x0003
+SOL_PACKET          = 263
+PACKET_STATISTICS   = 6
+PACKET_OUTGOING     = 4
+
+# struct tpacket_stats { unsigned int tp_packets; unsigned int tp_drops; }
+TPACKET_STATS = struct.Struct('=II')
+
+
+class PacketCapture:
+    # Long-lived capture on a single raw AF_PACKET socket.
+    # A background thread drains the socket in batches of up to batch_size frames and
+    # hands them over to the consumer through a bounded queue. If no frame is received
+    # for timeout seconds, the capture stops and a None sentinel is queued.
+    def __init__(self, iface, batch_size=256, timeout=60, snaplen=2048, queue_size=64,
+                 rcvbuf=1 << 24):
+        self.iface      = iface
+        self.batch_size = batch_size
+        self.timeout    = timeout
+        self.snaplen    = snaplen
+
+        self.queue      = queue.Queue(maxsize=queue_size)
+        self.running    = False
+        self.thread     = None
+
+        # Capture counters.
+        self.pkts_recv      = 0     # Frames received by the capture thread.
+        self.pkts_kernel    = 0     # Frames seen by the kernel (PACKET_STATISTICS).
+        self.pkts_dropped   = 0     # Frames dropped by the kernel (PACKET_STATISTICS).
+        self.batches        = 0     # Batches handed over to the consumer.
+
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.sock.bind((iface, 0))
+
+    def start(self):
+        self.running    = True
+        self.thread     = threading.Thread(target=self.__capture_loop__, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        self.sock.close()
+
+    # Returns the next batch as a (frames, ts_first) tuple, or None once the capture stopped.
+    def next_batch(self):
+        return self.queue.get()
+
+    def __capture_loop__(self):
+        sock = self.sock
+
+        try:
+            while self.running:
+                self.__capture_batch__(sock)
+        except TimeoutError:
+            pass
+        finally:
+            self.running = False
+            self.queue.put(None)
+
+    def __capture_batch__(self, sock):
+        # Block until the first frame of the batch arrives.
+        readable, _, _ = select.select([sock], [], [], self.timeout)
+        if not readable:
+            raise TimeoutError
+        frame, addr = sock.recvfrom(self.snaplen)
+        ts_first = time.time()
+
+        frames = []
+        if addr[2] != PACKET_OUTGOING:
+            frames.append(frame)
+
+        # Drain whatever is already queued in the socket, up to the batch size.
+        while len(frames) < self.batch_size:
+            try:
+                frame, addr = sock.recvfrom(self.snaplen, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                break
+            if addr[2] != PACKET_OUTGOING:
+                frames.append(frame)
+
+        if frames:
+            self.pkts_recv  += len(frames)
+            self.batches    += 1
+            self.queue.put((frames, ts_first))
+
+    # Kernel-side counters. Note that PACKET_STATISTICS resets on every read.
+    def stats(self):
+        try:
+            packets, drops = TPACKET_STATS.unpack(
+                self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, TPACKET_STATS.size))
+            self.pkts_kernel    += packets
+            self.pkts_dropped   += drops
+        except OSError:
+            pass
+
+        return {'recv':     self.pkts_recv,
+                'kernel':   self.pkts_kernel,
+                'dropped':  self.pkts_dropped,
+                'batches':  self.batches}
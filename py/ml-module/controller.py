@@ -7,10 +7,16 @@ import argparse
 import json
 import random
 import time
-import pipeline
 import yaml
 from pathlib import Path
+
+# Modules shared with dp-sim (transport, snapshots, metrics, Peregrine header).
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+import pipeline
 from pipeline import pkt_pipeline
+from alerts import open_alert_sink
+from metrics import open_metrics_exporter
 
 
 if __name__ == "__main__":
@@ -33,7 +39,21 @@ if __name__ == "__main__":
                                 conf['ol_model'],
                                 conf['train_stats'],
                                 conf['thres'],
-                                conf['attack'])
+                                conf['attack'],
+                                conf.get('batch_size', 256),
+                                conf.get('timeout', 60),
+                                conf.get('decoder', 'fast'),
+                                conf.get('transport', 'veth'),
+                                conf.get('transport_addr'),
+                                conf.get('train_batch', 1),
+                                conf.get('workers', 1),
+                                conf.get('flow_capacity', 0),
+                                conf.get('flow_timeout', 0),
+                                open_alert_sink(conf),
+                                conf.get('snapshot_path'),
+                                conf.get('snapshot_interval', 0),
+                                open_metrics_exporter(conf),
+                                conf.get('stats_history', 0))
 
     stop        = time.time()
     total_time  = stop - start
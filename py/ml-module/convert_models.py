@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import pickle
+import argparse
+import yaml
+from plugins.KitNET.bundle import ModelBundle, save_bundle
+
+# Converts the pickled models of a configuration (fm_model, el_model, ol_model, train_stats and
+# thres) into a single model bundle (see plugins/KitNET/bundle.py), including the data plane
+# registers of the training statistics. The configurations can then point all the model paths
+# to the bundle.
+
+# dp-sim directory, for the register file.
+DP_SIM = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dp-sim')
+
+
+def load_pickle(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Peregrine model converter.")
+    argparser.add_argument('-c', '--conf', type=str, help='Config path')
+    argparser.add_argument('-o', '--out', type=str, help='Model bundle path (.npz)')
+    args = argparser.parse_args()
+
+    with open(args.conf, "r") as yaml_conf:
+        conf = yaml.load(yaml_conf, Loader=yaml.FullLoader)
+
+    out = args.out or os.path.join(os.path.dirname(conf['fm_model']),
+                                   f'{conf["attack"]}-m-{conf["max_ae"]}.npz')
+
+    start = time.time()
+
+    with open(conf['thres'], 'r') as f:
+        threshold = float(f.readline())
+
+    train_stats = load_pickle(conf['train_stats'])
+
+    sys.path.append(DP_SIM)
+    from register_file import RegisterFile
+    registers = RegisterFile.from_train_stats(conf['train_stats']).snapshot()
+
+    save_bundle(out,
+                load_pickle(conf['fm_model']),
+                load_pickle(conf['el_model']),
+                load_pickle(conf['ol_model']),
+                threshold,
+                train_stats[:4],
+                registers,
+                {'attack': conf['attack'], 'm': conf['max_ae']})
+
+    print(f'Model bundle: {out} ({os.path.getsize(out)} bytes, {time.time() - start:.2f} s)')
+
+    # Check the bundle loads.
+    bundle = ModelBundle(out)
+    print(f'Feature map: {len(bundle.feature_map())} autoencoders, threshold {bundle.threshold()}')
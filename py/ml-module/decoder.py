@@ -0,0 +1,193 @@
+import socket
+import struct
+import numpy as np
+
+# Fast decoder for the frames sent by the data plane (Ether / IPv4 / L4 / Peregrine header).
+# Frames are parsed straight from their buffers, without scapy dissection. The scapy-based
+# path (pipeline.pkt_callback) remains the reference decoder.
+
+ETH_HDR_LEN     = 14
+ETH_TYPE_IPV4   = 0x0800
+ETH_TYPE_VLAN   = 0x8100
+
+IP_PROTO_ICMP   = 1
+IP_PROTO_TCP    = 6
+IP_PROTO_UDP    = 17
+
+# Peregrine header fields, in wire order (see peregrine_header.PeregrineHdr).
+PEREGRINE_FIELDS = ['decay',
+                    'mac_ip_src_pkt_cnt', 'mac_ip_src_mean', 'mac_ip_src_std_dev',
+                    'ip_src_pkt_cnt', 'ip_src_mean', 'ip_src_std_dev',
+                    'ip_pkt_cnt', 'ip_mean_0', 'ip_std_dev_0', 'ip_magnitude', 'ip_radius',
+                    'five_t_pkt_cnt', 'five_t_mean_0', 'five_t_std_dev_0',
+                    'five_t_magnitude', 'five_t_radius',
+                    'ip_sum_res_prod_cov', 'ip_pcc', 'five_t_sum_res_prod_cov', 'five_t_pcc']
+
+PEREGRINE_HDR   = struct.Struct('!17I4Q')
+PEREGRINE_DTYPE = np.dtype([(name, '>u4') for name in PEREGRINE_FIELDS[:17]] +
+                           [(name, '>u8') for name in PEREGRINE_FIELDS[17:]])
+
+# Order in which the controller expects the statistics (see pipeline.pkt_callback).
+STATS_FIELDS = ['decay',
+                'mac_ip_src_pkt_cnt', 'mac_ip_src_mean', 'mac_ip_src_std_dev',
+                'ip_src_pkt_cnt', 'ip_src_mean', 'ip_src_std_dev',
+                'ip_pkt_cnt', 'ip_mean_0', 'ip_std_dev_0', 'ip_magnitude', 'ip_radius',
+                'ip_sum_res_prod_cov', 'ip_pcc',
+                'five_t_pkt_cnt', 'five_t_mean_0', 'five_t_std_dev_0',
+                'five_t_magnitude', 'five_t_radius',
+                'five_t_sum_res_prod_cov', 'five_t_pcc']
+STATS_ORDER = [PEREGRINE_FIELDS.index(name) for name in STATS_FIELDS]
+
+# Decoded flow header fields.
+FLOW_DTYPE = np.dtype([('mac_src', 'u8'), ('ip_src', 'u4'), ('ip_dst', 'u4'),
+                       ('proto', 'u1'), ('sport', 'u2'), ('dport', 'u2')])
+
+_HDR_RANGE = np.arange(PEREGRINE_HDR.size)
+
+
+# Decodes a single frame. Returns a (flow header, stats) tuple, or None if the frame does not
+# carry a Peregrine header.
+def decode_frame(frame):
+    buf = memoryview(frame)
+
+    off         = ETH_HDR_LEN
+    eth_type    = (buf[12] << 8) | buf[13]
+    if eth_type == ETH_TYPE_VLAN and len(buf) >= off + 4:
+        eth_type    = (buf[16] << 8) | buf[17]
+        off         += 4
+    if eth_type != ETH_TYPE_IPV4 or len(buf) < off + 20:
+        return None
+
+    ihl     = (buf[off] & 0xF) * 4
+    proto   = buf[off + 9]
+    ip_src, ip_dst = struct.unpack_from('!II', buf, off + 12)
+    off     += ihl
+
+    sport = dport = 0
+    if proto == IP_PROTO_UDP or proto == IP_PROTO_TCP:
+        if len(buf) < off + 14:
+            return None
+        sport, dport = struct.unpack_from('!HH', buf, off)
+        off += 8 if proto == IP_PROTO_UDP else (buf[off + 12] >> 4) * 4
+    elif proto == IP_PROTO_ICMP:
+        off += 8
+    else:
+        return None
+
+    if len(buf) < off + PEREGRINE_HDR.size:
+        return None
+
+    mac_src = int.from_bytes(buf[6:12], 'big')
+    hdr     = PEREGRINE_HDR.unpack_from(buf, off)
+
+    return ((mac_src, ip_src, ip_dst, proto, sport, dport),
+            [hdr[i] for i in STATS_ORDER])
+
+
+# Decodes a batch of frames at once.
+# Returns a (flows, stats) tuple: a FLOW_DTYPE structured array and an (N, 21) uint64 array with
+# the statistics in controller order. Frames without a Peregrine header are left out.
+def decode_batch(frames):
+    lens    = np.fromiter(map(len, frames), dtype=np.int64, count=len(frames))
+    starts  = np.zeros(len(frames), dtype=np.int64)
+    np.cumsum(lens[:-1], out=starts[1:])
+    ends    = starts + lens
+
+    # Pad the joined buffer so that out-of-frame gathers stay in bounds (they are masked out).
+    pad = ETH_HDR_LEN + 4 + 60 + 60 + PEREGRINE_HDR.size
+    raw = np.frombuffer(b''.join(frames) + bytes(pad), dtype=np.uint8)
+
+    def u8(off):
+        return raw[off].astype(np.int64)
+
+    def u16(off):
+        return (u8(off) << 8) | u8(off + 1)
+
+    def u32(off):
+        return (u8(off) << 24) | (u8(off + 1) << 16) | (u8(off + 2) << 8) | u8(off + 3)
+
+    # Ethernet (optionally 802.1Q tagged).
+    eth_type    = u16(starts + 12)
+    vlan        = eth_type == ETH_TYPE_VLAN
+    l3          = starts + ETH_HDR_LEN + 4 * vlan
+    eth_type    = np.where(vlan, u16(starts + 16), eth_type)
+    valid       = (eth_type == ETH_TYPE_IPV4) & (l3 + 20 <= ends)
+
+    # IPv4.
+    ihl     = (u8(l3) & 0xF) * 4
+    proto   = u8(l3 + 9)
+    ip_src  = u32(l3 + 12)
+    ip_dst  = u32(l3 + 16)
+    l4      = l3 + ihl
+
+    # L4.
+    is_udp  = proto == IP_PROTO_UDP
+    is_tcp  = proto == IP_PROTO_TCP
+    is_icmp = proto == IP_PROTO_ICMP
+    ports   = is_udp | is_tcp
+    valid   &= (ports & (l4 + 14 <= ends)) | is_icmp
+    l4      = np.where(valid, l4, starts)
+    sport   = np.where(ports, u16(l4), 0)
+    dport   = np.where(ports, u16(l4 + 2), 0)
+    l4_len  = np.where(is_tcp, (u8(l4 + 12) >> 4) * 4, 8)
+
+    hdr_off = l4 + l4_len
+    valid   &= hdr_off + PEREGRINE_HDR.size <= ends
+
+    hdr_off = hdr_off[valid]
+    hdr     = raw[hdr_off[:, None] + _HDR_RANGE].copy().view(PEREGRINE_DTYPE).reshape(-1)
+
+    flows               = np.empty(len(hdr_off), dtype=FLOW_DTYPE)
+    mac_off             = starts[valid] + 6
+    flows['mac_src']    = (u16(mac_off) << 32) | u32(mac_off + 2)
+    flows['ip_src']     = ip_src[valid]
+    flows['ip_dst']     = ip_dst[valid]
+    flows['proto']      = proto[valid]
+    flows['sport']      = sport[valid]
+    flows['dport']      = dport[valid]
+
+    stats = np.empty((len(hdr_off), len(STATS_FIELDS)), dtype=np.uint64)
+    for col, name in enumerate(STATS_FIELDS):
+        stats[:, col] = hdr[name]
+
+    return flows, stats
+
+
+# Binary records received through a transport (see transport.RECORD): packet timestamp and flow
+# header followed by the Peregrine header in wire order.
+RECORD_DTYPE = np.dtype([('ts', '>f8'), ('mac_src', '>u8'), ('ip_src', '>u4'), ('ip_dst', '>u4'),
+                         ('proto', 'u1'), ('sport', '>u2'), ('dport', '>u2')] +
+                        PEREGRINE_DTYPE.descr)
+
+
+# Decodes a batch of transport records. Same output as decode_batch().
+def decode_record_batch(payload):
+    records = np.frombuffer(payload, dtype=RECORD_DTYPE)
+
+    flows = np.empty(len(records), dtype=FLOW_DTYPE)
+    for name in FLOW_DTYPE.names:
+        flows[name] = records[name]
+
+    stats = np.empty((len(records), len(STATS_FIELDS)), dtype=np.uint64)
+    for col, name in enumerate(STATS_FIELDS):
+        stats[:, col] = records[name]
+
+    return flows, stats
+
+
+# Packet timestamps (trace time, s) of a batch of transport records.
+def decode_record_times(payload):
+    return np.frombuffer(payload, dtype=RECORD_DTYPE)['ts'].tolist()
+
+
+# Converts a decoded flow header (or the header fields of a record) to strings, for the alerts.
+def flow_to_str(flow):
+    mac_src, ip_src, ip_dst, proto, sport, dport = (int(v) for v in flow)
+    mac = mac_src.to_bytes(6, 'big').hex()
+
+    return [':'.join(mac[i:i + 2] for i in range(0, 12, 2)),
+            socket.inet_ntoa(ip_src.to_bytes(4, 'big')),
+            socket.inet_ntoa(ip_dst.to_bytes(4, 'big')),
+            str(proto),
+            str(sport),
+            str(dport)]
@@ -0,0 +1,172 @@
+from collections import OrderedDict
+import numpy as np
+
+# Bounded per-flow state table for the controller statistics (see Peregrine.__update_stats__).
+# The statistics of all the flows live in one preallocated 2D slab (one row per flow), indexed
+# through a key -> row map kept in least recently used order. A flow is evicted when it has been
+# idle for longer than timeout seconds (the largest decay window of the data plane, by default),
+# or when the table is full and a new flow arrives (least recently used first). A flow looked up
+# again after being idle for longer than timeout starts over from zeroed statistics.
+# Keys are packed integers (see Peregrine.__update_stats__). NaNs in the legacy statistics are
+# stored as 0.
+
+SLAB_ROWS = 1 << 12     # Initial rows of an unbounded table (doubled when full).
+KEY_MASK  = (1 << 64) - 1
+
+
+class FlowTable:
+    # width: statistics per flow.
+    # capacity: maximum number of flows (0: unbounded).
+    # timeout: idle time (s) after which a flow is evicted (0: never).
+    # legacy: optional dict of flow statistics keyed by the header strings of the training
+    # statistics pickles, with legacy_key converting an integer key to its string key. Entries
+    # are migrated to the slab on the first lookup of their flow, and are not subject to the idle
+    # timeout until then (the training statistics have no last seen time).
+    def __init__(self, width, capacity=0, timeout=0, legacy=None, legacy_key=None):
+        self.width      = width
+        self.capacity   = capacity
+        self.timeout    = timeout
+
+        rows            = capacity if capacity > 0 else SLAB_ROWS
+        self.slab       = np.zeros((rows, width))
+        self.last_seen  = np.zeros(rows)
+        self.rows       = OrderedDict()     # key -> slab row, least recently used first
+        self.free       = list(range(rows - 1, -1, -1))
+
+        self.legacy         = legacy if legacy else {}
+        self.legacy_key     = legacy_key
+
+        # Metrics.
+        self.hits           = 0
+        self.misses         = 0
+        self.migrated       = 0
+        self.evicted_lru    = 0
+        self.evicted_idle   = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    # Returns the statistics row (a slab view) of a flow, creating it if missing (or zeroing it if
+    # the flow has been idle for longer than timeout), and marks the flow as used at time now. The
+    # view is only valid until the next lookup.
+    def lookup(self, key, now):
+        row = self.rows.get(key)
+        if row is not None:
+            self.rows.move_to_end(key)
+            if self.timeout > 0 and self.last_seen[row] < now - self.timeout:
+                self.misses         += 1
+                self.evicted_idle   += 1
+                self.slab[row]      = 0
+            else:
+                self.hits += 1
+        else:
+            self.misses += 1
+            self.__evict__(now)
+            row = self.__alloc__()
+            self.rows[key] = row
+            self.slab[row] = self.__migrate__(key)
+        self.last_seen[row] = now
+        return self.slab[row]
+
+    # Statistics of a new flow: its legacy entry if any, zeros otherwise.
+    def __migrate__(self, key):
+        if not self.legacy:
+            return 0
+
+        stats = self.legacy.pop(self.legacy_key(key), None)
+        if stats is None:
+            return 0
+        self.migrated += 1
+        return np.nan_to_num(stats, nan=0.0, posinf=np.inf, neginf=-np.inf)
+
+    # Evicts the idle flows and, if full, the least recently used one.
+    def __evict__(self, now):
+        rows = self.rows
+
+        if self.timeout > 0:
+            deadline = now - self.timeout
+            while rows:
+                key, row = next(iter(rows.items()))
+                if self.last_seen[row] >= deadline:
+                    break
+                del rows[key]
+                self.free.append(row)
+                self.evicted_idle += 1
+
+        if self.capacity > 0 and len(rows) >= self.capacity:
+            _, row = rows.popitem(last=False)
+            self.free.append(row)
+            self.evicted_lru += 1
+
+    def __alloc__(self):
+        if not self.free:
+            # Unbounded table: double the slab.
+            rows            = len(self.slab)
+            self.slab       = np.concatenate((self.slab, np.zeros((rows, self.width))))
+            self.last_seen  = np.concatenate((self.last_seen, np.zeros(rows)))
+            self.free       = list(range(2 * rows - 1, rows - 1, -1))
+        return self.free.pop()
+
+    # State arrays of the table for a snapshot (see snapshot.py), named prefix + name: the flows in
+    # least recently used order (keys split in 64-bit halves), their statistics and idle times, the
+    # legacy entries not migrated yet and the metrics.
+    def snapshot(self, prefix, now):
+        keys = list(self.rows.keys())
+        rows = np.fromiter(self.rows.values(), dtype=np.int64, count=len(keys))
+
+        return {prefix + 'keys_hi':     np.array([key >> 64 for key in keys], dtype=np.uint64),
+                prefix + 'keys_lo':     np.array([key & KEY_MASK for key in keys], dtype=np.uint64),
+                prefix + 'stats':       self.slab[rows],
+                prefix + 'idle':        now - self.last_seen[rows],
+                prefix + 'legacy':      np.array(list(self.legacy.keys()), dtype=str),
+                prefix + 'metrics':     np.array([self.hits, self.misses, self.migrated,
+                                                  self.evicted_lru, self.evicted_idle], dtype=np.int64)}
+
+    # Restores the state saved by snapshot() from the snapshot arrays (npz), elapsed seconds after
+    # the snapshot was taken (counted as idle time), into a newly built table: its legacy entries
+    # are restricted to the ones not migrated yet at the time of the snapshot.
+    def restore(self, npz, prefix, now, elapsed):
+        legacy = self.legacy
+        self.clear()
+
+        # Only the most recently used flows fit if the capacity was lowered.
+        n_keys  = len(npz[prefix + 'keys_hi'])
+        first   = n_keys - self.capacity if 0 < self.capacity < n_keys else 0
+        n       = n_keys - first
+
+        # The flows take the first n rows of the slab, in least recently used order.
+        if n > len(self.slab):
+            rows            = 1 << (n - 1).bit_length()
+            self.slab       = np.zeros((rows, self.width))
+            self.last_seen  = np.zeros(rows)
+        self.slab[:n]       = npz[prefix + 'stats'][first:]
+        self.last_seen[:n]  = now - elapsed - npz[prefix + 'idle'][first:]
+        self.free           = list(range(len(self.slab) - 1, n - 1, -1))
+
+        keys_hi     = npz[prefix + 'keys_hi'][first:].tolist()
+        keys_lo     = npz[prefix + 'keys_lo'][first:].tolist()
+        self.rows   = OrderedDict(zip([(hi << 64) | lo for hi, lo in zip(keys_hi, keys_lo)], range(n)))
+
+        self.legacy = {key: legacy[key] for key in npz[prefix + 'legacy'].tolist() if key in legacy}
+
+        self.hits, self.misses, self.migrated, self.evicted_lru, self.evicted_idle = \
+            npz[prefix + 'metrics'].tolist()
+
+    def clear(self):
+        self.rows.clear()
+        self.legacy = {}
+        self.free   = list(range(len(self.slab) - 1, -1, -1))
+
+    def stats(self):
+        return {'flows':        len(self.rows),
+                'capacity':     self.capacity,
+                'occupancy':    len(self.rows) / self.capacity if self.capacity > 0 else 0.0,
+                'hits':         self.hits,
+                'misses':       self.misses,
+                'migrated':     self.migrated,
+                'legacy':       len(self.legacy),
+                'evicted_lru':  self.evicted_lru,
+                'evicted_idle': self.evicted_idle}
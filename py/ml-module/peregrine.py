@@ -1,19 +1,67 @@
 import os
+import time
+import itertools
+import socket
 from plugins.KitNET.KitNET import KitNET
+from flow_table import FlowTable
+from snapshot import Snapshotter, load_snapshot
+from metrics import METRICS
+from plugins.KitNET.bundle import open_bundle
 import numpy as np
-import pandas as pd
 import pickle
 from pathlib import Path
 
+# Hot path stages (see metrics.py).
+STAGE_FLOW_TABLE    = METRICS.stage('flow_table')
+STAGE_KITNET        = METRICS.stage('kitnet')
+
+
+# Packed integer flow keys, from the integer header fields of a record.
+def key_mac_ip_src(mac_src, ip_src):
+    return (mac_src << 32) | ip_src
+
+
+def key_ip(ip_src, ip_dst):
+    return (ip_src << 32) | ip_dst
+
+
+def key_five_t(ip_src, ip_dst, proto, sport, dport):
+    return (ip_src << 72) | (ip_dst << 40) | (proto << 32) | (sport << 16) | dport
+
+
+def mac_to_str(mac):
+    mac = mac.to_bytes(6, 'big').hex()
+    return ':'.join(mac[i:i + 2] for i in range(0, 12, 2))
+
+
+def ip_to_str(ip):
+    return socket.inet_ntoa(ip.to_bytes(4, 'big'))
+
+
+# Header string keys of the training statistics pickles (concatenated header strings),
+# for each packed key.
+def legacy_key_mac_ip_src(key):
+    return mac_to_str(key >> 32) + ip_to_str(key & 0xFFFFFFFF)
+
+
+def legacy_key_ip(key):
+    return ip_to_str(key >> 32) + ip_to_str(key & 0xFFFFFFFF)
+
+
+def legacy_key_five_t(key):
+    return ip_to_str(key >> 72) + ip_to_str((key >> 40) & 0xFFFFFFFF) + str((key >> 32) & 0xFF) + \
+        str((key >> 16) & 0xFFFF) + str(key & 0xFFFF)
+
 
 class Peregrine:
     def __init__(self, fm_grace, ad_grace, max_autoencoder_size=10, learning_rate=0.1,
                  hidden_ratio=0.75, lambdas=4, fm_model=None, el_model=None, ol_model=None, 
-                 train_stats=None, attack=''):
+                 train_stats=None, attack='', train_batch=1, flow_capacity=0, flow_timeout=0,
+                 snapshot_path=None, snapshot_interval=0, stats_history=0):
 
         # Initialize KitNET.
         self.AnomDetector = KitNET(fm_grace, ad_grace, 80, max_autoencoder_size, learning_rate, 
-                                   hidden_ratio, fm_model, el_model, ol_model, attack)
+                                   hidden_ratio, fm_model, el_model, ol_model, attack, train_batch)
 
         self.decay_to_pos = {0: 0, 1: 0, 2: 1, 3: 2, 4: 3,
                              8192: 1, 16384: 2, 24576: 3}
@@ -24,70 +72,141 @@ class Peregrine:
         self.attack     = attack
         self.m          = max_autoencoder_size
 
+        # KitNET input vectors kept for save_exec_stats, up to stats_history per phase (training,
+        # execution; 0: none), so that memory stays bounded on long runs.
+        self.stats_history          = stats_history
+        self.stats_cnt              = 0
         self.df_train_stats_list    = []
         self.df_exec_stats_list     = []
 
-        # If train_skip is true, import the previously generated models.
-        with open(train_stats, 'rb') as f_stats:
-            stats                   = pickle.load(f_stats)
-            self.stats_mac_ip_src   = stats[0]
-            self.stats_ip_src       = stats[1]
-            self.stats_ip           = stats[2]
-            self.stats_five_t       = stats[3]
+        # Per-flow statistics tables, bounded to flow_capacity flows each and evicting flows idle for
+        # flow_timeout seconds (0: unbounded / never). Flows are timed with the packet timestamps of
+        # the records when given (trace time, see proc_batch), on arrival otherwise (monotonic
+        # clock). now is the time of the last record.
+        self.flow_capacity  = flow_capacity
+        self.flow_timeout   = flow_timeout
+        self.trace_clock    = False
+        self.now            = 0.0
+
+        # If train_skip is true, import the previously generated models
+        # (training statistics pickle, or model bundle).
+        if train_stats.endswith('.npz'):
+            stats = open_bundle(train_stats).train_stats()
+        else:
+            with open(train_stats, 'rb') as f_stats:
+                stats = pickle.load(f_stats)
+
+        self.stats_mac_ip_src   = FlowTable(3 * lambdas, flow_capacity, flow_timeout,
+                                            stats[0], legacy_key_mac_ip_src)
+        self.stats_ip_src       = FlowTable(3 * lambdas, flow_capacity, flow_timeout,
+                                            stats[1], ip_to_str)
+        self.stats_ip           = FlowTable(7 * lambdas, flow_capacity, flow_timeout,
+                                            stats[2], legacy_key_ip)
+        self.stats_five_t       = FlowTable(7 * lambdas, flow_capacity, flow_timeout,
+                                            stats[3], legacy_key_five_t)
+
+        # Warm restart from the last snapshot, if any, and periodic snapshots of the flow tables
+        # and KitNET every snapshot_interval seconds (see snapshot.py).
+        self.snapshots = None
+        if snapshot_path:
+            self.restore(snapshot_path)
+            self.snapshots = Snapshotter(snapshot_path, snapshot_interval, self.snapshot)
+
+    # now: packet timestamp of the record (trace time), or None (arrival time).
+    def proc_next_packet(self, cur_stats, now=None):
+        if self.snapshots is not None:
+            self.snapshots.tick()
+
+        self.trace_clock = now is not None
+        if now is None:
+            now = time.monotonic()
+
+        start           = time.perf_counter_ns()
+        processed_stats = self.__update_stats__(cur_stats, now)
+        mid             = time.perf_counter_ns()
+        STAGE_FLOW_TABLE.observe(mid - start)
+
+        # Run KitNET with the current statistics.
+        rmse = self.AnomDetector.process(processed_stats)
+        STAGE_KITNET.observe(time.perf_counter_ns() - mid)
+        return rmse
+
+    # Processes a batch of records. The flow statistics are updated record by record; KitNET then
+    # trains on (or scores) the whole batch at once (see KitNET.process_batch).
+    # times: packet timestamps of the records (trace time), or None (arrival time of the batch).
+    # Returns the list of scores.
+    def proc_batch(self, records, times=None):
+        if self.snapshots is not None:
+            self.snapshots.tick()
+
+        self.trace_clock = times is not None
+        if times is None:
+            times = itertools.repeat(time.monotonic())
+
+        start           = time.perf_counter_ns()
+        processed_stats = [self.__update_stats__(cur_stats, now)
+                           for cur_stats, now in zip(records, times)]
+        mid             = time.perf_counter_ns()
+        STAGE_FLOW_TABLE.observe(mid - start, len(records))
+        if not processed_stats:
+            return []
 
-    def proc_next_packet(self, cur_stats):
+        rmses = self.AnomDetector.process_batch(np.array(processed_stats))
+        STAGE_KITNET.observe(time.perf_counter_ns() - mid, len(records))
+        return rmses
+
+    # Updates the flow statistics with a record seen at time now and returns the KitNET input vector.
+    # A record holds the integer header fields (mac_src, ip_src, ip_dst, proto, sport, dport)
+    # followed by the statistics (see pipeline.decode_records).
+    def __update_stats__(self, cur_stats, now):
         try:
             cur_decay_pos = self.decay_to_pos[cur_stats[6]]
         except KeyError:
             print(cur_stats)
 
-        hdr_mac_ip_src  = cur_stats[0] + cur_stats[1]
-        hdr_ip_src      = cur_stats[1]
-        hdr_ip          = cur_stats[1] + cur_stats[2]
-        hdr_five_t      = cur_stats[1] + cur_stats[2] + cur_stats[3] + cur_stats[4] + cur_stats[5]
-
-        if hdr_mac_ip_src not in self.stats_mac_ip_src:
-            self.stats_mac_ip_src[hdr_mac_ip_src] = np.zeros(3 * self.lambdas)
-        self.stats_mac_ip_src[hdr_mac_ip_src][(3*cur_decay_pos):(3*cur_decay_pos+3)] = \
-            cur_stats[7:10]
-
-        if hdr_ip_src not in self.stats_ip_src:
-            self.stats_ip_src[hdr_ip_src] = np.zeros(3 * self.lambdas)
-        self.stats_ip_src[hdr_ip_src][(3*cur_decay_pos):(3*cur_decay_pos+3)] = \
-            cur_stats[10:13]
-
-        if hdr_ip not in self.stats_ip:
-            self.stats_ip[hdr_ip] = np.zeros(7 * self.lambdas)
-        self.stats_ip[hdr_ip][(7*cur_decay_pos):(7*cur_decay_pos+7)] = \
-            cur_stats[13:20]
-
-        if hdr_five_t not in self.stats_five_t:
-            self.stats_five_t[hdr_five_t] = np.zeros(7 * self.lambdas)
-        self.stats_five_t[hdr_five_t][(7*cur_decay_pos):(7*cur_decay_pos+7)] = \
-            cur_stats[20:]
-
-        processed_stats = np.concatenate((self.stats_mac_ip_src[hdr_mac_ip_src],
-                                          self.stats_ip_src[hdr_ip_src],
-                                          self.stats_ip[hdr_ip],
-                                          self.stats_five_t[hdr_five_t]))
-
-        # Convert any existing NaNs to 0.
-        processed_stats[np.isnan(processed_stats)] = 0
-
-        if len(self.df_train_stats_list) < self.fm_grace + self.ad_grace:
-            self.df_train_stats_list.append(processed_stats)
-        else:
-            self.df_exec_stats_list.append(processed_stats)
+        mac_src, ip_src, ip_dst, proto, sport, dport = cur_stats[:6]
 
+        # Packed keys (see key_mac_ip_src, key_ip and key_five_t), inlined.
+        hdr_mac_ip_src  = (mac_src << 32) | ip_src
+        hdr_ip_src      = ip_src
+        hdr_ip          = (ip_src << 32) | ip_dst
+        hdr_five_t      = (hdr_ip << 40) | (proto << 32) | (sport << 16) | dport
 
-        # Run KitNET with the current statistics.
-        return self.AnomDetector.process(processed_stats)
+        self.now = now
+
+        stats_mac_ip_src = self.stats_mac_ip_src.lookup(hdr_mac_ip_src, now)
+        stats_mac_ip_src[(3*cur_decay_pos):(3*cur_decay_pos+3)] = cur_stats[7:10]
+
+        stats_ip_src = self.stats_ip_src.lookup(hdr_ip_src, now)
+        stats_ip_src[(3*cur_decay_pos):(3*cur_decay_pos+3)] = cur_stats[10:13]
+
+        stats_ip = self.stats_ip.lookup(hdr_ip, now)
+        stats_ip[(7*cur_decay_pos):(7*cur_decay_pos+7)] = cur_stats[13:20]
+
+        stats_five_t = self.stats_five_t.lookup(hdr_five_t, now)
+        stats_five_t[(7*cur_decay_pos):(7*cur_decay_pos+7)] = cur_stats[20:]
+
+        # NaNs (only found in the training statistics) are converted to 0 when migrated to the slabs.
+        processed_stats = np.concatenate((stats_mac_ip_src, stats_ip_src, stats_ip, stats_five_t))
+
+        if self.stats_history > 0:
+            if self.stats_cnt < self.fm_grace + self.ad_grace:
+                stats_list = self.df_train_stats_list
+            else:
+                stats_list = self.df_exec_stats_list
+            if len(stats_list) < self.stats_history:
+                stats_list.append(processed_stats)
+            self.stats_cnt += 1
+
+        return processed_stats
 
     def save_exec_stats(self):
         outdir = str(Path(__file__).parents[0]) + '/KitNET/models'
         if not os.path.exists(str(Path(__file__).parents[0]) + '/KitNET/models'):
             os.mkdir(outdir)
 
+        import pandas as pd
+
         for i in range(0, len(self.df_exec_stats_list), 50000):
             self.df_exec_stats_list[i:i + 50000]
             df_exec_stats = pd.DataFrame(self.df_exec_stats_list[i:i + 50000])
@@ -99,7 +218,68 @@ class Peregrine:
     def reset_stats(self):
         print('Reset stats')
 
-        self.stats_mac_ip_src   = {}
-        self.stats_ip_src       = {}
-        self.stats_ip           = {}
-        self.stats_five_t       = {}
+        self.stats_mac_ip_src.clear()
+        self.stats_ip_src.clear()
+        self.stats_ip.clear()
+        self.stats_five_t.clear()
+
+    def flow_tables(self):
+        return {'mac_ip_src':   self.stats_mac_ip_src,
+                'ip_src':       self.stats_ip_src,
+                'ip':           self.stats_ip,
+                'five_t':       self.stats_five_t}
+
+    # Occupancy and eviction metrics of the flow tables (see FlowTable.stats).
+    def flow_stats(self):
+        return {name: table.stats() for name, table in self.flow_tables().items()}
+
+    # State arrays for a snapshot: the flow tables (flow_<table>_*, see FlowTable.snapshot) and
+    # KitNET (see KitNET.snapshot), with the wall clock time of the snapshot and, if the flows are
+    # timed in trace time, the time of the last record (trace_time).
+    def snapshot(self):
+        now     = self.now if self.trace_clock else time.monotonic()
+        arrays  = {'time': np.float64(time.time())}
+        if self.trace_clock:
+            arrays['trace_time'] = np.float64(now)
+        for name, table in self.flow_tables().items():
+            arrays.update(table.snapshot(f'flow_{name}_', now))
+        arrays.update(self.AnomDetector.snapshot())
+        return arrays
+
+    # Restores the state of a snapshot, if there is one at path. In trace time, the flows resume
+    # at the time of the last record; otherwise, the time elapsed since the snapshot counts as idle
+    # time for the flows.
+    def restore(self, path):
+        npz = load_snapshot(path)
+        if npz is None:
+            return
+
+        start   = time.monotonic()
+        elapsed = max(time.time() - float(npz['time']), 0.0)
+        if 'trace_time' in npz:
+            self.trace_clock    = True
+            self.now            = float(npz['trace_time'])
+            now, idle           = self.now, 0.0
+        else:
+            now, idle           = start, elapsed
+        for name, table in self.flow_tables().items():
+            table.restore(npz, f'flow_{name}_', now, idle)
+        self.AnomDetector.restore(npz, path)
+        npz.close()
+
+        print(f'Restored snapshot {path} ({elapsed:.1f} s old): '
+              f'{sum(len(table) for table in self.flow_tables().values())} flows '
+              f'in {time.monotonic() - start:.3f} s')
+
+    # Writes the final snapshot.
+    def close(self):
+        if self.snapshots is not None:
+            self.snapshots.close()
+            print_snapshot_stats(self.snapshots)
+
+
+def print_snapshot_stats(snapshots):
+    stats = snapshots.stats()
+    print(f'Snapshots: written {stats["written"]}, skipped {stats["skipped"]}, '
+          f'failed {stats["failed"]}. Last pause {1000 * stats["pause"]:.3f} ms, '
+          f'last write {stats["duration"]:.3f} s')
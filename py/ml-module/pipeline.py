@@ -1,13 +1,15 @@
-import os
 import sys
-import json
+import socket
 import itertools
-import pandas as pd
-from datetime import datetime
-from pathlib import Path
-from scapy.all import sniff, bind_layers, TCP, UDP, ICMP, Ether, IP
+import time
+from capture import PacketCapture
+from alerts import AlertSink
+from metrics import METRICS
+from decoder import decode_batch, decode_record_batch, decode_record_times
 from peregrine import Peregrine
-from peregrine_header import PeregrineHdr
+from plugins.KitNET.bundle import open_bundle
+from shard import ShardedPeregrine
+from transport import open_receiver, RECORD
 
 # KitNET parameters
 
@@ -24,6 +26,29 @@ pkt_header  = []    # Header fields from the last received packet.
 # Needed to keep track of the total pkt num, as not all pkts are sent to the control plane.
 pkt_cnt_global = 0
 
+# Hot path stages (see metrics.py). Capture: time spent waiting for (and receiving) a batch.
+STAGE_CAPTURE   = METRICS.stage('capture')
+STAGE_DECODE    = METRICS.stage('decode')
+STAGE_ALERTS    = METRICS.stage('alerts')
+
+# Scapy layers of the reference decoder, imported by load_scapy() (scapy.all takes seconds to
+# import, and the other decoders do not need it).
+Ether = IP = TCP = UDP = PeregrineHdr = None
+
+
+def load_scapy():
+    global Ether, IP, TCP, UDP, PeregrineHdr
+    if PeregrineHdr is not None:
+        return
+
+    from scapy.all import bind_layers, TCP, UDP, ICMP, Ether, IP
+    from peregrine_header import PeregrineHdr
+
+    bind_layers(UDP, PeregrineHdr)
+    bind_layers(TCP, PeregrineHdr)
+    bind_layers(ICMP, PeregrineHdr)
+
+
 def pkt_callback(pkt):
     global cur_stats
     cur_stats = 0
@@ -55,105 +80,210 @@ def pkt_callback(pkt):
                       pkt[PeregrineHdr].five_t_sum_res_prod_cov,
                       pkt[PeregrineHdr].five_t_pcc]]
 
-        pkt_header = [str(pkt[Ether].src),
-                      str(pkt[IP].src),
-                      str(pkt[IP].dst),
-                      str(pkt[IP].proto)]
+        pkt_header = [int(pkt[Ether].src.replace(':', ''), 16),
+                      int.from_bytes(socket.inet_aton(pkt[IP].src), 'big'),
+                      int.from_bytes(socket.inet_aton(pkt[IP].dst), 'big'),
+                      pkt[IP].proto]
 
         if UDP in pkt:
-            pkt_header.append(str(pkt[UDP].sport))
-            pkt_header.append(str(pkt[UDP].dport))
+            pkt_header.append(pkt[UDP].sport)
+            pkt_header.append(pkt[UDP].dport)
         elif TCP in pkt:
-            pkt_header.append(str(pkt[TCP].sport))
-            pkt_header.append(str(pkt[TCP].dport))
+            pkt_header.append(pkt[TCP].sport)
+            pkt_header.append(pkt[TCP].dport)
         else:
-            pkt_header.append('0')
-            pkt_header.append('0')
+            pkt_header.append(0)
+            pkt_header.append(0)
         cur_stats.insert(0, pkt_header)
 
-def pkt_pipeline(cur_eg_veth, fm_grace, ad_grace, max_ae, fm_model, el_model, ol_model,
-                 train_stats, thres_path, attack):
-    global cur_stats
-    global pkt_header
-    global pkt_cnt_global
-
-    bind_layers(UDP, PeregrineHdr)
-    bind_layers(TCP, PeregrineHdr)
-    bind_layers(ICMP, PeregrineHdr)
-
+# Builds Peregrine (sharded across workers processes if workers > 1, see shard.py) and reads its
+# threshold. Returns a (peregrine, threshold) tuple.
+def build_peregrine(fm_grace, ad_grace, max_ae, fm_model, el_model, ol_model, train_stats,
+                    thres_path, attack, train_batch=1, workers=1, flow_capacity=0, flow_timeout=0,
+                    snapshot_path=None, snapshot_interval=0, stats_history=0):
     threshold = 0
 
-    with open(thres_path, 'r') as f:
-        threshold = f.readline()
+    if thres_path.endswith('.npz'):
+        threshold = open_bundle(thres_path).threshold()
+    else:
+        with open(thres_path, 'r') as f:
+            threshold = f.readline()
+
+    # The thresholds shipped with the models were computed with per-sample AD training: a model
+    # trained here in mini-batches scores differently, and needs its own threshold.
+    if train_batch > 1 and (el_model is None or ol_model is None):
+        print(f'Warning: the AD is trained with train_batch {train_batch}, but the threshold '
+              f'({thres_path}) was not computed for it, recompute it once trained.')
 
     # Build Peregrine.
-    peregrine = Peregrine(fm_grace, ad_grace, max_ae, learning_rate, hidden_ratio, lambdas,
-                          fm_model, el_model, ol_model, train_stats, attack)
+    if workers > 1:
+        peregrine = ShardedPeregrine(workers, fm_grace, ad_grace, max_ae, learning_rate,
+                                     hidden_ratio, lambdas, fm_model, el_model, ol_model,
+                                     train_stats, attack, train_batch, flow_capacity, flow_timeout,
+                                     snapshot_path, snapshot_interval, stats_history)
+    else:
+        peregrine = Peregrine(fm_grace, ad_grace, max_ae, learning_rate, hidden_ratio, lambdas,
+                              fm_model, el_model, ol_model, train_stats, attack, train_batch,
+                              flow_capacity, flow_timeout, snapshot_path, snapshot_interval,
+                              stats_history)
+
+    return peregrine, float(threshold)
+
+
+def pkt_pipeline(cur_eg_veth, fm_grace, ad_grace, max_ae, fm_model, el_model, ol_model,
+                 train_stats, thres_path, attack, batch_size=256, timeout=60, decoder='fast',
+                 transport='veth', transport_addr=None, train_batch=1, workers=1,
+                 flow_capacity=0, flow_timeout=0, alerts=None, snapshot_path=None,
+                 snapshot_interval=0, metrics=None, stats_history=0):
+    peregrine, threshold = build_peregrine(fm_grace, ad_grace, max_ae, fm_model, el_model,
+                                           ol_model, train_stats, thres_path, attack, train_batch,
+                                           workers, flow_capacity, flow_timeout, snapshot_path,
+                                           snapshot_interval, stats_history)
+
+    if transport == 'veth':
+        # Long-lived capture: frames are drained from a single socket in batches.
+        capture = PacketCapture(cur_eg_veth, batch_size=batch_size, timeout=timeout)
+    else:
+        # Records pushed by the simulator through a UNIX socket or a shared memory ring.
+        capture = open_receiver(transport, transport_addr, batch_size, timeout)
+        decoder = 'record'
+    capture.start()
+
+    # Alerts are written by a background thread (see alerts.py).
+    if alerts is None:
+        alerts = AlertSink()
+
+    # Metrics endpoint and dump (see metrics.py), with the capture, flow table and alert metrics.
+    # The flow tables of sharded workers are only read by print_flow_stats (from this thread).
+    METRICS.gauge('capture', 'Capture counters.', capture.stats)
+    METRICS.gauge('alerts', 'Alert sink counters.', alerts.stats)
+    if workers == 1:
+        METRICS.gauge('flows', 'Flows per flow table.',
+                      lambda: {table: len(flow_table) for table, flow_table in
+                               peregrine.flow_tables().items()})
+
+    batch_lat_sum = 0
+    batch_lat_max = 0
+    batch_cnt     = 0
 
     print('--- ML Module: Inference phase ---')
     print('--- Processing...')
-    # Process the trace, packet by packet.
+    # Process the trace, batch by batch.
     while True:
-        cur_stats = -1
+        start = time.perf_counter_ns()
+        batch = capture.next_batch()
 
-        if pkt_cnt_global % 10000 == 0:
-            print('Processed packets: ', fm_grace + ad_grace + pkt_cnt_global)
+        if batch is None:
+            print('Timeout.')
+            break
 
-        # Execution: data plane
-        # Callback function to retrieve the packet's custom header.
-        sniff(iface=cur_eg_veth, count=1, prn=pkt_callback, timeout=60)
+        frames, ts_first = batch
+        STAGE_CAPTURE.observe(time.perf_counter_ns() - start,
+                              len(frames) // RECORD.size if decoder == 'record' else len(frames))
 
-        # If any statistics were obtained, send them to the ML pipeline.
-        if cur_stats != -1:
-            if cur_stats == 0:
-                continue
+        process_batch(peregrine, threshold, frames, decoder, alerts)
 
-            # Flatten the statistics' list of lists.
-            cur_stats = list(itertools.chain(*cur_stats))
+        # Batch latency: from the reception of its first frame to the end of its processing.
+        batch_lat       = time.time() - ts_first
+        batch_lat_sum   += batch_lat
+        batch_lat_max   = max(batch_lat_max, batch_lat)
+        batch_cnt       += 1
 
-            # Call function with the content of kitsune's main (before the eval/csv part).
-            rmse = peregrine.proc_next_packet(cur_stats)
+        if batch_cnt % 100 == 0:
+            print_capture_stats(capture, batch_cnt, batch_lat_sum, batch_lat_max)
+            print_flow_stats(peregrine)
+            print_alert_stats(alerts)
+            batch_lat_sum = 0
+            batch_lat_max = 0
 
-            # ---------- json ----------
+    capture.stop()
+    print_capture_stats(capture, batch_cnt, batch_lat_sum, batch_lat_max)
+    print_flow_stats(peregrine)
 
-            if rmse > float(threshold):
-                output_json(cur_stats)
+    alerts.close()
+    print_alert_stats(alerts)
 
-            # --------------------------
+    # Final snapshot (see Peregrine.close), and stop the workers.
+    peregrine.close()
 
-        else:
-            print('Timeout.')
-            break
+    if metrics is not None:
+        metrics.close()
+
+
+# Runs Peregrine on all the records of a batch (see Peregrine.proc_batch),
+# pushing an alert to the alert sink for every record above the threshold.
+# Transport records carry their packet timestamp, which times the flows (frames from the data
+# plane do not: their flows are timed on arrival).
+def process_batch(peregrine, threshold, frames, decoder, alerts):
+    pkt_cnt_first   = pkt_cnt_global
+    start           = time.perf_counter_ns()
+    records         = list(decode_records(frames, decoder))
+    times           = decode_record_times(frames) if decoder == 'record' else None
+    STAGE_DECODE.observe(time.perf_counter_ns() - start, len(records))
+
+    if pkt_cnt_global // 10000 > pkt_cnt_first // 10000:
+        print('Processed packets: ', peregrine.fm_grace + peregrine.ad_grace + pkt_cnt_global)
+
+    # Call function with the content of kitsune's main (before the eval/csv part).
+    rmses = peregrine.proc_batch(records, times)
 
-def output_json(cur_stats):
-        ts_datetime = datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
-
-        # Get current flow headers
-
-        ip_src      = cur_stats[1]
-        ip_dst      = cur_stats[2]
-        ip_proto    = cur_stats[3]
-        port_src    = cur_stats[4]
-        port_dst    = cur_stats[5]
-
-        # Generate json
-
-        output_json = {
-            "timestamp": ts_datetime,
-            "data": {
-                "ip_src": ip_src,
-                "ip_dst": ip_dst,
-                "ip_proto": ip_proto,
-                "port_src": port_src,
-                "port_dst": port_dst,
-                "prediction": "MALICIOUS FLOW"
-            },
-            "model": "KitNET"
-        }
-
-        outdir = str(Path(__file__).parents[0]) + '/json'
-        if not os.path.exists(str(Path(__file__).parents[0]) + '/json'):
-            os.mkdir(outdir)
-
-        with open(f'json/alert-{ts_datetime}.json', mode="w", encoding="utf-8") as wf:
-            json.dump(output_json, wf)
+    start = time.perf_counter_ns()
+    for cur_stats, rmse in zip(records, rmses):
+        if rmse > threshold:
+            alerts.push(cur_stats, rmse)
+    STAGE_ALERTS.observe(time.perf_counter_ns() - start, len(records))
+
+
+# Yields the flattened header + statistics list of every Peregrine record in a batch of frames.
+# Header fields are integers: mac_src, ip_src, ip_dst, proto, sport, dport.
+# decoder: 'fast' (struct/NumPy based, see decoder.py), 'scapy' (reference decoder) or 'record'
+# (binary records from a transport, see transport.py).
+def decode_records(frames, decoder='fast'):
+    global cur_stats
+    global pkt_cnt_global
+
+    if decoder == 'scapy':
+        load_scapy()
+        for frame in frames:
+            # Callback function to retrieve the packet's custom header.
+            pkt_callback(Ether(frame))
+
+            # If any statistics were obtained, send them to the ML pipeline.
+            if cur_stats == 0:
+                continue
+
+            # Flatten the statistics' list of lists.
+            yield list(itertools.chain(*cur_stats))
+    else:
+        if decoder == 'record':
+            flows, stats = decode_record_batch(frames)
+        else:
+            flows, stats = decode_batch(frames)
+        stats = stats.tolist()
+
+        for flow, flow_stats in zip(flows.tolist(), stats):
+            pkt_cnt_global += 1
+            yield list(flow) + flow_stats
+
+
+def print_capture_stats(capture, batch_cnt, batch_lat_sum, batch_lat_max):
+    stats       = capture.stats()
+    lat_window  = batch_cnt % 100 or 100
+    print(f'Capture: recv {stats["recv"]}, kernel {stats["kernel"]}, '
+          f'dropped {stats["dropped"]}, batches {stats["batches"]}. '
+          f'Batch latency (ms): avg {1000 * batch_lat_sum / lat_window:.3f}, '
+          f'max {1000 * batch_lat_max:.3f}')
+
+def print_flow_stats(peregrine):
+    for table, stats in peregrine.flow_stats().items():
+        print(f'Flow table {table}: {stats["flows"]} flows, '
+              f'occupancy {100 * stats["occupancy"]:.1f}%, '
+              f'hits {stats["hits"]}, misses {stats["misses"]}, migrated {stats["migrated"]}, '
+              f'evicted (lru) {stats["evicted_lru"]}, evicted (idle) {stats["evicted_idle"]}')
+
+
+def print_alert_stats(alerts):
+    stats = alerts.stats()
+    print(f'Alerts: pushed {stats["pushed"]}, written {stats["written"]}, '
+          f'queued {stats["queued"]}, dropped {stats["dropped"]}, '
+          f'suppressed {stats["suppressed"]}, errors {stats["errors"]}')
@@ -1,5 +1,5 @@
+import time
 import numpy as np
-from scipy.cluster.hierarchy import linkage, to_tree
 
 
 # A helper class for KitNET which performs a correlation-based incremental clustering of the dimensions in X n: the
@@ -15,6 +15,7 @@ class CorClust:
         self.c_rs = np.zeros(n)  # linear sum of feature residues
         self.C = np.zeros((n, n))  # partial correlation matrix
         self.N = 0  # number of updates performed
+        self.cluster_time = 0.0  # duration (s) of the last cluster() call
 
     # x: a numpy vector of length n
     def update(self, x):
@@ -25,6 +26,21 @@ class CorClust:
         self.c_rs += c_rt ** 2
         self.C += np.outer(c_rt, c_rt)
 
+    # X: a numpy array of k vectors of length n (k x n)
+    # Same as calling update() on each row of X: the residue of each row is taken against the running mean after
+    # that row (cumulative sums), and the outer products are folded into C with a single matrix product.
+    def update_batch(self, X):
+        k = len(X)
+        if k == 0:
+            return
+        c_t = self.c + np.cumsum(X, axis=0)  # linear sums after each row
+        c_rt = X - c_t / (self.N + np.arange(1, k + 1))[:, None]
+        self.N += k
+        self.c = c_t[-1]
+        self.c_r += c_rt.sum(axis=0)
+        self.c_rs += (c_rt ** 2).sum(axis=0)
+        self.C += np.dot(c_rt.T, c_rt)
+
     # creates the current correlation distance matrix between the features
     def corr_dist(self):
         c_rs_sqrt = np.sqrt(self.c_rs)
@@ -38,7 +54,11 @@ class CorClust:
         return D
 
     # clusters the features together, having no more than maxClust features per cluster
+    # scipy.cluster is only imported here (once the feature mapping grace period is over).
     def cluster(self, max_clust):
+        from scipy.cluster.hierarchy import linkage, to_tree
+
+        start = time.time()
         D = self.corr_dist()
         Z = linkage(D[np.triu_indices(self.n, 1)])  # create a linkage matrix based on the distance matrix
         if max_clust < 1:
@@ -46,6 +66,7 @@ class CorClust:
         if max_clust > self.n:
             max_clust = self.n
         map = self.__breakClust__(to_tree(Z), max_clust)
+        self.cluster_time = time.time() - start
         return map
 
     # a recursive helper function which breaks down the dendrogram branches until all clusters have no more than
@@ -1,9 +1,13 @@
 import os
+import time
 import numpy as np
 import pickle
 from pathlib import Path
 from .dA import DA, DAParams
 from .CorClust import CorClust
+from .ensemble import FusedEnsemble
+from .bundle import ModelBundle, load_feature_map, load_ensemble_layer, load_output_layer, save_bundle, \
+    bundle_arrays
 
 
 # This class represents a KitNET machine learner. KitNET is a lightweight online anomaly detection algorithm based on
@@ -19,9 +23,10 @@ class KitNET:
     # 0.75 will cause roughly a 25% compression in the hidden layer. feature_map: One may optionally provide a
     # feature map instead of learning one. The map must be a list, where the i-th entry contains a list of the
     # feature indices to be assigned to the i-th autoencoder in the ensemble. For example, [[2,5,3],[4,0,1],[6,7]]
+    # feature_map, ensemble_layer and output_layer are pickle paths, or model bundle paths (.npz, see bundle.py).
     def __init__(self, fm_grace_period, ad_grace_period, n, max_autoencoder_size=10,
                  learning_rate=0.1, hidden_ratio=0.75, feature_map=None, ensemble_layer=None,
-                 output_layer=None, attack=''):
+                 output_layer=None, attack='', train_batch=1):
         # Parameters:
         self.AD_grace_period = ad_grace_period
         if fm_grace_period is None:
@@ -35,33 +40,37 @@ class KitNET:
         self.lr = learning_rate
         self.hr = hidden_ratio
         self.n  = n
+        self.train_batch_size = max(train_batch, 1)  # AD training mini-batch size (1: per-sample SGD)
 
         # Variables
         self.n_trained      = 0  # the number of training instances so far
         self.n_executed     = 0  # the number of executed instances so far
         self.ensembleLayer  = []
         self.outputLayer    = None
+        self.fused          = None  # fused ensemble engine for execute_batch (once trained)
         self.attack         = attack
+        self.train_time     = 0.0   # time spent training the AD
+        self.fm_time        = 0.0   # time spent training the FM (updates and clustering)
 
         # Check if the feature map, ensemble layer and output layer are provided as input.
         # If so, skip the training phase.
+        trained = ensemble_layer is not None and output_layer is not None
 
         if feature_map is not None:
-            with open(feature_map, 'rb') as f_fm:
-                self.v = pickle.load(f_fm)
-            self.__createAD__()
+            self.v = load_feature_map(feature_map)
+            if not trained:
+                self.__createAD__()
             print("Feature-Mapper: execute-mode, Anomaly-Detector: train-mode")
         else:
             self.v = None
             print("Feature-Mapper: train-mode, Anomaly-Detector: off-mode")
         self.FM = CorClust(self.n)  # incremental feature clustering for the feature mapping process
 
-        if ensemble_layer is not None and output_layer is not None:
-            with open(ensemble_layer, 'rb') as f_el:
-                self.ensembleLayer = pickle.load(f_el)
-            with open(output_layer, 'rb') as f_ol:
-                self.outputLayer = pickle.load(f_ol)
+        if trained:
+            self.ensembleLayer = load_ensemble_layer(ensemble_layer)
+            self.outputLayer = load_output_layer(output_layer)
             self.n_trained = self.FM_grace_period + self.AD_grace_period + 1
+            self.fused = FusedEnsemble(self.v, self.ensembleLayer, self.outputLayer)
             print("Feature-Mapper: execute-mode, Anomaly-Detector: execute-mode")
 
     # If FM_grace_period+AM_grace_period has passed, then this function executes KitNET on x.
@@ -80,16 +89,15 @@ class KitNET:
         if self.n_trained < self.FM_grace_period and self.v is None:
             # If the FM is in train-mode, and the user has not supplied a feature mapping
             # update the incremental correlation matrix
+            time_start = time.time()
             self.FM.update(x)
+            self.fm_time += time.time() - time_start
             if self.n_trained == self.FM_grace_period - 1:  # If the feature mapping should be instantiated
-                self.v = self.FM.cluster(self.m)
-                self.__createAD__()
-                print("The Feature-Mapper found a mapping: " + str(self.n) + " features to " + str(
-                    len(self.v)) + " autoencoders.")
-                print("Feature-Mapper: execute-mode, Anomaly-Detector: train-mode")
+                self.__finish_mapping__()
             self.n_trained += 1
             return 0.0
         else:  # train
+            time_start = time.time()
             # Ensemble Layer
             S_l1 = np.zeros(len(self.ensembleLayer))
             for a in range(len(self.ensembleLayer)):
@@ -98,22 +106,132 @@ class KitNET:
                 S_l1[a] = self.ensembleLayer[a].train(xi)
             # OutputLayer
             output = self.outputLayer.train(S_l1)
+            self.train_time += time.time() - time_start
             if self.n_trained == self.AD_grace_period + self.FM_grace_period - 1:
-                print("Feature-Mapper: execute-mode, Anomaly-Detector: execute-mode")
-
-                outdir = str(Path(__file__).parents[0]) + '/models'
-                if not os.path.exists(str(Path(__file__).parents[0]) + '/models'):
-                    os.mkdir(outdir)
-
-                with open(f'{outdir}/{self.attack}-m-{self.m}-fm.txt', 'wb') as f_fm:
-                    pickle.dump(self.v, f_fm)
-                with open(f'{outdir}/{self.attack}-m-{self.m}-el.txt', 'wb') as f_el:
-                    pickle.dump(self.ensembleLayer, f_el)
-                with open(f'{outdir}/{self.attack}-m-{self.m}-ol.txt', 'wb') as f_ol:
-                    pickle.dump(self.outputLayer, f_ol)
+                self.__finish_training__()
             self.n_trained += 1
             return output
 
+    # Batched process(): the instances of X (N x n) are used for training until the grace periods are over
+    # (the FM with one batch update, the AD in mini-batches of train_batch_size), and the rest is executed
+    # with execute_batch.
+    # returns the N scores (0 or training scores during the grace periods)
+    def process_batch(self, X):
+        X       = np.asarray(X)
+        scores  = []
+        i       = 0
+
+        # FM training: the correlation matrix is updated with all the FM rows at once
+        if self.n_trained < self.FM_grace_period and self.v is None:
+            n_fm = min(self.FM_grace_period - self.n_trained, len(X))
+            time_start = time.time()
+            self.FM.update_batch(X[:n_fm])
+            self.fm_time += time.time() - time_start
+            self.n_trained += n_fm
+            scores.extend([0.0] * n_fm)
+            i = n_fm
+            if self.n_trained == self.FM_grace_period:
+                self.__finish_mapping__()
+
+        # AD per-sample training
+        while self.train_batch_size == 1 and i < len(X) and \
+                self.n_trained < self.FM_grace_period + self.AD_grace_period:
+            scores.append(self.train(X[i]))
+            i += 1
+
+        # AD mini-batch training
+        n_train = min(self.FM_grace_period + self.AD_grace_period - self.n_trained, len(X) - i)
+        if n_train > 0:
+            scores.extend(self.train_batch(X[i:i + n_train]).tolist())
+            i += n_train
+
+        if i < len(X):
+            scores.extend(self.execute_batch(X[i:]).tolist())
+
+        return scores
+
+    # force train the AD on the instances of X (N x n) in mini-batches of train_batch_size
+    # returns the training scores of the N instances (do not use for alerting)
+    def train_batch(self, X):
+        time_start  = time.time()
+        output      = np.zeros(len(X))
+        for i in range(0, len(X), self.train_batch_size):
+            Xb = X[i:i + self.train_batch_size]
+            # Ensemble Layer
+            S_l1 = np.zeros((len(Xb), len(self.ensembleLayer)))
+            for a in range(len(self.ensembleLayer)):
+                S_l1[:, a] = self.ensembleLayer[a].train_batch(Xb[:, self.v[a]])
+            # OutputLayer
+            output[i:i + len(Xb)] = self.outputLayer.train_batch(S_l1)
+            self.n_trained += len(Xb)
+        self.train_time += time.time() - time_start
+
+        if self.n_trained == self.AD_grace_period + self.FM_grace_period:
+            self.__finish_training__()
+        return output
+
+    # Builds the feature mapping from the correlation matrix and switches the AD to train-mode.
+    def __finish_mapping__(self):
+        self.v = self.FM.cluster(self.m)
+        self.fm_time += self.FM.cluster_time
+        self.__createAD__()
+        print("The Feature-Mapper found a mapping: " + str(self.n) + " features to " + str(
+            len(self.v)) + " autoencoders.")
+        print(f"Feature-Mapper: {self.FM.N} updates, clustering took {self.FM.cluster_time:.3f} s "
+              f"({self.fm_time:.3f} s in total)")
+        print("Feature-Mapper: execute-mode, Anomaly-Detector: train-mode")
+
+    # Switches the AD to execute-mode: saves the trained models and builds the fused ensemble.
+    def __finish_training__(self):
+        print("Feature-Mapper: execute-mode, Anomaly-Detector: execute-mode")
+        if self.train_time > 0:
+            print(f"Anomaly-Detector: trained on {self.AD_grace_period} instances in {self.train_time:.2f} s "
+                  f"({self.AD_grace_period / self.train_time:.0f} instances/s, batch size {self.train_batch_size})")
+
+        outdir = str(Path(__file__).parents[0]) + '/models'
+        if not os.path.exists(str(Path(__file__).parents[0]) + '/models'):
+            os.mkdir(outdir)
+
+        with open(f'{outdir}/{self.attack}-m-{self.m}-fm.txt', 'wb') as f_fm:
+            pickle.dump(self.v, f_fm)
+        with open(f'{outdir}/{self.attack}-m-{self.m}-el.txt', 'wb') as f_el:
+            pickle.dump(self.ensembleLayer, f_el)
+        with open(f'{outdir}/{self.attack}-m-{self.m}-ol.txt', 'wb') as f_ol:
+            pickle.dump(self.outputLayer, f_ol)
+        # Model only bundle: convert_models.py builds the full one (threshold, statistics, registers).
+        save_bundle(f'{outdir}/{self.attack}-m-{self.m}-model.npz', self.v, self.ensembleLayer,
+                    self.outputLayer, meta={'attack': self.attack, 'm': self.m, 'n': self.n})
+
+        self.fused = FusedEnsemble(self.v, self.ensembleLayer, self.outputLayer)
+
+    # State arrays for a snapshot (see Peregrine.snapshot): the counters and, once trained, the model
+    # (as model bundle arrays). The FM and AD training state is not saved.
+    def snapshot(self):
+        arrays = {'kitnet_counters': np.array([self.n_trained, self.n_executed], dtype=np.int64)}
+        if self.fused is not None:
+            arrays.update(bundle_arrays(self.v, self.ensembleLayer, self.outputLayer,
+                                        meta={'attack': self.attack, 'm': self.m, 'n': self.n}))
+        return arrays
+
+    # Restores the state saved by snapshot() from the snapshot at path (npz: its arrays). A model that
+    # was still training at the time of the snapshot is trained again; a model loaded from the
+    # configuration is kept over the one of the snapshot.
+    def restore(self, npz, path):
+        if 'el_W' not in npz.files:
+            print("Anomaly-Detector: snapshot taken during training, not restored")
+            return
+
+        if self.fused is None:
+            bundle              = ModelBundle(path)
+            self.v              = bundle.feature_map()
+            self.ensembleLayer  = bundle.ensemble_layer()
+            self.outputLayer    = bundle.output_layer()
+            self.fused          = FusedEnsemble(self.v, self.ensembleLayer, self.outputLayer)
+            bundle.close()
+            print("Feature-Mapper: execute-mode, Anomaly-Detector: execute-mode (snapshot)")
+
+        self.n_trained, self.n_executed = npz['kitnet_counters'].tolist()
+
     # force execute KitNET on x
     def execute(self, x):
         if self.v is None:
@@ -131,6 +249,26 @@ class KitNET:
             # OutputLayer
             return self.outputLayer.execute(S_l1)
 
+    # force execute KitNET on a batch of instances X (N x n)
+    # once trained, the whole ensemble runs fused (see FusedEnsemble), else one matrix product per autoencoder
+    # returns the anomaly scores of the N instances
+    def execute_batch(self, X):
+        if self.v is None:
+            raise RuntimeError(
+                'KitNET Cannot execute X, because a feature mapping has not yet been learned or provided. Try running '
+                'process(x) instead.')
+        else:
+            X = np.asarray(X)
+            self.n_executed += len(X)
+            if self.fused is not None:
+                return self.fused.execute(X)
+            # Ensemble Layer
+            S_l1 = np.zeros((len(X), len(self.ensembleLayer)))
+            for a in range(len(self.ensembleLayer)):
+                S_l1[:, a] = self.ensembleLayer[a].execute_batch(X[:, self.v[a]])
+            # OutputLayer
+            return self.outputLayer.execute_batch(S_l1)
+
     def __createAD__(self):
         # construct ensemble layer
         for ad_map in self.v:
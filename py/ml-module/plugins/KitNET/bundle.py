@@ -0,0 +1,194 @@
+import os
+import json
+import pickle
+import functools
+import numpy as np
+from .dA import DA, DAParams
+
+# Versioned model bundle.
+# A trained model is stored as a single uncompressed .npz holding plain arrays only (no pickles):
+#   meta                JSON metadata (format version, KitNET parameters).
+#   threshold           Anomaly threshold (NaN if unknown).
+#   fm_index, fm_offset Feature map: the features of autoencoder a are fm_index[fm_offset[a]:fm_offset[a + 1]].
+#   el_*                Ensemble layer: W (k x max visible x max hidden), biases and norms (zero padded),
+#                       with the sizes of each autoencoder in el_n_visible / el_n_hidden.
+#   ol_*                Output layer: W, biases and norms.
+#   stats_<table>       Controller training statistics (see Peregrine): one row per flow, with the
+#   stats_<table>_keys  flow header strings in a separate array.
+#   reg_<table>         Data plane registers (see dp-sim register_file.RegisterFile.snapshot): the
+#   reg_<table>_index   non-zero registers only, with their indices in a separate array.
+
+BUNDLE_VERSION  = 1
+STATS_TABLES    = ['mac_ip_src', 'ip_src', 'ip', 'five_t']
+
+
+# Saves a model bundle. Every part except the feature map and the layers is optional.
+# train_stats: list of the 4 controller statistics dicts; registers: dict of register arrays.
+def save_bundle(path, feature_map, ensemble_layer, output_layer, threshold=None, train_stats=None,
+                registers=None, meta=None):
+    arrays = bundle_arrays(feature_map, ensemble_layer, output_layer, threshold, train_stats,
+                           registers, meta)
+
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+# The arrays of a model bundle (see save_bundle).
+def bundle_arrays(feature_map, ensemble_layer, output_layer, threshold=None, train_stats=None,
+                  registers=None, meta=None):
+    k       = len(ensemble_layer)
+    n_vis   = np.array([ae.params.n_visible for ae in ensemble_layer], dtype=np.int64)
+    n_hid   = np.array([ae.params.n_hidden for ae in ensemble_layer], dtype=np.int64)
+
+    arrays = {'fm_index':       np.concatenate([np.asarray(ad_map, dtype=np.int64) for ad_map in feature_map]),
+              'fm_offset':      np.cumsum([0] + [len(ad_map) for ad_map in feature_map]),
+              'threshold':      np.float64(np.nan if threshold is None else threshold),
+              'el_n_visible':   n_vis,
+              'el_n_hidden':    n_hid,
+              'el_n':           np.array([ae.n for ae in ensemble_layer], dtype=np.int64),
+              'el_W':           np.zeros((k, n_vis.max(), n_hid.max())),
+              'el_hbias':       np.zeros((k, n_hid.max())),
+              'el_vbias':       np.zeros((k, n_vis.max())),
+              'el_norm_max':    np.zeros((k, n_vis.max())),
+              'el_norm_min':    np.zeros((k, n_vis.max())),
+              'ol_n':           np.int64(output_layer.n),
+              'ol_W':           output_layer.W,
+              'ol_hbias':       output_layer.hbias,
+              'ol_vbias':       output_layer.vbias,
+              'ol_norm_max':    output_layer.norm_max,
+              'ol_norm_min':    output_layer.norm_min}
+
+    for a, ae in enumerate(ensemble_layer):
+        arrays['el_W'][a, :n_vis[a], :n_hid[a]] = ae.W
+        arrays['el_hbias'][a, :n_hid[a]]        = ae.hbias
+        arrays['el_vbias'][a, :n_vis[a]]        = ae.vbias
+        arrays['el_norm_max'][a, :n_vis[a]]     = ae.norm_max
+        arrays['el_norm_min'][a, :n_vis[a]]     = ae.norm_min
+
+    if train_stats is not None:
+        for table, stats in zip(STATS_TABLES, train_stats):
+            arrays[f'stats_{table}_keys']   = np.array(list(stats.keys()), dtype=str)
+            arrays[f'stats_{table}']        = np.array(list(stats.values()), dtype=np.float64)
+
+    if registers is not None:
+        for table, regs in registers.items():
+            nonzero                         = regs.view(np.uint8).reshape(len(regs), -1).any(axis=1)
+            index                           = np.flatnonzero(nonzero)
+            arrays[f'reg_{table}']          = regs[index]
+            arrays[f'reg_{table}_index']    = index
+
+    params  = output_layer.params
+    meta    = dict(meta or {}, version=BUNDLE_VERSION, lr=params.lr, hidden_ratio=params.hiddenRatio,
+                   corruption_level=params.corruption_level, grace_period=params.gracePeriod)
+    arrays['meta'] = np.array(json.dumps(meta))
+
+    return arrays
+
+
+class ModelBundle:
+    # Loads a model bundle (arrays are read on access, without pickle).
+    def __init__(self, path):
+        self.path   = path
+        self.npz    = np.load(path, allow_pickle=False)
+        self.meta   = json.loads(str(self.npz['meta']))
+        self.rng    = np.random.RandomState(1234)  # shared by the rebuilt DAs (only used for corruption)
+
+        if self.meta.get('version') != BUNDLE_VERSION:
+            raise ValueError(f'{path}: unsupported model bundle version {self.meta.get("version")}.')
+
+    def __contains__(self, name):
+        return name in self.npz.files
+
+    def threshold(self):
+        threshold = float(self.npz['threshold'])
+        if np.isnan(threshold):
+            raise ValueError(f'{self.path}: the model bundle has no threshold.')
+        return threshold
+
+    def feature_map(self):
+        index   = self.npz['fm_index'].tolist()
+        offset  = self.npz['fm_offset'].tolist()
+        return [index[offset[a]:offset[a + 1]] for a in range(len(offset) - 1)]
+
+    def ensemble_layer(self):
+        npz     = self.npz
+        W       = npz['el_W']
+        hbias   = npz['el_hbias']
+        vbias   = npz['el_vbias']
+        norm_max = npz['el_norm_max']
+        norm_min = npz['el_norm_min']
+        n       = npz['el_n']
+
+        layer = []
+        for a, (n_vis, n_hid) in enumerate(zip(npz['el_n_visible'].tolist(), npz['el_n_hidden'].tolist())):
+            layer.append(self.__da__(n_vis, n_hid, int(n[a]), W[a, :n_vis, :n_hid], hbias[a, :n_hid],
+                                     vbias[a, :n_vis], norm_max[a, :n_vis], norm_min[a, :n_vis]))
+        return layer
+
+    def output_layer(self):
+        npz = self.npz
+        W   = npz['ol_W']
+        return self.__da__(W.shape[0], W.shape[1], int(npz['ol_n']), W, npz['ol_hbias'], npz['ol_vbias'],
+                           npz['ol_norm_max'], npz['ol_norm_min'])
+
+    # Rebuilds a trained DA from its arrays (without the random initialization of DA.__init__).
+    def __da__(self, n_vis, n_hid, n, W, hbias, vbias, norm_max, norm_min):
+        params = DAParams(n_visible=n_vis, n_hidden=n_hid, lr=self.meta['lr'],
+                          corruption_level=self.meta['corruption_level'],
+                          grace_period=self.meta['grace_period'], hidden_ratio=None)
+        params.hiddenRatio = self.meta['hidden_ratio']
+
+        da          = DA.__new__(DA)
+        da.params   = params
+        da.W        = np.array(W)
+        da.W_prime  = da.W.T
+        da.hbias    = np.array(hbias)
+        da.vbias    = np.array(vbias)
+        da.norm_max = np.array(norm_max)
+        da.norm_min = np.array(norm_min)
+        da.n        = n
+        da.rng      = self.rng
+        return da
+
+    # The 4 controller statistics dicts (see Peregrine), keyed by the flow header strings.
+    def train_stats(self):
+        if 'stats_mac_ip_src' not in self.npz.files:
+            raise ValueError(f'{self.path}: the model bundle has no training statistics.')
+        return [dict(zip(self.npz[f'stats_{table}_keys'].tolist(), self.npz[f'stats_{table}']))
+                for table in STATS_TABLES]
+
+    def close(self):
+        self.npz.close()
+
+
+# Opens a model bundle, reusing the one already open for the same file (the feature map and both
+# layers usually come from the same bundle).
+def open_bundle(path):
+    return __open_bundle__(os.path.abspath(path), os.stat(path).st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=4)
+def __open_bundle__(path, mtime_ns):
+    return ModelBundle(path)
+
+
+# Model loaders: pickle path, or model bundle path (.npz).
+def load_feature_map(path):
+    if path.endswith('.npz'):
+        return open_bundle(path).feature_map()
+    with open(path, 'rb') as f_fm:
+        return pickle.load(f_fm)
+
+
+def load_ensemble_layer(path):
+    if path.endswith('.npz'):
+        return open_bundle(path).ensemble_layer()
+    with open(path, 'rb') as f_el:
+        return pickle.load(f_el)
+
+
+def load_output_layer(path):
+    if path.endswith('.npz'):
+        return open_bundle(path).output_layer()
+    with open(path, 'rb') as f_ol:
+        return pickle.load(f_ol)
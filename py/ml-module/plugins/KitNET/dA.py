@@ -105,6 +105,40 @@ class DA:
         self.vbias += self.params.lr * L_vbias
         return numpy.sqrt(numpy.mean(L_h2 ** 2))  # the RMSE reconstruction error during training
 
+    # Mini-batch train(): one gradient step for the rows of X (N x n_visible).
+    # The norms are updated with the whole batch before normalizing it, and the step is the mean of
+    # the per-sample gradients, with the same learning rate (summed gradients make the step N times
+    # larger, and the autoencoders diverge). With N = 1 this is train().
+    # Returns the training RMSE of each row.
+    def train_batch(self, X):
+        self.n = self.n + len(X)
+        # update norms
+        self.norm_max = numpy.maximum(self.norm_max, X.max(axis=0))
+        self.norm_min = numpy.minimum(self.norm_min, X.min(axis=0))
+
+        # 0-1 normalize
+        X = (X - self.norm_min) / (self.norm_max - self.norm_min + 0.0000000000000001)
+
+        if self.params.corruption_level > 0.0:
+            tilde_X = self.get_corrupted_input(X, self.params.corruption_level)
+        else:
+            tilde_X = X
+        Y = self.get_hidden_values(tilde_X)
+        Z = self.get_reconstructed_input(Y)
+
+        L_h2 = X - Z
+        L_h1 = numpy.dot(L_h2, self.W) * Y * (1 - Y)
+
+        L_vbias = L_h2.sum(axis=0)
+        L_hbias = L_h1.sum(axis=0)
+        L_W = numpy.dot(tilde_X.T, L_h1) + numpy.dot(L_h2.T, Y)
+
+        lr = self.params.lr / len(X)
+        self.W += lr * L_W
+        self.hbias += lr * L_hbias
+        self.vbias += lr * L_vbias
+        return numpy.sqrt(numpy.mean(L_h2 ** 2, axis=1))  # the RMSE reconstruction errors during training
+
     def reconstruct(self, x):
         y = self.get_hidden_values(x)
         z = self.get_reconstructed_input(y)
@@ -120,5 +154,15 @@ class DA:
             rmse = numpy.sqrt(((x - z) ** 2).mean())  # MSE
             return rmse
 
+    # Batched execute(): returns the RMSE of the reconstruction of each row of X (N x n_visible).
+    def execute_batch(self, X):
+        if self.n < self.params.gracePeriod:
+            return numpy.zeros(len(X))
+        else:
+            # 0-1 normalize
+            X = (X - self.norm_min) / (self.norm_max - self.norm_min + 0.0000000000000001)
+            Z = self.reconstruct(X)
+            return numpy.sqrt(((X - Z) ** 2).mean(axis=1))
+
     def in_grace(self):
         return self.n < self.params.gracePeriod
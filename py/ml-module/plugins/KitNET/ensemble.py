@@ -0,0 +1,50 @@
+import numpy as np
+from scipy.special import expit
+
+
+# Fused execution engine for a trained KitNET ensemble layer.
+# The autoencoders of the ensemble are packed into a single block-diagonal autoencoder:
+# the feature map becomes one gather permutation, the weights of all autoencoders one
+# block-diagonal matrix, and the per-autoencoder RMSEs one product with a group mean matrix.
+# The engine is a snapshot of the weights: it must be rebuilt if the ensemble trains further.
+class FusedEnsemble:
+    def __init__(self, feature_map, ensemble_layer, output_layer):
+        sizes   = [len(ad_map) for ad_map in feature_map]
+        hidden  = [ae.params.n_hidden for ae in ensemble_layer]
+        n_vis   = sum(sizes)
+        n_hid   = sum(hidden)
+
+        self.perm       = np.concatenate([np.asarray(ad_map, dtype=np.int64) for ad_map in feature_map])
+        self.norm_min   = np.concatenate([ae.norm_min for ae in ensemble_layer])
+        self.norm_range = np.concatenate([ae.norm_max - ae.norm_min for ae in ensemble_layer]) + \
+            0.0000000000000001
+        self.hbias      = np.concatenate([ae.hbias for ae in ensemble_layer])
+        self.vbias      = np.concatenate([ae.vbias for ae in ensemble_layer])
+
+        self.W          = np.zeros((n_vis, n_hid))
+        self.W_prime    = np.zeros((n_hid, n_vis))
+        self.group_mean = np.zeros((n_vis, len(sizes)))
+
+        vis = hid = 0
+        for a, ae in enumerate(ensemble_layer):
+            self.W[vis:vis + sizes[a], hid:hid + hidden[a]]         = ae.W
+            self.W_prime[hid:hid + hidden[a], vis:vis + sizes[a]]   = ae.W_prime
+            self.group_mean[vis:vis + sizes[a], a]                  = 1 / sizes[a]
+            vis += sizes[a]
+            hid += hidden[a]
+
+        # Autoencoders still in their grace period score 0 (see DA.execute).
+        self.in_grace       = np.array([ae.in_grace() for ae in ensemble_layer])
+        self.output_layer   = output_layer
+
+    # Returns the anomaly scores of the instances X (N x n).
+    def execute(self, X):
+        x = (X[:, self.perm] - self.norm_min) / self.norm_range
+        y = expit(np.dot(x, self.W) + self.hbias)
+        z = expit(np.dot(y, self.W_prime) + self.vbias)
+
+        S_l1 = np.sqrt(np.dot((x - z) ** 2, self.group_mean))
+        if self.in_grace.any():
+            S_l1[:, self.in_grace] = 0.0
+
+        return self.output_layer.execute_batch(S_l1)
@@ -1,5 +1,4 @@
 import numpy
-from scipy.stats import norm
 
 numpy.seterr(all='ignore')
 
@@ -10,6 +9,7 @@ def pdf(x, mu, sigma):  # normal distribution pdf
 
 
 def inv_log_cdf(x, mu, sigma):  # normal distribution cdf
+    from scipy.stats import norm  # scipy.stats is slow to import: only loaded here.
     x = (x - mu) / sigma
     return norm.logcdf(-x)  # note: we multiple by -1 after normalization to better get the 1-cdf
 
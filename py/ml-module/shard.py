@@ -0,0 +1,129 @@
+import zlib
+import time
+import multiprocessing
+import numpy as np
+from peregrine import Peregrine
+from metrics import METRICS
+
+# Sharded controller.
+# Feature records are partitioned by source IP across worker processes, each running its own
+# Peregrine instance: all the statistics keys (mac/ip_src, ip_src, ip_src/ip_dst, 5-tuple)
+# start with the source IP, so every flow is owned by a single worker, which keeps the only
+# copy of its statistics that gets updated. The trained KitNET model is loaded read-only by
+# every worker, so sharding requires execute-mode (previously trained EL and OL models).
+# Each worker snapshots its own state (to snapshot_path.<worker>), so a snapshot can only be
+# restored with the same number of workers.
+# The flow_table and kitnet stages are timed in the workers, whose metrics are not exported: the
+# dispatcher only times whole batches (shards stage, see metrics.py).
+
+STAGE_SHARDS = METRICS.stage('shards')
+
+
+# Worker shard of a source IP (integer). crc32 spreads consecutive addresses across the shards.
+def shard_of(ip_src, n_shards):
+    return zlib.crc32(ip_src.to_bytes(4, 'big')) % n_shards
+
+
+# Worker loop: builds Peregrine, then processes the sub-batches (records, times) sent by the
+# dispatcher until None (or returns its flow table metrics, on 'flow_stats').
+def __worker__(conn, peregrine_args):
+    peregrine = Peregrine(*peregrine_args)
+    conn.send(None)
+
+    while True:
+        batch = conn.recv()
+        if batch is None:
+            peregrine.close()
+            conn.send(None)
+            break
+        if batch == 'flow_stats':
+            conn.send(peregrine.flow_stats())
+            continue
+        conn.send(np.asarray(peregrine.proc_batch(*batch), dtype=np.float64))
+
+    conn.close()
+
+
+class ShardedPeregrine:
+    # Same batch interface as Peregrine (proc_batch), backed by n_workers processes.
+    # The arguments after n_workers are the Peregrine ones.
+    def __init__(self, n_workers, fm_grace, ad_grace, max_autoencoder_size=10, learning_rate=0.1,
+                 hidden_ratio=0.75, lambdas=4, fm_model=None, el_model=None, ol_model=None,
+                 train_stats=None, attack='', train_batch=1, flow_capacity=0, flow_timeout=0,
+                 snapshot_path=None, snapshot_interval=0, stats_history=0):
+        if fm_model is None or el_model is None or ol_model is None:
+            raise ValueError('Sharding requires previously trained FM, EL and OL models.')
+
+        self.n_workers  = n_workers
+        self.fm_grace   = fm_grace
+        self.ad_grace   = ad_grace
+        self.shard_cnt  = [0] * n_workers   # Records processed by each worker.
+
+        peregrine_args = (fm_grace, ad_grace, max_autoencoder_size, learning_rate, hidden_ratio,
+                          lambdas, fm_model, el_model, ol_model, train_stats, attack, train_batch,
+                          flow_capacity, flow_timeout)
+
+        ctx         = multiprocessing.get_context('fork')
+        self.conns  = []
+        self.procs  = []
+        for w in range(n_workers):
+            worker_snapshot = f'{snapshot_path}.{w}' if snapshot_path else None
+            worker_args     = peregrine_args + (worker_snapshot, snapshot_interval, stats_history)
+            conn, worker_conn = ctx.Pipe()
+            proc = ctx.Process(target=__worker__, args=(worker_conn, worker_args), daemon=True)
+            proc.start()
+            worker_conn.close()
+            self.conns.append(conn)
+            self.procs.append(proc)
+
+        # Wait for all the workers to load their models.
+        for conn in self.conns:
+            conn.recv()
+
+    # Processes a batch of records (and their times, see Peregrine.proc_batch) across the workers.
+    # Returns the list of scores, in the order of the records (so alerts keep the per-flow order).
+    def proc_batch(self, records, times=None):
+        start   = time.perf_counter_ns()
+        shards  = [[] for _ in range(self.n_workers)]
+        for i, cur_stats in enumerate(records):
+            shards[shard_of(cur_stats[1], self.n_workers)].append(i)
+
+        # Dispatch all the sub-batches first, so the workers run concurrently.
+        for conn, idx in zip(self.conns, shards):
+            if idx:
+                conn.send(([records[i] for i in idx],
+                           [times[i] for i in idx] if times is not None else None))
+
+        rmse = np.zeros(len(records))
+        for w, (conn, idx) in enumerate(zip(self.conns, shards)):
+            if idx:
+                rmse[idx] = conn.recv()
+                self.shard_cnt[w] += len(idx)
+
+        STAGE_SHARDS.observe(time.perf_counter_ns() - start, len(records))
+        return rmse.tolist()
+
+    # Flow table metrics (see Peregrine.flow_stats), summed over the workers.
+    def flow_stats(self):
+        for conn in self.conns:
+            conn.send('flow_stats')
+        worker_stats = [conn.recv() for conn in self.conns]
+
+        flow_stats = {}
+        for table in worker_stats[0]:
+            stats = {name: sum(ws[table][name] for ws in worker_stats) for name in worker_stats[0][table]}
+            stats['occupancy'] = stats['flows'] / stats['capacity'] if stats['capacity'] > 0 else 0.0
+            flow_stats[table] = stats
+        return flow_stats
+
+    # Stops the workers, once they have written their final snapshot.
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+        for conn in self.conns:
+            conn.recv()
+            conn.close()
+        for proc in self.procs:
+            proc.join()
+
+        print('Shards: records per worker', self.shard_cnt)